@@ -1,6 +1,9 @@
 # This stimulates using the given parameters
 # 
 from __future__ import division
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
 		
 def plotSampleWaveform(amp=0.1,freq=25,pw=200,ipd=50,npulse=15,sr=24414.0625):
     ##############################################################################################################
@@ -12,7 +15,7 @@ def plotSampleWaveform(amp=0.1,freq=25,pw=200,ipd=50,npulse=15,sr=24414.0625):
     import csv
     import sys
     import platform
-    from scipy import signal
+    from stimbuffer import constant_rate_pulser, pulse_train
     import matplotlib.pyplot as plt
     import time
 
@@ -70,30 +73,15 @@ def plotSampleWaveform(amp=0.1,freq=25,pw=200,ipd=50,npulse=15,sr=24414.0625):
         wf = np.append(wf,0) # ensure that last sample is zero
         return wf
 
-
-    def constant_rate_pulser(f, dur, sr):
-
-        ipis = np.floor(sr/f)
-        durs = np.floor(dur*sr)
-
-        pt = np.zeros(int(durs))
-        for i in range(0, int(durs-ipis),int(ipis)):
-            pt[i] = 1
-
-        return pt
-
     def MakeStimBuffer(params):
         #print params
         # %% generate the biphasic waveform
         wf = biphasic_waveform(params["amp"], params["pw"],params['ipd'],params['sr'])
         #print wf
         # %% generate the train for the test block
-        # % create the 30Hz train
+        # % create the 30Hz train (only needed for the plot) and place the pulse at every onset
         ptTest = constant_rate_pulser(params["freq"], params["duration_test"],params['sr'])
-        #plt.plot(ptTest)
-        yTest = signal.convolve(ptTest, wf)
-        ypad = np.zeros(10) # add a small pad to beginning of buffer
-        yTest = np.concatenate((ypad, yTest),axis=0)
+        yTest = pulse_train(wf, params["freq"], params["duration_test"], sr=params['sr'], pad=10)
         # %% generate the buffer
         # buf = np.zeros((params["nchan"],len(yTest)))
         # buf[1,:] = np.tile(yTest,[1,1])
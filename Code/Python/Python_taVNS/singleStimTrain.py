@@ -1,139 +1,114 @@
 # This stimulates using the given parameters
 # 
+# The DAQ is found and set up on the first call and then kept open (see taVNS_common/stimulator.py),
+# so repeated calls only write the new buffer and start the committed task. Call
+# close_stimulator() when done; it is also called at exit and leaves the output at 0 V.
 from __future__ import division
-		
+import os
+import sys
+import atexit
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+import numpy as np
+from stimbuffer import pulse_train
+from stimulator import Stimulator
+
+
+##############################################################################################################
+##############################################################################################################
+#	tVNS Setup
+##############################################################################################################
+##############################################################################################################
+
+def biphasic_waveform(amp, pw, ipd, sr):
+# %
+# % amp [uA]        +----+
+# % pw  [us]        |    |
+# % ipd [us]        |    |
+# %                 |    |
+# % -------+    +---+    +-------
+# %        |    | \
+# % (amp)--|    |  (ipd)
+# %        |    |
+# %        +----+
+# %           \
+# %            (pw)
+# %
+# % ipd defaults to 0 us
+# % sr defaults 24414.0625 Hz
+
+# duration of a single pulse cycle is 
+# pw*2+ipd
+
+    # set divisor based on sampling rate
+    if sr < 1000:
+        divisor = 1e4
+    elif (sr >=1000) and (sr < 9999):
+        divisor = 1e5
+    elif (sr >= 10000) and (sr < 99999):
+        divisor = 1e6
+    elif sr >= 100000:
+        divisor = 1e7
+    
+    # get pulse width and ipd in samples for a given sampling rate
+    pws = np.ceil(pw*sr/divisor) 
+    ipds = np.ceil(ipd*sr/divisor)
+
+    # generate waveform
+    wf = np.zeros(int(pws*2+ipds))
+    wf[0:int(pws)] = -amp
+    wf[-int(pws):] = amp
+    wf = np.append(wf,0) # ensure that last sample is zero
+    return wf
+
+
+def MakeStimBuffer(params):
+    #print params
+    # %% generate the biphasic waveform
+    wf = biphasic_waveform(params["amp"], params["pw"],params['ipd'],params['sr'])
+    #print wf
+    # %% generate the train for the test block
+    # % place the pulse at every onset of the train (same buffer as convolving the pulse train with wf)
+    # % and add a small pad to beginning of buffer
+    yTest = pulse_train(wf, params["freq"], params["duration_test"], sr=params['sr'], pad=10)
+    # %% generate the buffer
+    # buf = np.zeros((params["nchan"],len(yTest)))
+    # buf[1,:] = np.tile(yTest,[1,1])
+
+    return yTest
+
+
+stimulator = None
+
+def get_stimulator(sr=24414.0625):
+    # open the DAQ session on first use (and reopen it if the sampling rate changes)
+    global stimulator
+    if stimulator is not None and stimulator.defaults['sr'] != sr:
+        close_stimulator()
+    if stimulator is None:
+        stimulator = Stimulator(MakeStimBuffer, {"sr":sr, "pw":200, 'ipd':50, "freq":25, 'npulse':15})
+    return stimulator
+
+
+def close_stimulator():
+    global stimulator
+    if stimulator is not None:
+        stimulator.close()
+        stimulator = None
+
+atexit.register(close_stimulator)
+
+
 def singleStimTrain(amp=0.1,freq=25,pw=200,ipd=50,npulse=15,sr=24414.0625, plot=0):
-    ##############################################################################################################
-    ##############################################################################################################
-    #   Import statements: Do not change
-    ##############################################################################################################
-    ##############################################################################################################
-    import numpy as np
-    import csv
-    import sys
-    import platform
-    import nidaqmx
-    from nidaqmx import constants
-    from nidaqmx.stream_writers import AnalogSingleChannelWriter
-    from scipy import signal
-    import matplotlib.pyplot as plt
-    import time
-
-
-    params = {}
-    params.update({"sr":sr, "amp":amp, "freq":freq, "pw":pw, 'ipd':ipd, 'npulse':npulse})
-    params.update({"duration_test":params['npulse']/params["freq"]})
 
-    
-    ##############################################################################################################
-    ##############################################################################################################
-    #	tVNS Setup
-    ##############################################################################################################
-    ##############################################################################################################
-
-    system = nidaqmx.system.System.local()
-    system.driver_version
-
-    for device in system.devices:
-        print(device)
-
-   
-    def biphasic_waveform(amp, pw, ipd, sr):
-    # %
-    # % amp [uA]        +----+
-    # % pw  [us]        |    |
-    # % ipd [us]        |    |
-    # %                 |    |
-    # % -------+    +---+    +-------
-    # %        |    | \
-    # % (amp)--|    |  (ipd)
-    # %        |    |
-    # %        +----+
-    # %           \
-    # %            (pw)
-    # %
-    # % ipd defaults to 0 us
-    # % sr defaults 24414.0625 Hz
-
-    # duration of a single pulse cycle is 
-    # pw*2+ipd
-
-        # set divisor based on sampling rate
-        if sr < 1000:
-            divisor = 1e4
-        elif (sr >=1000) and (sr < 9999):
-            divisor = 1e5
-        elif (sr >= 10000) and (sr < 99999):
-            divisor = 1e6
-        elif sr >= 100000:
-            divisor = 1e7
-        
-        # get pulse width and ipd in samples for a given sampling rate
-        pws = np.ceil(pw*sr/divisor) 
-        ipds = np.ceil(ipd*sr/divisor)
-
-        # generate waveform
-        wf = np.zeros(int(pws*2+ipds))
-        wf[0:int(pws)] = -amp
-        wf[-int(pws):] = amp
-        wf = np.append(wf,0) # ensure that last sample is zero
-        return wf
-
-    def constant_rate_pulser(f, dur, sr):
-
-        ipis = np.floor(sr/f)
-        durs = np.floor(dur*sr)
-
-        pt = np.zeros(int(durs))
-        for i in range(0, int(durs-ipis),int(ipis)):
-            pt[i] = 1
-
-        return pt
-
-
-    def MakeStimBuffer(params):
-        #print params
-        # %% generate the biphasic waveform
-        wf = biphasic_waveform(params["amp"], params["pw"],params['ipd'],params['sr'])
-        #print wf
-        # %% generate the train for the test block
-        # % create the 30Hz train
-        ptTest = constant_rate_pulser(params["freq"], params["duration_test"],params['sr'])
-        #plt.plot(ptTest)
-        yTest = signal.convolve(ptTest, wf)
-        ypad = np.zeros(10) # add a small pad to beginning of buffer
-        yTest = np.concatenate((ypad, yTest),axis=0)
-        # %% generate the buffer
-        # buf = np.zeros((params["nchan"],len(yTest)))
-        # buf[1,:] = np.tile(yTest,[1,1])
-
-        return yTest
-
-
-    global task
-    with nidaqmx.Task() as task:
-        
-        # Make stim buffer
-        buf = MakeStimBuffer(params)
-        buf_time = np.arange(0,len(buf))/params['sr']
-
-
-        task.ao_channels.add_ao_voltage_chan("Dev1/ao1") # check output channel on DAQ
-        #task.timing.cfg_samp_clk_timing(rate=params["sr"],samps_per_chan=len(buf))
-        task.timing.cfg_samp_clk_timing(rate=params["sr"],
-                                        sample_mode=constants.AcquisitionType.FINITE,  # FINITE or CONTINUOUS
-                                        samps_per_chan=len(buf))
-        writer = AnalogSingleChannelWriter(task.out_stream)
-        # Stimulate
-
-        #task.write(list(buf), auto_start=True) # I think this should work...
-        writer.write_many_sample(buf)
-        start_time = time.time()
-        task.start()
-        task.wait_until_done(10)
-        task.stop()
-        print("--- %s seconds ---" % (time.time() - start_time))
+    stim = get_stimulator(sr)
+
+    # Stimulate
+    timing = stim.fire(amp=amp, freq=freq, pw=pw, ipd=ipd, npulse=npulse)
+    print("--- %s seconds ---" % (timing.t_stopped - timing.t_request))
 
     if plot:
+        import matplotlib.pyplot as plt
+        buf = stim.last
+        buf_time = np.arange(0,len(buf))/sr
         plt.plot(buf_time,buf)
         plt.show()
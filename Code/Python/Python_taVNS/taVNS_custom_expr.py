@@ -1,11 +1,16 @@
 from __future__ import division
 from time import perf_counter
-import random
 import numpy as np
 #import csv
 import sys
+import os
 #import platform
-from scipy import signal
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+from stimbuffer import pulse_train, biphasic_triangular_waveform
+from stimschedule import compile_schedule, StreamingOutput
+from sartplan import new_seed
+from deadline import DeadlineScheduler
+from datetime import datetime
 import matplotlib.pyplot as plt
 from easygui import *
 
@@ -57,80 +62,6 @@ def biphasic_waveform(amp, pw, ipd, sr):
     wf = np.append(wf,0) # ensure that last sample is zero
     return wf
 
-def biphasic_triangular_waveform(amp, pw, ipd, sr):
-# %
-# % amp [uA]        +----+
-# % pw  [us]        |    |
-# % ipd [us]        |    |
-# %                 |    |
-# % -------+    +---+    +-------
-# %        |    | \
-# % (amp)--|    |  (ipd)
-# %        |    |
-# %        +----+
-# %           \
-# %            (pw)
-# %
-# % ipd defaults to 0 us
-# % sr defaults 24414.0625 Hz
-
-# duration of a single pulse cycle is 
-# pw*2+ipd
-
-    # set divisor based on sampling rate
-    if sr < 1000:
-        divisor = 1e4
-    elif (sr >=1000) and (sr < 9999):
-        divisor = 1e5
-    elif (sr >= 10000) and (sr < 99999):
-        divisor = 1e6
-    elif sr >= 100000:
-        divisor = 1e7
-    
-    # get pulse width and ipd in samples for a given sampling rate
-    pws = np.ceil(pw*sr/divisor) 
-    ipds = np.ceil(ipd*sr/divisor)
-
-    # generate waveform
-    wf = np.zeros(int(pws*2+ipds))
-    halfwave_length = len(wf[0:int(pws)])
-    print(pws)
-    # still need to fix this
-    if  pws==2:
-        neg_waveform = np.array([0, -amp])
-        pos_waveform = np.array([amp, 0])       
-    elif pws==1:
-        neg_waveform = np.array([-amp])
-        pos_waveform = np.array([amp])
-    elif halfwave_length%2==0: # if even number of samples, then triangle will not be equal
-        neg_waveform1 = np.linspace(0,-amp,round(pws/2)) # create the first part, going to maximum amplitude
-        neg_waveform2 = np.linspace(neg_waveform1[-2],0,round(pws/2)) # create the second part, based on first
-        neg_waveform = np.concatenate((neg_waveform1,neg_waveform2))
-        pos_waveform1 = np.linspace(0,amp,round(pws/2))
-        pos_waveform2 = np.linspace(pos_waveform1[-2],0,round(pws/2))
-        pos_waveform = np.concatenate((pos_waveform1,pos_waveform2))  
-    else:
-        neg_waveform = np.concatenate([np.linspace(0,-amp, np.ceil(pws/2).astype(int))[0:-1],np.array([-amp]),np.linspace(-amp,0, np.floor(pws/2+1).astype(int))[1:]])
-        pos_waveform = np.concatenate([np.linspace(0,amp, np.ceil(pws/2).astype(int))[0:-1],np.array([amp]),np.linspace(amp,0, np.floor(pws/2+1).astype(int))[1:]])
-
-
-    wf[0:int(pws)] = neg_waveform
-    wf[-int(pws):] = pos_waveform
-    wf = np.append(wf,0) # ensure that last sample is zero
-    return wf
-    
-
-def constant_rate_pulser(f, dur, sr):
-
-    ipis = np.floor(sr/f)
-    durs = np.floor(dur*sr)
-
-    pt = np.zeros(int(durs))
-    for i in range(0, int(durs-ipis),int(ipis)):
-        pt[i] = 1
-
-    return pt
-
 def MakeStimBuffer(params):
     #print params
     # %% generate the biphasic waveform
@@ -147,12 +78,9 @@ def MakeStimBuffer(params):
             wf = biphasic_triangular_waveform(params["amp"], params["pw"],params['ipd'],params['sr'])
         #print wf
         # %% generate the train for the test block
-        # % create the 30Hz train
-        ptTest = constant_rate_pulser(params["freq"], params["duration_stim"],params['sr'])
-        #plt.plot(ptTest)
-        yTest = signal.convolve(ptTest, wf)
-        ypad = np.zeros(10) # add a small pad to beginning of buffer
-        yTest = np.concatenate((ypad, yTest),axis=0)
+        # % place the pulse at every onset of the train (same buffer as convolving the pulse train with wf)
+        # % and add a small pad to beginning of buffer
+        yTest = pulse_train(wf, params["freq"], params["duration_stim"], sr=params['sr'], pad=10)
     # %% generate the buffer
     # buf = np.zeros((params["nchan"],len(yTest)))
     # buf[1,:] = np.tile(yTest,[1,1])
@@ -168,8 +96,8 @@ def get_expr_params():
     title = "taVNS Experiment"
     fieldNames = ["Experiment Duration (seconds)","Inter-trial-interval (seconds) [interval]","Stim Duration (seconds)",
         "Amplitude (mA)","Frequency (Hz)","Pulse Width (microseconds)","Inter-pulse-distance (microseconds)",'Debug (no stim, 0 or 1)',
-        'Waveform shape (square,sine,triangle']
-    fieldValues = [5, [2,2.5],0.5,1,30,100,50,1,'square']  # we start with blanks for the values
+        'Waveform shape (square,sine,triangle','Random seed for ITIs (number, or random)']
+    fieldValues = [5, [2,2.5],0.5,1,30,100,50,1,'square','random']  # we start with blanks for the values
     fieldValues = multenterbox(msg,title, fieldNames, fieldValues)
     
 
@@ -197,11 +125,16 @@ def get_expr_params():
     ipd = float(fieldValues[6])
     debug = int(fieldValues[7])
     waveshape = fieldValues[8]
+    seed = fieldValues[9].strip()
+    if seed.isdigit():
+        seed = int(seed)
+    else:
+        seed = new_seed() # draw one from np.random, so it can be saved with the schedule (and seeding np.random fixes it)
 
     params = {}
     params.update({'duration_expr':duration_expr,'iti':iti,"duration_stim":duration_stim})
     params.update({"sr":44100, "amp":amp, "freq":freq, "pw":pw,'ipd':ipd})
-    params.update({'debug':debug,'waveshape':waveshape})
+    params.update({'debug':debug,'waveshape':waveshape,'seed':seed})
 
     buf = MakeStimBuffer(params)
     buf_time = np.arange(0,len(buf))/params['sr']
@@ -224,94 +157,49 @@ def get_expr_params():
 
 params = get_expr_params()
 
+# Make stim buffer and compile the whole session: all ITIs are drawn up front and every stim
+# onset is placed on the sample clock of one continuously running task
+buf = MakeStimBuffer(params)
+schedule = compile_schedule(params['duration_expr'], params['iti'], params['duration_stim'], buf,
+    params['sr'], seed=params['seed'])
+schedule_file = 'taVNS_schedule_{}.csv'.format(datetime.now().strftime('%Y%m%d_%H%M%S'))
+schedule.save(schedule_file)
+print('{} stim periods over {:.1f} seconds (seed {}), schedule saved to {}\n'.format(
+    len(schedule), schedule.duration, params['seed'], schedule_file))
+
 if not params['debug']:
-    import nidaqmx
-    from nidaqmx import constants
-    from nidaqmx.stream_writers import AnalogSingleChannelWriter
+    import daq
+    from daq import nidaqmx, AnalogSingleChannelWriter # nidaqmx, or simdaq with TAVNS_SIMULATE_DAQ=1
     system = nidaqmx.system.System.local()
     system.driver_version
 
     global task
     with nidaqmx.Task() as task:
-        # Make stim buffer
-        buf = MakeStimBuffer(params)
-        buf_time = np.arange(0,len(buf))/params['sr']
-
         task.ao_channels.add_ao_voltage_chan("Dev1/ao1") # check output channel on DAQ
-        #task.timing.cfg_samp_clk_timing(rate=params["sr"],samps_per_chan=len(buf))
-        task.timing.cfg_samp_clk_timing(rate=params["sr"],
-                                        sample_mode=constants.AcquisitionType.FINITE,  # FINITE or CONTINUOUS
-                                        samps_per_chan=len(buf))
         writer = AnalogSingleChannelWriter(task.out_stream)
 
-
-        # Start the stopwatch / counter
+        # stream the schedule in fixed size chunks (configures the task as CONTINUOUS)
+        output = StreamingOutput(task, writer, schedule)
         expr_start = perf_counter()
-        expr_stop = perf_counter()-expr_start
-
-        # run the experiment for the target duration
-        while expr_stop < params['duration_expr']:
-
-            # get stim duration
-            duration_stim = params['duration_stim']
-            stim_start = perf_counter()
-            stim_stop = perf_counter()-stim_start
-            while stim_stop < duration_stim:
-
-                # add stim code here
-                print('stimulating...\n')
-                writer.write_many_sample(buf)
-                start_time = time.time()
-                task.start()
-                task.wait_until_done(10)
-                task.stop()
-                stim_stop = perf_counter()-stim_start
-            print("--- %s seconds ---" % (stim_stop))
-
-
-            # get inter-trial-interval
-            if len(params['iti']) == 1:
-                iti = params['iti']
-            elif len(params['iti']) == 2:
-                iti = random.random()*(params['iti'][1]-params['iti'][0])+params['iti'][0]
+        output.run()
+        print("--- %s seconds ---" % (perf_counter()-expr_start))
 
-            iti_start = perf_counter()
-            iti_stop = perf_counter()-iti_start
-            while iti_stop < iti:
-                iti_stop = perf_counter()-iti_start
-
-
-            # Stop the stopwatch / counter
-            expr_stop = perf_counter()-expr_start
+    # summary of the emitted trains when running against the simulated DAQ
+    daq.report()
 else:
-    # run a fake experiment
-
-    # Start the stopwatch / counter
-    expr_start = perf_counter()
-    expr_stop = perf_counter()-expr_start
-
-    # run the experiment for the target duration
-    while expr_stop < params['duration_expr']:
-
-        # get stim duration
-        duration_stim = params['duration_stim']
-        stim_start = perf_counter()
-        stim_stop = perf_counter()-stim_start
-        while stim_stop < duration_stim:
-            print('fake stimulation...\n')
-            stim_stop = perf_counter()-stim_start
-
-        # get inter-trial-interval
-        if len(params['iti']) == 1:
-            iti = params['iti']
-        elif len(params['iti']) == 2:
-            iti = random.random()*(params['iti'][1]-params['iti'][0])+params['iti'][0]
+    # run a fake experiment on the same schedule; the waits sleep until just before each onset
+    # instead of spinning, and the deadlines are measured from the session start
+    clock = DeadlineScheduler()
+    clock.start()
+    stim_times = schedule.onset_times()
+    duration_stim = len(schedule.block)/schedule.sr
+    for onset, iti in zip(stim_times, schedule.itis):
+        clock.wait_until(onset, 'stim')
+        print('fake stimulation...\n')
+        clock.wait_until(onset+duration_stim, 'iti')
         print('%f...\n' % iti)
-        iti_start = perf_counter()
-        iti_stop = perf_counter()-iti_start
-        while iti_stop < iti:
-            iti_stop = perf_counter()-iti_start
-
+    clock.wait_until(schedule.duration, 'end')
 
-        # Stop the stopwatch / counter
-        expr_stop = perf_counter()-expr_start
+    print("--- %s seconds ---" % clock.elapsed())
+    print('\nlateness of the fake events (ms):')
+    print(clock.report())
@@ -209,6 +209,11 @@ import csv
 from datetime import date,datetime
 import sys
 import platform
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+from frametrial import FrameTrialScheduler, preflight, flag_soa, save_display_check
+from digitcache import DigitStimCache
+from datasink import TrialDataSink
 
 ##############################################################################################################
 ##############################################################################################################
@@ -450,11 +455,8 @@ defaults = {'minimumversion':"5.0.5.0",
 
 # initialize clocks and wait times for experiment
 globalClock = core.Clock()
-trialClock = core.Clock() 
 logging.setDefaultClock(globalClock)
 
-waitperiod = core.StaticPeriod()
-
 ##############################################################################################################
 ##############################################################################################################
 #	INCLUDE
@@ -492,7 +494,8 @@ data = {'columns':('build','computer.platform','date','time','subject','group','
 'parameters.maskpresentationtime','values.trialtype','values.digit','values.fontsize','response','correct',
 'values.RT','latency','values.latencytype','values.responsetype','values.count_anticipatory',
 'values.correctsuppressions','values.count_NoGo','values.incorrectsuppressions','values.count_Go',
-'values.count_validGo','values.countprobes','radiobuttons.difficulty.response','radiobuttons.interest.response'),
+'values.count_validGo','values.countprobes','radiobuttons.difficulty.response','radiobuttons.interest.response',
+'values.soa','values.digitduration','values.maskduration','values.maxframeinterval','values.droppedframes'),
 'separatefiles':True
 }
 # /columns = (date, time, subject, group, blockcode, blocknum, trialcode, trialnum, expressions.trialcount,
@@ -763,6 +766,20 @@ digit.autoDraw = False  # Automatically draw every frame
 fixation = visual.ImageStim(mywin,image=mask,units='height',size=0.2)
 fixation.height = 0.2
 
+# one pre-rendered digit per (digit, fontsize) pair, drawn once so the textures are uploaded before the first trial
+digit_stims = DigitStimCache(mywin, expr_fontsizes['items'], font=defaults['fontstyle'], units='height', color=(1,1,1))
+digit_stims.warm(fixation)
+
+# display pre-flight: refresh interval and jitter over a run of blank frames, before the practice block
+display_check = preflight(mywin)
+print(display_check)
+
+# digit and mask durations in whole frames of the measured refresh rate, keys polled every frame
+frame_scheduler = FrameTrialScheduler(mywin, parameters['digitpresentationtime'], parameters['maskpresentationtime'],
+    refresh=display_check.refresh)
+# psychopy only prints warnings to the console, so the display timing goes to its own file
+save_display_check('logs/G{}S{}_sart_display.txt'.format(group,subject), display_check, frame_scheduler)
+
 # <picture mask>
 # /items = mask
 # /select = 1
@@ -867,10 +884,9 @@ def update_index(target):
     return target
 
 def createdata(suffix=''):
-    # open files, write headers, close
-    raw_data_log = open('logs/G{}S{}_sart_log{}.csv'.format(group,subject,suffix),'w')
-    raw_data_writer = csv.writer(raw_data_log)
-    raw_data_writer.writerow(data['columns'])
+    # open the data file and write the header; rows are written in batches by a background thread
+    # (the sink is flushed and closed at the end of the block, or at exit when the task is quit)
+    raw_data_writer = TrialDataSink('logs/G{}S{}_sart_log{}.csv'.format(group,subject,suffix),data['columns'])
 
     return raw_data_writer
 
@@ -887,6 +903,26 @@ def record_summary_data(summary_data,suffix=''):
     summary_data_writer.writerow(summary_data['columns'])
     summary_data_writer.writerow(summary_data)
     summary_data_log.close()
+
+def frame_data(result):
+    # display timing columns of a trial (ms): SOA, digit and mask duration, longest frame, dropped frames
+    soa = '' if result.soa is None else round(result.soa*1000,3)
+    return [soa, round(result.digit_duration*1000,3), round(result.mask_duration*1000,3),
+        round(result.max_interval()*1000,3), result.dropped_frames()]
+
+def record_timing_summary(suffix = ''):
+    # flag the trials whose digit to digit SOA deviated from ITI + digit + mask time
+    nominal = (parameters['ITI']+parameters['digitpresentationtime']+parameters['maskpresentationtime'])*1000
+    summary, flagged = flag_soa('logs/G{}S{}_sart_log{}.csv'.format(group,subject,suffix), nominal,
+        refresh=frame_scheduler.refresh)
+    with open('logs/G{}S{}_sart_timing{}.csv'.format(group,subject,suffix),'w',newline='') as f:
+        timing_writer = csv.writer(f)
+        timing_writer.writerow(('blocknum','trialnum','soa','deviation','droppedframes'))
+        timing_writer.writerows(flagged)
+    print('SOA: {} of {} trials deviated from {:.0f} ms by more than {:.1f} ms (max {:.1f} ms), mean {:.3f} ms, '
+        '{} dropped frames'.format(summary['nflagged'], summary['ntrials'], nominal, summary['tolerance'],
+        summary['max_deviation'], summary['mean_soa'], summary['dropped_frames']))
+
 #############################
 # General Helper Trial
 #############################
@@ -901,6 +937,8 @@ def getReady():
     waitForButtonPress()
     
     mywin.flip(clearBuffer=True)
+    # the first trial after this screen has no SOA
+    frame_scheduler.reset_soa()
 
 ###################################################################################################################
 ###################################################################################################################
@@ -920,50 +958,23 @@ def practice_trial():
 
         print('trialindex = {}, fontindex = {}'.format(practice_trialtype['currentindex'],practice_fontsizes['currentindex']))
 
-        # Update digit presentation text
-        digit.height = fontsize
-        digit.text = digitvalue
-
-        # Set up digit
-        digit.draw()
-
-        # wait for the inter-trial-interval
-        core.wait(pretrialpause)
+        # Pick the pre-rendered digit
+        digit_stim = digit_stims.get(digitvalue, fontsize)
 
-        # Start recording button presses
-        event.clearEvents()
-        trialClock.reset()
-                
-        # Show digit
-        mywin.flip()
-        waitperiod.start(parameters['digitpresentationtime'])  # start a period of 0.5s
-        # Draw fixation while mask is displayed 
-        fixation.draw()
-        waitperiod.complete()
-        # show mask
-        mywin.flip()
-        core.wait(parameters['maskpresentationtime'])
-        keys = event.getKeys(keyList=["q","space"],timeStamped=trialClock) # get just the first time space was pressed        print('keys are {}'.format(keys))
-
-        if len(keys) > 0:
-            keys = keys[0]
-            response = keys[0]
-            latency = round((keys[1])*1000) # convert to ms
-        else:
-            response = "0"
-            latency = 0
+        # show digit, then mask, for a fixed number of frames; keys are polled on every frame and
+        # through the inter-trial-interval that follows the mask
+        result = frame_scheduler.run(digit_stim, fixation, clear=False, iti=pretrialpause)
+        response = result.response
+        latency = round(result.rt*1000) # convert to ms
 
         # check for quit key
         if response =='q':
             mywin.close()
             core.quit()
         # record overall time
-        trialduration = trialClock.getTime()
+        trialduration = result.duration
 
-        # revert to black screen
-        mywin.flip(clearBuffer=True)
-
-        return trialtype, response, latency, trialduration, digitvalue, fontsize
+        return trialtype, response, latency, trialduration, digitvalue, fontsize, result
 
 
     def ontrialend(trialtype, response,latency):
@@ -1012,15 +1023,16 @@ def practice_trial():
         return RT, latencytype, responsetype, correct
    
    # run 
-    trialtype, response, latency, trialduration, digitvalue, fontsize = ontrialbegin()
+    trialtype, response, latency, trialduration, digitvalue, fontsize, result = ontrialbegin()
     RT, latencytype, responsetype, correct = ontrialend(trialtype, response,latency)
     print('latency was {}, latencytype was {}, RT was {}\n'.format(latency,latencytype,RT))
     print('responsetype was {}\n'.format(responsetype))
 
     if correct==0: # I invented where this should be set
         feedback()
+        frame_scheduler.reset_soa()
     
-    return trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize
+    return trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize, result
 # end Practice Go
 
 ###################################################################################################################
@@ -1058,53 +1070,24 @@ def trial():
         elif trialtype=='nogo':
             count_NoGo += 1
 
-        # Update digit presentation text
-        digit.height = fontsize
-        digit.text = digitvalue
-
-         # Set up digit
-        digit.draw()
+        # Pick the pre-rendered digit
+        digit_stim = digit_stims.get(digitvalue, fontsize)
 
-        # wait for the inter-trial-interval
-        core.wait(pretrialpause)
+        # show digit, then mask, for a fixed number of frames; keys are polled on every frame and
+        # through the inter-trial-interval that follows the mask
+        result = frame_scheduler.run(digit_stim, fixation, clear=False, iti=pretrialpause)
+        response = result.response
+        latency = round(result.rt*1000) # convert to ms
 
-        # Start recording button presses
-        event.clearEvents()
-        trialClock.reset()
-                
-        # Show digit
-        mywin.flip()
-        waitperiod.start(parameters['digitpresentationtime'])  # start a period of 0.5s
-
-        # Draw fixation while mask is displayed 
-        fixation.draw()
-        waitperiod.complete() 
-
-        # show fixation
-        mywin.flip()
-        core.wait(parameters['maskpresentationtime'])
-        keys = event.getKeys(keyList=["q","space"],timeStamped=trialClock) # get just the first time space was pressed
-
-        if len(keys) > 0:
-            keys = keys[0]
-            response = keys[0]
-            latency = round((keys[1])*1000) # convert to ms
-
-            # check for quit key
-            if response =='q':
-                mywin.close()
-                core.quit()
-        else:
-            response = "0"
-            latency = 0
+        # check for quit key
+        if response =='q':
+            mywin.close()
+            core.quit()
 
         # record overall time
-        trialduration = trialClock.getTime()
-
-        # revert to black screen
-        mywin.flip(clearBuffer=True)
+        trialduration = result.duration
 
-        return trialtype, response, latency, trialduration, digitvalue, digitvalue, fontsize
+        return trialtype, response, latency, trialduration, digitvalue, digitvalue, fontsize, result
 
     def ontrialend(trialtype, response,latency):
         # define global variables to update
@@ -1211,10 +1194,10 @@ def trial():
         return RT, latencytype, responsetype, correct
 
     # run 
-    trialtype, response, latency, trialduration, digitvalue, digitvalue, fontsize = ontrialbegin()
+    trialtype, response, latency, trialduration, digitvalue, digitvalue, fontsize, result = ontrialbegin()
     RT, latencytype, responsetype, correct = ontrialend(trialtype, response,latency)
 
-    return trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize
+    return trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize, result
     
 
 ###################################################################################################################
@@ -1233,7 +1216,7 @@ def block_practice():
     #        count_NoGo, incorrectsuppressions, count_Go, count_validGo
 
     for trx in range(len(practice_digitsequence['items'])):
-        trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize = practice_trial()
+        trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize, result = practice_trial()
         
         # apply appropriate formatting to variables
         trialcode = trialtype.lower()
@@ -1246,7 +1229,7 @@ def block_practice():
             int(parameters['digitpresentationtime']*100), int(parameters['maskpresentationtime']*100), trialtype, digitvalue, fontsize,
             response, correct, RT, latency, latencytype, responsetype, count_anticipatory,correctsuppressions, count_NoGo, 
             incorrectsuppressions, count_Go, count_validGo, 
-            0,0,0] #
+            0,0,0] + frame_data(result) #
 
             # build,computer.platform,date,time,subject,group,blockcode,blocknum,trialcode,trialnum    expressions.trialcount,
             # parameters.digitpresentationtime,parameters.maskpresentationtime,values.trialtype    values.digit,values.fontsize,
@@ -1256,6 +1239,7 @@ def block_practice():
 
         record_data(raw_data_log,trial_data)
 
+    raw_data_log.close()
     #record_summary_data()
 
     #onblockend = expr_fontsizes.reset() # so make expr_fontsizes a class? with a method reset?
@@ -1274,7 +1258,7 @@ def block_SART():
     getReady()
     raw_data_log = createdata('_expr')
     for trx in range(len(expr_digitsequence['items'])):
-        trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize = trial()
+        trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, digitvalue, fontsize, result = trial()
         
         # apply appropriate formatting to variables
         trialcode = trialtype.lower()
@@ -1287,10 +1271,12 @@ def block_SART():
             int(parameters['digitpresentationtime']*100), int(parameters['maskpresentationtime']*100), trialtype, digitvalue, fontsize,
             response, correct, RT, latency, latencytype, responsetype, count_anticipatory,correctsuppressions, count_NoGo, 
             incorrectsuppressions, count_Go, count_validGo, 
-            0,0,0] #
+            0,0,0] + frame_data(result) #
         record_data(raw_data_log,trial_data)
 
+    raw_data_log.close()
     #record_summary_data()
+    record_timing_summary('_expr')
 
 # <block SART>
 # / bgstim = (cognitiveloadsart)
@@ -5,17 +5,32 @@
 ##############################################################################################################
 ##############################################################################################################
 from __future__ import division
-from psychopy import visual, core, gui,event, logging, info
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+from startup import StartupTimer, discover_daq
+startup = StartupTimer()
+from psychopy import core, gui # the rest of psychopy is imported after the dialog
+startup.mark('import psychopy.gui')
+# the DAQ driver is imported and the devices are listed while the operator fills in the dialog
+daq_discovery = startup.background('DAQ discovery', discover_daq)
 import numpy as np
 import random
 import csv
 from datetime import date,datetime
-import sys
 import platform
-import nidaqmx
-from nidaqmx import constants
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
-from scipy import signal
+from time import perf_counter
+from stimbuffer import pulse_train, StimBufferCache
+from daqcodes import Int16Writer
+from stimcontroller import StimController, TrainDone
+from triggeredstim import TriggeredStim
+from frametrial import FrameTrialScheduler, preflight, flag_soa, save_display_check
+from digitcache import DigitStimCache
+from sartplan import compile_sart_plan, save_plan, stim_order as block_order
+from sartscore import SARTScorer, classify, score_csv, write_summary
+from datasink import TrialDataSink
+from eventlog import EventRecorder, STIM_START, STIM_STOP, STIM_ERROR
+startup.mark('import numpy, taVNS_common')
 
 ##############################################################################################################
 ##############################################################################################################
@@ -33,7 +48,10 @@ parameters = {
 'anticipatoryresponsetime' : 100,
 'validresponsetime' : 200,
 'run_mindwanderingprobe' : False,
-'postprobeduration' : 500
+'postprobeduration' : 500,
+'stimtrigger' : False, # True: preload each block's train into a retriggerable task started by a DO edge after the digit flip (the edge is written by software once the flip has returned)
+'triggerline' : 'Dev1/port0/line0', # DO line pulsed at the digit flip, cabled to triggersource
+'triggersource' : '/Dev1/PFI0' # start trigger terminal of the AO task
 }
 trialduration = parameters['digitpresentationtime'] + parameters['maskpresentationtime']
 
@@ -118,6 +136,10 @@ getReady_Params = {'items': 'Get Ready: {}'.format(expressions['buttoninstruct2'
 
 fontsizes = [0.1,0.13,0.16,0.19,0.21]
 ntrials = 225
+# digit sequence constraints: NoGo trials at least nogo_spacing trials apart, none in the first
+# nogo_free_start trials (so the first stim window is complete)
+nogo_spacing = 2
+nogo_free_start = 2
 
 ##############################################################################################################
 ##############################################################################################################
@@ -141,6 +163,10 @@ else:
     core.quit()  # the user hit cancel so exit
 subject = expInfo['subject']
 group = expInfo['group']
+startup.mark('dialog')
+
+from psychopy import visual, event, logging, info
+startup.mark('import psychopy.visual')
 
 ##############################################################################################################
 ##############################################################################################################
@@ -148,10 +174,11 @@ group = expInfo['group']
 ##############################################################################################################
 ##############################################################################################################
 
-system = nidaqmx.system.System.local()
-system.driver_version
+system, devices = startup.wait('DAQ discovery', daq_discovery)
+import daq
+from daq import nidaqmx, constants # nidaqmx, or simdaq with TAVNS_SIMULATE_DAQ=1
 
-for device in system.devices:
+for device in devices:
     print(device)
 
 def biphasic_waveform(amp, pw, ipd=0, sr=24414.0625):
@@ -166,43 +193,31 @@ def biphasic_waveform(amp, pw, ipd=0, sr=24414.0625):
     return wf
 
 
-def constant_rate_pulser(f, dur, sr=24414.0625):
-
-    ipis = np.floor(sr/f)
-    durs = np.floor(dur*sr)
-
-    pt = np.zeros(int(durs))
-    for i in range(0, int(durs-ipis),int(ipis)):
-        pt[i] = 1
-
-    return pt
-
-
 def MakeStimBuffer(params):
     #print params
     # %% generate the biphasic waveform
     wf = biphasic_waveform(params["amp"], params["pw"],ipd=50)
     #print wf
     # %% generate the train for the test block
-    # % create the 30Hz train
-    ptTest = constant_rate_pulser(params["freq"], params["duration_test"])
-    #plt.plot(ptTest)
-    yTest = signal.convolve(ptTest, wf)
-    ypad = np.zeros(100)
-    yTest = np.concatenate((ypad, yTest),axis=0)
+    # % place the pulse at every onset of the 25Hz train (same buffer as convolving the pulse train with wf)
+    yTest = pulse_train(wf, params["freq"], params["duration_test"], pad=100)
     # %% generate the buffer
     # buf = np.zeros((params["nchan"],len(yTest)))
     # buf[1,:] = np.tile(yTest,[1,1])
 
     return yTest
 
+# active and sham blocks repeat the same two buffers, so only synthesize each once
+stim_cache = StimBufferCache(MakeStimBuffer)
+
 # Create fake buffer
 params = {}
 params.update({"sr":24000.00, "freq":25, "pw":200, 'npulse':15})
 params.update({"duration_test":params['npulse']/params["freq"]}) # 15 = npulses, "pw": 15/(params["freq"]*100) <- why?
 params.update({"amp":0}) # if sham block, set stimulation amplitude to 0. 
 
-fake_buf = MakeStimBuffer(params)
+fake_buf = stim_cache.get(params)
+startup.mark('DAQ setup, stim buffer')
 ##############################################################################################################
 ##############################################################################################################
 #	DEFAULTS
@@ -221,23 +236,23 @@ defaults = {'fontstyle': 'Arial',
 
 # initialize clocks and wait times for experiment
 globalClock = core.Clock()
-trialClock = core.Clock() 
 logging.setDefaultClock(globalClock)
 
-digitperiod = core.StaticPeriod()
-maskperiod = core.StaticPeriod()
-
 # might be better to make each column a dictionary
 data = {'columns':('build','computer.platform','date','time','subject','group','blockcode','blocknum',
 'trialcode','trialnum','expressions.trialcount','parameters.digitpresentationtime',
 'parameters.maskpresentationtime','values.trialtype','values.digit','values.fontsize','response','correct',
 'values.RT','latency','values.latencytype','values.responsetype','values.count_anticipatory',
 'values.correctsuppressions','values.count_NoGo','values.incorrectsuppressions','values.count_Go',
-'values.count_validGo','values.dostim','values.amp','values.order')
+'values.count_validGo','values.dostim','values.amp','values.order',
+'values.soa','values.digitduration','values.maskduration','values.maxframeinterval','values.droppedframes')
 }
 
 
-lastLog = logging.LogFile("logs\{}_{}_tvns_sart.log".format(subject,group), level=logging.INFO, filemode='w')
+# trial events (digit/mask flips, key presses, stim start/stop) go to the binary event stream (eventlog.py,
+# read back with read_events); the text log only keeps psychopy's warnings and errors
+lastLog = logging.LogFile("logs\{}_{}_tvns_sart.log".format(subject,group), level=logging.WARNING, filemode='w')
+events = EventRecorder('logs/G{}S{}_sart_events.bin'.format(group,subject))
 ##############################################################################################################
 ##############################################################################################################
 #	VALUES: automatically updated
@@ -253,28 +268,9 @@ current_date = monthday + year[2:4]
 current_time = '{d.hour}:{d.minute}:{d.second}'.format(d = datetime.now())
 build = '{}'.format(sys.version[0:6])
 
-# global variables that are updated during the experiment
-fourfilled = 0
-RT1 = 0
-RT2 = 0
-RT3 = 0
-RT4 = 0
-
-correctsuppressions = 0
-incorrectsuppressions = 0
-count_NoGo = 0
-count_Go = 0
-count_validGo = 0
-count_anticipatory = 0
-count_4RTs_successsuppression = 0
-count_4RTs_failedsuppression = 0
-sumRT_successsuppression = 0
-sumRT_failedsuppression = 0
-
-# Note: list created on runtime; it saves all valid latencies of correct Go trials
-# in order to calculate Std of correct and valid Go-latencies
-
-validgolatencies = []
+# running SART scores (counts, valid Go RT mean/SD, RTs before NoGo trials), updated on every trial
+score = SARTScorer(parameters['responsekey'], parameters['anticipatoryresponsetime'], parameters['validresponsetime'])
+
 trial_data = []
 summary_data = []
 
@@ -287,6 +283,7 @@ summary_data = []
 # initialize window
 mywin = visual.Window(monitor="testMonitor", units="deg",
     color=defaults['screencolor'],fullscr=True) # this initializes the window as black, which is what I seem to remember. 
+startup.mark('window')
 
 getReadyText = visual.TextStim(mywin, text=getReady_Params['items'],
     font=getReady_Params['fontstyle'], # To do: not sure we have the 'Symbol' font, may need to add
@@ -321,6 +318,21 @@ digit.autoDraw = False  # Automatically draw every frame
 fixation = visual.ImageStim(mywin,image=mask,units='height',size=0.2)
 fixation.height = 0.2
 
+# one pre-rendered digit per (digit, fontsize) pair, drawn once so the textures are uploaded before the first trial
+digit_stims = DigitStimCache(mywin, fontsizes, font=defaults['fontstyle'], units='height', color=(1,1,1))
+digit_stims.warm(fixation)
+
+# display pre-flight: refresh interval and jitter over a run of blank frames, before the practice block
+display_check = preflight(mywin)
+print(display_check)
+
+# digit and mask durations in whole frames of the measured refresh rate, keys polled every frame
+frame_scheduler = FrameTrialScheduler(mywin, parameters['digitpresentationtime'], parameters['maskpresentationtime'],
+    refresh=display_check.refresh, events=events)
+# the text log only keeps warnings, so the display timing goes to its own file
+save_display_check('logs/G{}S{}_sart_display.txt'.format(group,subject), display_check, frame_scheduler)
+startup.mark('digit stims, display pre-flight')
+
 errorfeedback = visual.TextStim(mywin, text='Incorrect',
     font=defaults['fontstyle'], # To do: not sure we have the 'Symbol' font, may need to add
     units='height',
@@ -329,6 +341,9 @@ errorfeedback = visual.TextStim(mywin, text='Incorrect',
     pos=(0,0))
 errorfeedback.autoDraw = False  # Automatically draw every frame
 
+startup.mark('remaining stimuli')
+print(startup.report())
+
 
 ###################################################################################################################
 ###################################################################################################################
@@ -351,6 +366,17 @@ def waitForButtonPress(waitTime=0):
         if response =='q':
             core.quit()
 
+def log_stim_stop(future, trialnum=-1):
+    # called on the stim controller thread once a train has been stopped
+    if future.exception() is None:
+        timing = future.result()
+        # a hardware-triggered train (stimtrigger) has no measured stop
+        if timing.t_stopped is not None:
+            events.record(STIM_STOP, trialnum, timing.duration, t=timing.t_stopped)
+    else:
+        events.record(STIM_ERROR, trialnum)
+        logging.log(level=logging.ERROR, msg='stim error: {}'.format(future.exception()))
+
 def feedback():
     errorfeedback.draw()
     mywin.flip()
@@ -371,10 +397,10 @@ def present_page(page):
     mywin.flip(clearBuffer=True)
 
 def createdata(suffix = ''):
-    # open files, write headers, close
-    raw_data_log = open('logs/G{}S{}_sart_log{}.csv'.format(group,subject,suffix),'w',newline='',encoding='utf-8')
-    raw_data_writer = csv.writer(raw_data_log)
-    raw_data_writer.writerow(data['columns'])
+    # open the data file and write the header; rows are written in batches by a background thread
+    # (the sink is both the writer and the log: record_data(writer,...), log.sync(), log.close())
+    raw_data_log = TrialDataSink('logs/G{}S{}_sart_log{}.csv'.format(group,subject,suffix),data['columns'])
+    raw_data_writer = raw_data_log
 
     return raw_data_writer, raw_data_log
 
@@ -385,6 +411,33 @@ def record_data(raw_data_writer,trial_data): # add all the variables that change
     # raw_data_log.writerow(trial_data)
     # raw_data_log.close()
 
+def record_summary_data(suffix = ''):
+    # session summary from the running scores, plus one row per block scored from the saved trial file
+    summaries = [('session', score.summary())]
+    blocks = score_csv('logs/G{}S{}_sart_log{}.csv'.format(group,subject,suffix), by='blocknum')
+    summaries += [('block {}'.format(b), summary) for b, summary in blocks.items()]
+    write_summary('logs/G{}S{}_sart_summary{}.csv'.format(group,subject,suffix), summaries,
+        (('subject',subject),('group',group),('date',current_date),('time',current_time),('order',subject_order)))
+
+def frame_data(result):
+    # display timing columns of a trial (ms): SOA, digit and mask duration, longest frame, dropped frames
+    soa = '' if result.soa is None else round(result.soa*1000,3)
+    return [soa, round(result.digit_duration*1000,3), round(result.mask_duration*1000,3),
+        round(result.max_interval()*1000,3), result.dropped_frames()]
+
+def record_timing_summary(suffix = ''):
+    # flag the trials whose digit to digit SOA deviated from ITI + digit + mask time
+    nominal = (parameters['ITI']+parameters['digitpresentationtime']+parameters['maskpresentationtime'])*1000
+    summary, flagged = flag_soa('logs/G{}S{}_sart_log{}.csv'.format(group,subject,suffix), nominal,
+        refresh=frame_scheduler.refresh)
+    with open('logs/G{}S{}_sart_timing{}.csv'.format(group,subject,suffix),'w',newline='') as f:
+        timing_writer = csv.writer(f)
+        timing_writer.writerow(('blocknum','trialnum','soa','deviation','droppedframes'))
+        timing_writer.writerows(flagged)
+    print('SOA: {} of {} trials deviated from {:.0f} ms by more than {:.1f} ms (max {:.1f} ms), mean {:.3f} ms, '
+        '{} dropped frames'.format(summary['nflagged'], summary['ntrials'], nominal, summary['tolerance'],
+        summary['max_deviation'], summary['mean_soa'], summary['dropped_frames']))
+
 #############################
 # General Helper Trial
 #############################
@@ -399,6 +452,8 @@ def getReady():
     waitForButtonPress()
     
     mywin.flip(clearBuffer=True)
+    # the first trial after this screen has no SOA
+    frame_scheduler.reset_soa()
 
 ###################################################################################################################
 ###################################################################################################################
@@ -407,108 +462,49 @@ def getReady():
 ###################################################################################################################
 
 
-def practice_trial(digitvalue,fontsize):
+def practice_trial(digitvalue,fontsize,trialnum=-1):
     pretrialpause = parameters['ITI'] # get ITI for this trial
     
-    # Update digit presentation text
-    digit.height = fontsize
-    digit.text = digitvalue
+    # Pick the pre-rendered digit
+    digit_stim = digit_stims.get(digitvalue, fontsize)
 
     if digitvalue==3:
         trialtype='practice_nogo'
     else:
         trialtype='practice_go'
 
-    # wait for the inter-trial-interval
-    core.wait(pretrialpause)
-
-    # set up digit
-    digit.draw()
-
-    # Set keyboard presses to none
-    key_pressed = False
+    # show digit, then mask, for a fixed number of frames; keys are polled on every frame and
+    # through the inter-trial-interval that follows the mask
+    result = frame_scheduler.run(digit_stim, fixation, clear=False, trial=trialnum,
+        iti=pretrialpause)
 
-    # Start recording button presses <- Trial Timer Start
-    event.clearEvents()
-    trialClock.reset()
-
-    # show digit <- Digit Presentation
-    mywin.logOnFlip(level=logging.EXP, msg='digit start')
-    while trialClock().getTime() <= parameters['digitpresentationtime']:
-        mywin.flip()
-        if key_pressed == False:
-            keys = event.getKeys(keyList=["q","space"],waitRelease=False,timeStamped=trialClock) # get just the first time space was pressed
-
-        #digitperiod.start(parameters['digitpresentationtime'])  # start a period of 0.25s
-
-    # Set up Fixation Mask
-    fixation.draw()
-
-    mywin.logOnFlip(level=logging.EXP, msg='mask start')
-    while trialClock().getTime() <= parameters['maskpresentationtime']:
-        mywin.flip()
-        if key_pressed == False:
-            keys = event.getKeys(keyList=["q","space"],waitRelease=False,timeStamped=trialClock) # get just the first time space was pressed
-
-    print('keys are {}'.format(keys))
-    if len(keys) > 0:
-        keys = keys[0]
-        response = keys[0]
-        latency = round((keys[1])*1000) # convert to ms
-    else:
-        response = "0"
-        latency = 0
+    print('keys are {}'.format(result.keys))
+    response = result.response
+    latency = round(result.rt*1000) # convert to ms
 
     # check for quit key
     if response =='q':
         core.quit()
     # record overall time
-    trialduration = trialClock.getTime()
-
-    # revert to black screen
-    mywin.flip(clearBuffer=True)
+    trialduration = result.duration
 
     if response == parameters['responsekey']:
         RT = latency
     else:
         RT = 0
-        latencytype = 0
-
-    if RT != 0 and RT < parameters['anticipatoryresponsetime']:
-        latencytype=1
-    elif RT != 0 and RT >= parameters['anticipatoryresponsetime'] and RT < parameters['validresponsetime']:
-        latencytype=2
-    elif RT != 0 and RT >= parameters['validresponsetime']:
-        latencytype=3 
-
-    if trialtype == 'practice_go':
-        if RT == 0:
-            responsetype = "Omission"
-        elif RT != 0 and RT < parameters['anticipatoryresponsetime']:
-            responsetype = "Go Anticipatory"
-        elif RT >= parameters['anticipatoryresponsetime'] and RT < parameters['validresponsetime']:
-            responsetype = "Go Ambiguous";
-        elif RT >= parameters['validresponsetime']:
-            responsetype = "Go Success"
-    elif trialtype == 'practice_nogo':
-        if RT == 0:
-            responsetype = "NoGo Success"
-        else:
-            responsetype = "NoGo Failure"
 
-    # determine accuracy and feedback (if practice)
-    if responsetype == "NoGo Success" or responsetype == "Go Success":
-        correct = 1
-    else:
-        correct = 0
+    # practice trials are classified like the test trials but not counted
+    latencytype, responsetype, correct = classify(trialtype, RT, parameters['anticipatoryresponsetime'],
+        parameters['validresponsetime'])
 
     if correct==0: # I invented where this should be set
         feedback()
+        frame_scheduler.reset_soa()
     
     print('latency was {}, latencytype was {}, RT was {}\n'.format(latency,latencytype,RT))
     print('responsetype was {}\n'.format(responsetype))
 
-    return response, latency, trialduration, RT, latencytype, responsetype, correct, trialtype
+    return response, latency, trialduration, RT, latencytype, responsetype, correct, trialtype, result
 
 ###################################################################################################################
 ###################################################################################################################
@@ -516,187 +512,53 @@ def practice_trial(digitvalue,fontsize):
 ###################################################################################################################
 ###################################################################################################################
 
-def trial(digitvalue,fontsize,dostim):
+def trial(digitvalue,fontsize,dostim,trialnum=-1):
     pretrialpause = parameters['ITI'] # get ITI for this trial
     
-    # define globals
-    global count_Go
-    global count_NoGo
-    global incorrectsuppressions
-    global count_anticipatory
-    global count_validGo
-    global validgolatencies
-    global fourfilled
-    global correctsuppressions
-    global count_4RTs_successsuppression
-    global count_4RTs_failedsuppression
-    global sumRT_failedsuppression
-    global sumRT_successsuppression
-    global RT1
-    global RT2
-    global RT3
-    global RT4
-    global fourfilled
-
     if digitvalue==3:
         trialtype='nogo'
     else:
         trialtype='go'
 
-    # update values
-    if trialtype=='go':
-        count_Go += 1
-
-    elif trialtype=='nogo':
-        count_NoGo += 1
-
-    # Update digit presentation text
-    digit.height = fontsize
-    digit.text = digitvalue
-
-    # Set up digit
-    digit.draw()
-
-
-    # wait for the inter-trial-interval
-    core.wait(pretrialpause)
-
-    # Start recording button presses
-    event.clearEvents()
-    trialClock.reset()
-            
-    # Show digit
-    mywin.logOnFlip(level=logging.EXP, msg='digit start')
-    mywin.flip()
-    digitperiod.start(parameters['digitpresentationtime'])  # start a period of 0.9s
-
-
-    # STIMULATE HERE
-    if dostim:
-        logging.log(level=logging.EXP, msg='stim start')
-        task.start()
- 
-    # Set up Fixation Mask
-    fixation.draw()
-
-    # wait for digit time to complete
-    digitperiod.complete()
-
-    # show fixation
-    mywin.logOnFlip(level=logging.EXP, msg='fixation start')
-    mywin.flip()
-
-    maskperiod.start(parameters['maskpresentationtime'])  # start a period of 0.9s
-    maskperiod.complete() 
-    keys = event.getKeys(keyList=["q","space"],timeStamped=trialClock) # get just the first time space was pressed
+    # Pick the pre-rendered digit
+    digit_stim = digit_stims.get(digitvalue, fontsize)
+
+    # Show digit, then the fixation mask, for a fixed number of frames; keys are polled on every frame
+    # and through the inter-trial-interval that follows the mask
+    # STIMULATE HERE (started right after the digit flip; the train runs on the stim controller thread,
+    # the trial does not wait for it). t_onset is the perf_counter time of the digit flip, so the
+    # latency report measures the onset from the flip itself
+    def start_stim(t_onset):
+        if dostim:
+            events.record(STIM_START, trialnum)
+            stim_future = stim.fire(t_ref=t_onset)
+            stim_future.add_done_callback(lambda future: log_stim_stop(future, trialnum))
+
+    result = frame_scheduler.run(digit_stim, fixation, on_digit_flip=start_stim, clear=False, trial=trialnum,
+        iti=pretrialpause)
+    response = result.response
+    latency = round(result.rt*1000) # convert to ms
 
-    if len(keys) > 0:
-        keys = keys[0]
-        response = keys[0]
-        latency = round((keys[1])*1000) # convert to ms
-
-        # check for quit key
-        if response =='q':
-                # CALL SAFE STOP TO STIMULATION
-            if dostim:
-                task.wait_until_done(10)
-                task.stop()
-                logging.log(level=logging.EXP, msg='stim stop')
-            raw_data_log.close()
-            mywin.close()
-            core.quit()
-    else:
-        response = "0"
-        latency = 0
+    # check for quit key
+    if response =='q':
+            # CALL SAFE STOP TO STIMULATION (finishes the current train, then stops the task)
+        if not debug:
+            stim.close()
+        raw_data_log.close()
+        events.close()
+        mywin.close()
+        core.quit()
 
     # record overall time
-    trialduration = trialClock.getTime()
-
-    # revert to black screen
-    mywin.logOnFlip(level=logging.EXP, msg='digit cleared')
-    mywin.flip(clearBuffer=True)
-
-    # CALL SAFE STOP TO STIMULATION
-    if dostim:
-        task.wait_until_done(10)
-        task.stop()
-        logging.log(level=logging.EXP, msg='stim stop')
+    trialduration = result.duration
 
-    # define RT for valid response
-    if response == parameters['responsekey']:
-        RT = latency
-    else:
-        RT = 0
-        latencytype = 0
-
-    # define latency type for valid response
-    if RT != 0 and RT < parameters['anticipatoryresponsetime']:
-        latencytype=1
-    elif RT != 0 and RT >= parameters['anticipatoryresponsetime'] and RT < parameters['validresponsetime']:
-        latencytype=2
-    elif RT != 0 and RT >= parameters['validresponsetime']:
-        latencytype=3
-
-    # define response type 
-    if trialtype == 'go':
-        if RT == 0:
-            responsetype = "Omission"
-            incorrectsuppressions += 1
-        elif RT != 0 and RT < parameters['anticipatoryresponsetime']:
-            responsetype = "Go Anticipatory"
-            count_anticipatory += 1
-        elif RT >= parameters['anticipatoryresponsetime'] and RT < parameters['validresponsetime']:
-            responsetype = "Go Ambiguous"
-        elif RT >= parameters['validresponsetime']:
-            responsetype = "Go Success"
-            count_validGo += 1
-            validgolatencies.append(RT)
-            
-        if RT != 0 and responsetype=="Go Success":
-            RT1 = RT2
-            RT2 = RT3
-            RT3 = RT4
-            RT4 = RT
-        else:
-            RT1 = 0
-            RT2 = 0
-            RT3 = 0
-            RT4 = 0
-            fourfilled=0
-        
-        if responsetype=="Go Success" and RT1 != 0 and RT2 != 0 and RT3 != 0 and RT4 != 0:
-            fourfilled = 1
-
-    elif trialtype == 'nogo':
-        if RT == 0:
-            responsetype = "NoGo Success"
-            correctsuppressions += 1
-        else:
-            responsetype = "NoGo Failure"
-        
-        if RT == 0 and fourfilled == 1:
-            count_4RTs_successsuppression +=1
-            sumRT_successsuppression += (RT1 + RT2 + RT3 + RT4)
-        elif RT != 0 and fourfilled == 1:
-            count_4RTs_failedsuppression +=1
-            sumRT_failedsuppression += (RT1 + RT2 + RT3 + RT4)
-        
-        RT1 = 0
-        RT2 = 0
-        RT3 = 0
-        RT4 = 0
-        fourfilled = 0
-
-    # determine accuracy and feedback (if practice)
-    if responsetype == "NoGo Success" or responsetype == "Go Success":
-        correct = 1
-    else:
-        correct = 0
+    # score the trial (RT, latency type, response type and the running counts)
+    RT, latencytype, responsetype, correct = score.update(trialtype, response, latency)
 
     # write to log
     logging.flush()
     # return
-    return trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct
+    return trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, result
 
 ###################################################################################################################
 ###################################################################################################################
@@ -715,6 +577,7 @@ def block_practice():
     waitForButtonPress()
 
     raw_data_writer, raw_data_log = createdata('_tvns_practice')
+    events.start_block(blocknum)
     getReady()
     
     # generate practice_digitsequence
@@ -732,7 +595,7 @@ def block_practice():
         digitvalue = practice_digitsequence[digit_counter]
         fontsize = fontsizes[fontsize_counter]
 
-        response, latency, trialduration, RT, latencytype, responsetype, correct, trialtype = practice_trial(digitvalue,fontsize)
+        response, latency, trialduration, RT, latencytype, responsetype, correct, trialtype, result = practice_trial(digitvalue,fontsize,trx+1)
         
         # apply appropriate formatting to variables
         trialcode = trialtype.lower()
@@ -741,9 +604,9 @@ def block_practice():
         # record data
         trial_data = [build, computer, current_date,current_time,subject,group,blockcode,blocknum,trialcode,trx+1,trx+1,
             int(parameters['digitpresentationtime']*100), int(parameters['maskpresentationtime']*100), trialtype, digitvalue, fontsize,
-            response, correct, RT, latency, latencytype, responsetype, count_anticipatory,correctsuppressions, count_NoGo, 
-            incorrectsuppressions, count_Go, count_validGo, 
-            0,0,0] #
+            response, correct, RT, latency, latencytype, responsetype, score.count_anticipatory,score.correctsuppressions, score.count_NoGo, 
+            score.incorrectsuppressions, score.count_Go, score.count_validGo, 
+            0,0,0] + frame_data(result) #
             # build,computer.platform,date,time,subject,group,blockcode,blocknum,trialcode,trialnum    expressions.trialcount,
             # parameters.digitpresentationtime,parameters.maskpresentationtime,values.trialtype    values.digit,values.fontsize,
             # response,correct,values.RT,latency,values.latencytype,values.responsetype,values.count_anticipatory,values.correctsuppressions,values.count_NoGo,
@@ -782,50 +645,33 @@ def block_SART(trialcount,b,stim_block):
     else:
         params.update({"amp":0}) # if sham block, set stimulation amplitude to 0. 
 
-    buf = MakeStimBuffer(params)
+    # active and sham blocks share the unit-amplitude train, only the scaling differs
+    buf = stim_cache.unit(params).scale(params['amp'])
 
-    # write the actual waveform to the buffer
-    writer.write_many_sample(buf)
+    # write the actual waveform to the buffer (quantized to DAC codes once per block)
+    # queued behind any train that is still playing
+    stim.load(writer.quantize(buf))
 
     getReady()
 
-    # set up trials for block
-    ndigits = len(np.arange(1,10))
-    nreps = int(ntrials/ndigits)
-    expr_digitsequence = np.repeat(np.arange(1,10),nreps)
-
-    # randomize
-    random.shuffle(expr_digitsequence) # fully randomized
-    random.shuffle(fontsizes)
+    # compile the whole block up front (digits, fontsizes, stim sequence, planned onsets) and save it
+    # next to the data; the trial loop only reads rows
+    trial_period = parameters['ITI']+frame_scheduler.digit_time+frame_scheduler.mask_time
+    plan = compile_sart_plan(blocknum, ntrials, fontsizes, trial_period=trial_period,
+        min_nogo_spacing=nogo_spacing, nogo_free_start=nogo_free_start)
+    save_plan(plan, 'logs/G{}S{}_sart_plan_block{}.csv'.format(group,subject,blocknum))
+    events.start_block(blocknum, plan['seed'][0])
 
-    # set up stimulation sequence
-    expr_stimsequence = np.zeros(len(expr_digitsequence))
-    nogo_idxs = np.where(expr_digitsequence==3)[0]
-    for nogotrial in range(len(nogo_idxs)):
-        idx = nogo_idxs[nogotrial]
-        low_idx = idx-2
-        high_idx = idx+2
-        if low_idx <0:
-            low_idx = 0
-        if high_idx>len(expr_stimsequence):
-            high_idx = len(expr_stimsequence)
-
-        expr_stimsequence[idx-2:idx+3] = 1
-        
+    for trx in range(len(plan)):
 
-    # initialize counters
-    digit_counter = 0
-    fontsize_counter=0
-    for trx in range(len(expr_digitsequence)):
-
-        digitvalue = expr_digitsequence[digit_counter]
-        fontsize = fontsizes[fontsize_counter]
+        digitvalue = int(plan['digit'][trx])
+        fontsize = float(plan['fontsize'][trx])
         if debug:
             dostim = 0
         else:
-            dostim = expr_stimsequence[digit_counter]
+            dostim = int(plan['dostim'][trx])
             
-        trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct = trial(digitvalue,fontsize,dostim)
+        trialtype, response, latency, trialduration, RT, latencytype, responsetype, correct, result = trial(digitvalue,fontsize,dostim,trx+1)
         
         # apply appropriate formatting to variables
         trialcode = trialtype.lower()
@@ -835,19 +681,16 @@ def block_SART(trialcount,b,stim_block):
         trialnum = trx+1
         trial_data = [build, computer, current_date,current_time,subject,group,blockcode,blocknum,trialcode,trialnum,trialcount,
             int(parameters['digitpresentationtime']*100), int(parameters['maskpresentationtime']*100), trialtype, digitvalue, fontsize,
-            response, correct, RT, latency, latencytype, responsetype, count_anticipatory,correctsuppressions, count_NoGo, 
-            incorrectsuppressions, count_Go, count_validGo, 
-            dostim,params['amp'],subject_order] #
+            response, correct, RT, latency, latencytype, responsetype, score.count_anticipatory,score.correctsuppressions, score.count_NoGo, 
+            score.incorrectsuppressions, score.count_Go, score.count_validGo, 
+            dostim,params['amp'],subject_order] + frame_data(result) #
         record_data(raw_data_writer,trial_data)
 
         # update trial values
         trialcount +=1
-        digit_counter += 1
-        fontsize_counter +=1 
-        if fontsize_counter==len(fontsizes):
-            random.shuffle(fontsizes)
-            fontsize_counter=0
 
+    # block boundary: everything from this block is on disk before the next one starts
+    raw_data_writer.sync()
     return trialcount
 
 ###################################################################################################################
@@ -871,14 +714,9 @@ def expt():
 
     # determine whether order of stimulation for this participant is AABB or BBAA
     # could also have a pre-randomized list of orders, and just select the one based on the subject number. 
-    subject_number = int(''.join(filter(str.isdigit, expInfo['subject'])))
     global subject_order
-    if subject_number % 2 == 0:
-        stim_order = ['A','A','B','B']
-        subject_order = 'AABB'
-    else:
-        stim_order = ['B','B','A','A']
-        subject_order = 'BBAA'
+    subject_order = block_order(expInfo['subject'], 4)
+    stim_order = list(subject_order)
 
     if debug:
         # run practice block
@@ -891,23 +729,40 @@ def expt():
             trialcount = block_SART(trialcount,b)
 
         raw_data_log.close()        
+        events.close()
+        record_summary_data('_tvns_expr')
+        record_timing_summary('_tvns_expr')
     else:
         global task
         global writer
+        global stim
         with nidaqmx.Task() as task:
             task.ao_channels.add_ao_voltage_chan("Dev1/ao1") # check output channel on DAQ
             task.timing.cfg_samp_clk_timing(rate=params["sr"],
                                     sample_mode=constants.AcquisitionType.FINITE,  # FINITE or CONTINUOUS
                                     samps_per_chan=len(fake_buf))
-            writer = AnalogSingleChannelWriter(task.out_stream,auto_start=False)
+            # buffers are pre-quantized to int16 DAC codes and written unscaled
+            writer = Int16Writer(task)
 
             # run first buffer as zeros (hack)
             writer.write_many_sample(fake_buf)
-            task.start()
-            core.wait(0.601) # just in case
-            task.wait_until_done(10)
+            train_done = TrainDone(task)
+            train_done.start()
+            train_done.wait(10) # DAQ done event: returns as soon as the zero train has played
             task.stop()
+            train_done.close()
+
 
+            # from here on the task is owned by the stim controller thread, or armed on the
+            # trigger line so the train starts in hardware on the DO edge written after the digit flip
+            trigger_task = None
+            if parameters['stimtrigger']:
+                trigger_task = nidaqmx.Task()
+                trigger_task.do_channels.add_do_chan(parameters['triggerline'])
+                daq.connect(parameters['triggerline'], parameters['triggersource'])
+                stim = TriggeredStim(task, writer, trigger_task, parameters['triggersource'])
+            else:
+                stim = StimController(task, writer)
 
             # run practice block
             block_practice()
@@ -921,8 +776,21 @@ def expt():
                 else:
                     trialcount = block_SART(trialcount,b,False)
 
-
+            # let the last train finish before the task is closed
+            stim.close()
+            if trigger_task is not None:
+                trigger_task.close()
             raw_data_log.close()
+            events.close()
+            record_summary_data('_tvns_expr')
+            record_timing_summary('_tvns_expr')
+
+            # time from digit flip to train start, and the other stim delivery phases
+            print(stim.latency.report(window=parameters['digitpresentationtime']))
+            stim.latency.save('logs/G{}S{}_stim_latency.csv'.format(group,subject))
+
+        # summary of the emitted trains when running against the simulated DAQ
+        daq.report('logs/G{}S{}_simdaq_trains.csv'.format(group,subject))
 
         completed = 1
 
@@ -5,18 +5,23 @@
 ##############################################################################################################
 ##############################################################################################################
 from __future__ import division
-from psychopy import visual, core, gui,event, logging, info
-from psychopy.visual.ratingscale import RatingScale
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+from startup import StartupTimer, discover_daq
+startup = StartupTimer()
+from psychopy import core, gui # the rest of psychopy is imported after the dialog
+startup.mark('import psychopy.gui')
+# the DAQ driver is imported and the devices are listed while the operator fills in the dialog
+daq_discovery = startup.background('DAQ discovery', discover_daq)
 import numpy as np
 import random
 import csv
 from datetime import date,datetime
-import sys
 import platform
-import nidaqmx
-from nidaqmx import constants
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
-from scipy import signal
+from stimbuffer import pulse_train
+from stimcontroller import TrainDone
+startup.mark('import numpy, taVNS_common')
 
 ##############################################################################################################
 ##############################################################################################################
@@ -142,6 +147,11 @@ else:
     core.quit()  # the user hit cancel so exit
 subject = expInfo['subject']
 group = expInfo['group']
+startup.mark('dialog')
+
+from psychopy import visual, event, logging, info
+from psychopy.visual.ratingscale import RatingScale
+startup.mark('import psychopy.visual')
 
 ##############################################################################################################
 ##############################################################################################################
@@ -149,10 +159,11 @@ group = expInfo['group']
 ##############################################################################################################
 ##############################################################################################################
 
-system = nidaqmx.system.System.local()
-system.driver_version
+system, devices = startup.wait('DAQ discovery', daq_discovery)
+import daq
+from daq import nidaqmx, constants, AnalogSingleChannelWriter # nidaqmx, or simdaq with TAVNS_SIMULATE_DAQ=1
 
-for device in system.devices:
+for device in devices:
     print(device)
 
 def biphasic_waveform(amp, pw, ipd=0, sr=24414.0625):
@@ -167,30 +178,14 @@ def biphasic_waveform(amp, pw, ipd=0, sr=24414.0625):
     return wf
 
 
-def constant_rate_pulser(f, dur, sr=24414.0625):
-
-    ipis = np.floor(sr/f)
-    durs = np.floor(dur*sr)
-
-    pt = np.zeros(int(durs))
-    for i in range(0, int(durs-ipis),int(ipis)):
-        pt[i] = 1
-
-    return pt
-
-
 def MakeStimBuffer(params):
     #print params
     # %% generate the biphasic waveform
     wf = biphasic_waveform(params["amp"], params["pw"],ipd=50)
     #print wf
     # %% generate the train for the test block
-    # % create the 30Hz train
-    ptTest = constant_rate_pulser(params["freq"], params["duration_test"])
-    #plt.plot(ptTest)
-    yTest = signal.convolve(ptTest, wf)
-    ypad = np.zeros(100)
-    yTest = np.concatenate((ypad, yTest),axis=0)
+    # % place the pulse at every onset of the 25Hz train (same buffer as convolving the pulse train with wf)
+    yTest = pulse_train(wf, params["freq"], params["duration_test"], pad=100)
     # %% generate the buffer
     # buf = np.zeros((params["nchan"],len(yTest)))
     # buf[1,:] = np.tile(yTest,[1,1])
@@ -286,6 +281,7 @@ summary_data = []
 # initialize window
 mywin = visual.Window(monitor="testMonitor", units="deg",
     color=defaults['screencolor'],fullscr=True) # this initializes the window as black, which is what I seem to remember. 
+startup.mark('window')
 
 getReadyText = visual.TextStim(mywin, text=getReady_Params['items'],
     font=getReady_Params['fontstyle'], # To do: not sure we have the 'Symbol' font, may need to add
@@ -328,6 +324,9 @@ errorfeedback = visual.TextStim(mywin, text='Incorrect',
     pos=(0,0))
 errorfeedback.autoDraw = False  # Automatically draw every frame
 
+startup.mark('stimuli')
+print(startup.report())
+
 
 ###################################################################################################################
 ###################################################################################################################
@@ -860,10 +859,11 @@ def expt():
 
             # run first buffer as zeros (hack)
             writer.write_many_sample(fake_buf)
-            task.start()
-            core.wait(0.601) # just in case
-            task.wait_until_done(10)
+            train_done = TrainDone(task)
+            train_done.start()
+            train_done.wait(10) # DAQ done event: returns as soon as the zero train has played
             task.stop()
+            train_done.close()
 
             # write the actual waveform to the buffer
             writer.write_many_sample(buf)
@@ -879,6 +879,9 @@ def expt():
 
             raw_data_log.close()
 
+        # summary of the emitted trains when running against the simulated DAQ
+        daq.report('logs/G{}S{}_simdaq_trains.csv'.format(group,subject))
+
         completed = 1
 
 
@@ -1,36 +1,34 @@
 #%%
 # Import packages
 import os
+import sys
 import glob
 import pandas as pd
 import matplotlib.pyplot as plt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+from eventlog import read_events, event_names, DIGIT_START, KEY_SPACE
 # %%
 # Set directories
 cur_dir = os.getcwd()
 data_dir = cur_dir.replace('Code/Python/SART_Python','Data/SART_Microstudy')
 # %%
-# Get list of log files
-file_list = glob.glob(data_dir + '/*.log')
+# Get list of event files (written by SART_taVNS.py, see eventlog.py)
+file_list = glob.glob(data_dir + '/*_events.bin')
 # %%
-# Read in tab separated log file (skipping practice trials)
-log_data = pd.read_csv(file_list[0], sep='\t', lineterminator='\n',header=None,skiprows=108)
-log_data.columns = ['Time','Event','Info']
+# Read in the binary event stream (skipping practice trials, block 0)
+events = read_events(file_list[0])
+log_data = pd.DataFrame({'Time': events['t'], 'Code': events['code'], 'Event': event_names(events['code']),
+    'Block': events['block'], 'Trial': events['trial'], 'Value': events['value']})
+log_data = log_data[log_data['Block'] > 0]
 log_data.head(100)
 
 # %%
-digit_start_idx = log_data['Info'].str.contains('digit start')
-button_press_idx = log_data['Info'].str.contains('space')
-log_data = log_data[digit_start_idx | button_press_idx]
-log_data = log_data.sort_values(by=['Time'])
-log_data = log_data.reset_index(drop='True')
-# %%
-log_data['Latency'] = 0
-# Iterate over rows and extract latency
-for r in range(log_data.shape[0]-1):
-    if log_data.loc[r,'Event'] == 'EXP ' and log_data.loc[r+1,'Event'] == 'DATA ':
-        log_data.loc[r,'Latency'] = log_data.loc[r+1,'Time'] - log_data.loc[r,'Time']
-    
-log_data = log_data[log_data['Event']=='EXP ']
+# key press values are the RT from the digit flip; keep the first press of every trial
+digits = log_data[log_data['Code'] == DIGIT_START]
+presses = log_data[log_data['Code'] == KEY_SPACE]
+presses = presses.drop_duplicates(subset=['Block','Trial'])
+log_data = digits.merge(presses[['Block','Trial','Value']], on=['Block','Trial'], how='left', suffixes=('','_key'))
+log_data['Latency'] = log_data['Value_key'].fillna(0)
 
 # %%
 plt.hist(log_data['Latency'])
@@ -0,0 +1,447 @@
+# This script runs several perception threshold staircases (e.g. one per pulse width and waveshape)
+# interleaved in one session, and returns a data file with every trial and one with the thresholds.
+# Python version of multiRandomStaircase.m: every trial goes to a randomly chosen staircase that has
+# not finished yet. The window and the DAQ task are set up once; each staircase has its own
+# amplitude bank (stimbuffer.AmplitudeBank), all padded to the same length so the committed task
+# never has to be reconfigured between trials.
+
+
+##############################################################################################################
+##############################################################################################################
+#   Import statements: Do not change
+##############################################################################################################
+##############################################################################################################
+from __future__ import division
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+from startup import StartupTimer, discover_daq
+startup = StartupTimer()
+from psychopy import core, gui # the rest of psychopy is imported after the dialog
+startup.mark('import psychopy.gui')
+# the DAQ driver is imported and the devices are listed while the operator fills in the dialog
+daq_discovery = startup.background('DAQ discovery', discover_daq)
+import numpy as np
+import csv
+from collections import OrderedDict
+from datetime import date,datetime
+from itertools import product
+import platform
+from stimbuffer import pulse_train, AmplitudeBank, biphasic_triangular_waveform
+from daqcodes import Int16Writer
+from stimcontroller import StimTiming, TrainDone
+from stimlatency import LatencyLog
+from threshold import PsiThreshold, UpDownStaircase, InterleavedStaircases
+from time import perf_counter
+startup.mark('import numpy, taVNS_common')
+
+##############################################################################################################
+##############################################################################################################
+#  Intro GUI
+##############################################################################################################
+##############################################################################################################
+
+# present a dialogue to change params
+# pulse widths and waveshapes are comma separated; one staircase runs for every combination
+expInfo = {
+    'group':'0',
+    'subject':'test',
+    'amplitude':0.1,
+    'pulse widths':'200,300,500',
+    'waveshapes':'square',
+    'debug':False,
+    'method':['psi','staircase']
+}
+
+dlg = gui.DlgFromDict(expInfo, title='taVNS Staircases', fixed=['dateStr'])
+if dlg.OK:
+    print('Participant # {}'.format(expInfo['subject']))
+else:
+    core.quit()  # the user hit cancel so exit
+subject = expInfo['subject']
+group = expInfo['group']
+startup.mark('dialog')
+
+from psychopy import visual, event, logging, info
+startup.mark('import psychopy.visual')
+
+
+##############################################################################################################
+##############################################################################################################
+#   EDITABLE INSTRUCTIONS: change instructions here
+##############################################################################################################
+##############################################################################################################
+
+#note: These instructions are not original. Please customize.
+page = {'intro': '''(To be read aloud to the participant)\n
+    "You will receive short bursts of stimulation. \n
+    This can feel like a sudden warming, tingling, or tapping sensation. \n
+    Whenever you are certain that you felt the stimulation, please say so out loud. \n
+    If you are unsure, remain silent. Only respond if you are certain that you felt the stimulation." \n\n
+    Press space to begin.'''}
+
+##############################################################################################################
+##############################################################################################################
+#	EDITABLE LISTS: change editable lists here
+##############################################################################################################
+##############################################################################################################
+
+# threshold engine for every staircase (see threshold.py and taVNS_Staircase.py)
+threshold_params = {
+    'target' : 0.25,
+    'stop_sd' : 0.2, # mA
+    'min_trials' : 8,
+    'max_trials' : 40,
+    'max_step_up' : 0.5 # mA above the highest amplitude given so far
+}
+
+def make_engine(method, start):
+    if method == 'staircase':
+        return UpDownStaircase(start=start)
+    return PsiThreshold(start=start, **threshold_params)
+
+# train parameters shared by all staircases
+train_params = {"sr":24000.00, "freq":25, "ipd":50, 'npulse':50}
+train_params.update({"duration_stim":train_params['npulse']/train_params["freq"]})
+
+
+##############################################################################################################
+##############################################################################################################
+#	tVNS Setup
+##############################################################################################################
+##############################################################################################################
+
+system, devices = startup.wait('DAQ discovery', daq_discovery)
+import daq
+from daq import nidaqmx, constants # nidaqmx, or simdaq with TAVNS_SIMULATE_DAQ=1
+
+for device in devices:
+    print(device)
+
+def biphasic_waveform(amp, pw, ipd=0, sr=24414.0625):
+
+    pws = np.floor(pw*sr/1e6)
+    ipds = np.floor(ipd*sr/1e6)
+
+    wf = np.zeros(int(pws*2+ipds))
+    wf[:int(pws)] = -amp
+    wf[len(wf)-int(pws):] = amp
+    wf = np.append(wf,0) # ensure that last sample is zero
+    return wf
+
+def MakeStimBuffer(params):
+    # %% generate the biphasic waveform
+    if params['waveshape'] == 'sine':
+        timevector = np.arange(0, params['duration_stim'], 1/params['sr'])
+        yTest = params['amp'] * np.sin(2 * np.pi * params['freq'] * timevector)
+        yTest[0] = 0
+        yTest[-1] = 0
+        return yTest
+    if params['waveshape'] == 'triangle':
+        wf = biphasic_triangular_waveform(params["amp"], params["pw"], params['ipd'], params['sr'])
+    else:
+        wf = biphasic_waveform(params["amp"], params["pw"], params['ipd'], params['sr'])
+    # %% place the pulse at every onset of the train (same buffer as convolving the pulse train with wf)
+    return pulse_train(wf, params["freq"], params["duration_stim"], sr=params['sr'], pad=100)
+
+# one staircase per pulse width x waveshape (sine trains have no pulse width, so only one of those)
+conditions = OrderedDict()
+pulsewidths = [int(pw) for pw in str(expInfo['pulse widths']).split(',') if pw.strip()]
+waveshapes = [shape.strip() for shape in str(expInfo['waveshapes']).split(',') if shape.strip()]
+for shape, pw in product(waveshapes, pulsewidths):
+    if shape == 'sine':
+        pw = 0
+    name = '{}_{}us'.format(shape, pw) if shape != 'sine' else 'sine'
+    conditions[name] = dict(train_params, waveshape=shape, pw=pw, amp=expInfo['amplitude'])
+
+# timestamps of every delivered train, reported at the end of the session
+latency = LatencyLog()
+
+
+##############################################################################################################
+##############################################################################################################
+#	DEFAULTS
+##############################################################################################################
+##############################################################################################################
+
+defaults = {'fontstyle': 'Arial',
+    'fontsize' : 0.04,
+    'txbgcolor': 'white',
+    'txcolor' : (0,0,0),
+    'screencolor':(-1,-1,-1) # We don't need the rectangle background
+    }
+
+# initialize clocks and wait times for experiment
+globalClock = core.Clock()
+trialClock = core.Clock()
+logging.setDefaultClock(globalClock)
+
+
+# might be better to make each column a dictionary
+data = {'columns':('build','computer.platform','date','time','subject','group',
+    'trial','staircase','waveshape','amplitude','pulsewidth','response','runningmean','method','threshold_sd'),
+    'threshold_columns':('subject','group','date','time','staircase','waveshape','pulsewidth','method',
+    'threshold','threshold_sd','ntrials')
+}
+
+##############################################################################################################
+##############################################################################################################
+#	VALUES: automatically updated
+##############################################################################################################
+##############################################################################################################
+
+# get date and time
+monthday = '{d.month}{d.day}'.format(d = date.today())
+year = '{d.year}'.format(d = date.today())
+current_date = monthday + year[2:4]
+current_time = '{d.hour}:{d.minute}:{d.second}'.format(d = datetime.now())
+
+build = '{}'.format(sys.version[0:6])
+
+
+###################################################################################################################
+###################################################################################################################
+#	STIMULI
+###################################################################################################################
+###################################################################################################################
+
+# initialize window (once for all staircases)
+mywin = visual.Window(monitor="testMonitor", units="deg",
+    color=defaults['screencolor'],fullscr=True)
+startup.mark('window')
+
+intro_page = visual.TextStim(mywin, text=page['intro'],
+    font='Arial',
+    units='norm',
+    height = 0.04,
+    color=(1,1,1), # white
+    pos=(0,0))
+
+fixation = visual.TextStim(mywin, text='+',
+    font=defaults['fontstyle'],
+    units='height',
+    height=defaults['fontsize'],
+    color=(1,1,1))
+fixation.autoDraw = False
+
+responsePrompt = visual.TextStim(mywin, text="1 = Didn't feel it.\t 2 = Felt it.",
+    font=defaults['fontstyle'],
+    units='height',
+    height=defaults['fontsize'],
+    color=(1,1,1))
+responsePrompt.autoDraw = False
+
+startup.mark('stimuli')
+print(startup.report())
+
+###################################################################################################################
+###################################################################################################################
+#	RESPONSES
+###################################################################################################################
+###################################################################################################################
+
+def waitForButtonPress(waitTime=0):
+    event.clearEvents()
+    clock = core.Clock()
+
+    if waitTime ==0:
+        keys = event.waitKeys(keyList=["q","space"],timeStamped=clock)[0] # if not explicitly waiting
+    else:
+        keys = event.waitKeys(keyList=["q","space"],timeStamped=clock,maxWait=waitTime)
+    if keys is not None:
+        response = keys[0] # get name (should be space)
+        if response =='q':
+            core.quit()
+
+###################################################################################################################
+###################################################################################################################
+# FUNCTIONS
+###################################################################################################################
+###################################################################################################################
+
+def createdata():
+    raw_data_log = open('logs/G{}S{}_multistaircaseTVNS.csv'.format(group,subject),'w',newline='')
+    raw_data_writer = csv.writer(raw_data_log)
+    raw_data_writer.writerow(data['columns'])
+
+    return raw_data_log, raw_data_writer
+
+def record_data(raw_data_writer,trial_data):
+    raw_data_writer.writerow(trial_data)
+
+def record_thresholds(stairs, method):
+    # one row per staircase
+    with open('logs/G{}S{}_multistaircase_thresholds.csv'.format(group,subject),'w',newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(data['threshold_columns'])
+        for name, params in conditions.items():
+            engine = stairs[name]
+            writer.writerow([subject, group, current_date, current_time, name, params['waveshape'], params['pw'], method,
+                np.round(engine.estimate(),2), engine.sd(), engine.ntrials])
+
+###################################################################################################################
+###################################################################################################################
+#	TRIALS
+###################################################################################################################
+###################################################################################################################
+
+def show_fixation():
+    fixation.draw()
+    mywin.flip()
+
+def trial(buf):
+    # update buffer
+    timing = StimTiming(None)
+    timing.t_write_start = perf_counter()
+    writer.write_many_sample(buf)
+    timing.t_write_done = perf_counter()
+
+    # Set up fixation
+    fixation.draw()
+    core.wait(0.5) # wait for 500ms between trials
+
+    # clear button preses
+    event.clearEvents()
+    trialClock.reset()
+
+    # Show fixation
+    mywin.flip()
+    timing.t_ref = perf_counter()
+    core.wait(0.1) # wait for 100ms
+
+    # Stimulate (ends on the DAQ done event, the fixation stays on screen in the meantime)
+    timing.t_request = timing.t_start_call = perf_counter()
+    train_done.start()
+    timing.t_started = perf_counter()
+    timing.t_done = train_done.wait(10, poll=show_fixation)
+    task.stop()
+    timing.t_stopped = perf_counter()
+    latency.add(timing)
+
+    return get_response()
+
+def debug_trial(duration):
+    fixation.draw()
+    core.wait(0.5) # wait for 500ms between trials
+
+    event.clearEvents()
+    trialClock.reset()
+
+    mywin.flip()
+    core.wait(0.1) # wait for 100ms
+
+    # Stimulate (no DAQ: wait for as long as the train would play)
+    core.wait(duration)
+
+    return get_response()
+
+def get_response():
+    responsePrompt.draw()
+    mywin.flip()
+
+    keys = event.waitKeys(keyList=["q","1","2"],timeStamped=trialClock)
+    response = keys[0][0]
+
+    # revert to black screen
+    mywin.flip(clearBuffer=True)
+
+    # check for quit key
+    if response =='q':
+        raw_data_log.close()
+        mywin.close()
+        core.quit()
+
+    return response
+
+def run_staircases(stairs, method, present):
+    # present(name, amp): delivers one trial and returns the response
+    global raw_data_log
+    computer = platform.system()
+    raw_data_log, raw_data_writer = createdata()
+    trialn = 0
+    while not stairs.done:
+        trialn+=1
+        name, amp = stairs.next()
+        response = present(name, amp)
+        stairs.update(name, amp, response == '2')
+        engine = stairs[name]
+        print('{}: {} mA'.format(name, amp))
+
+        params = conditions[name]
+        trial_data = [build, computer, current_date, current_time, subject, group, trialn, name, params['waveshape'],
+            amp, params['pw'], response, engine.estimate(), method, engine.sd()]
+        record_data(raw_data_writer,trial_data)
+    raw_data_log.close()
+
+def expr(expInfo):
+    global task
+    global writer
+    global train_done
+
+    debug = expInfo['debug'] # change to True to run without stimulation
+    method = expInfo['method']
+    stairs = InterleavedStaircases(OrderedDict((name, make_engine(method, params['amp']))
+        for name, params in conditions.items()))
+
+    # every staircase's trains are padded to the longest one, so one task length fits all of them
+    nsamples = max(len(MakeStimBuffer(dict(params, amp=1.0))) for params in conditions.values())
+
+    preinstructions = (intro_page)
+    preinstructions.draw()
+    mywin.flip()
+    waitForButtonPress()
+
+    if bool(debug):
+        run_staircases(stairs, method, lambda name, amp: debug_trial(nsamples/train_params['sr']))
+
+    else:
+        with nidaqmx.Task() as task:
+            task.ao_channels.add_ao_voltage_chan("Dev1/ao1") # check output channel on DAQ
+            task.timing.cfg_samp_clk_timing(rate=train_params["sr"],
+                                    sample_mode=constants.AcquisitionType.FINITE,  # FINITE or CONTINUOUS
+                                    samps_per_chan=nsamples)
+            writer = Int16Writer(task)
+            train_done = TrainDone(task)
+
+            # one amplitude bank per staircase (0 to 3 mA in 0.1 mA steps, int16 DAC codes)
+            banks = OrderedDict()
+            for name, params in conditions.items():
+                banks[name] = AmplitudeBank(MakeStimBuffer, params, quantize=writer.quantize, length=nsamples)
+            print('amplitude banks: {} x {} rows, {:.1f} MB, built in {:.1f} ms'.format(len(banks),
+                len(next(iter(banks.values()))), sum(bank.nbytes for bank in banks.values())/2**20,
+                sum(bank.build_time for bank in banks.values())*1000))
+
+            # commit once: reserving the device and programming the clock is not repeated for every start
+            task.control(constants.TaskMode.TASK_COMMIT)
+
+            # run first buffer as zeros (hack)
+            writer.write_many_sample(next(iter(banks.values())).get(0))
+            train_done.start()
+            train_done.wait(10)
+            task.stop()
+
+            run_staircases(stairs, method, lambda name, amp: trial(banks[name].get(amp)))
+
+            task.close()
+            print(latency.report())
+            latency.save('logs/G{}S{}_multistaircase_stim_latency.csv'.format(group,subject))
+            daq.report('logs/G{}S{}_simdaq_multistaircase_trains.csv'.format(group,subject))
+
+    record_thresholds(stairs, method)
+    print('----')
+    for name in conditions:
+        print('{}: threshold = {} (sd {:.2f} mA, {} trials)'.format(name, np.round(stairs[name].estimate(),2),
+            stairs[name].sd(), stairs[name].ntrials))
+    print('{} trials in total\n----'.format(stairs.ntrials))
+
+    mywin.close()
+    core.quit()
+
+
+# Run Staircases
+expr(expInfo)
+
+
+##############################################################################################################
+#												End of File
+##############################################################################################################
@@ -8,19 +8,28 @@
 ##############################################################################################################
 ##############################################################################################################
 from __future__ import division
-from psychopy import visual, core, gui,event, logging, info
-from psychopy.visual.ratingscale import RatingScale
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','taVNS_common'))
+from startup import StartupTimer, discover_daq
+startup = StartupTimer()
+from psychopy import core, gui # the rest of psychopy is imported after the dialog
+startup.mark('import psychopy.gui')
+# the DAQ driver is imported and the devices are listed while the operator fills in the dialog
+daq_discovery = startup.background('DAQ discovery', discover_daq)
 import numpy as np
 import csv
 from datetime import date,datetime
-import sys
 import platform
-import nidaqmx
-from nidaqmx import constants
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
-from scipy import signal
+from stimbuffer import pulse_train, StimBufferCache, AmplitudeBank
+from daqcodes import Int16Writer
+from stimcontroller import StimTiming, TrainDone
+from stimlatency import LatencyLog
+from threshold import PsiThreshold, UpDownStaircase
 import time
-import matplotlib.pyplot as plt
+from time import perf_counter
+startup.mark('import numpy, taVNS_common')
+# matplotlib is only imported for the staircase plot at the end
 
 ##############################################################################################################
 ##############################################################################################################
@@ -34,7 +43,8 @@ expInfo = {
     'subject':'test',
     'amplitude':0.1,
     'pulse width':200,
-    'debug':False
+    'debug':False,
+    'method':['psi','staircase']
 }
 
 dlg = gui.DlgFromDict(expInfo, title='SART Task', fixed=['dateStr'])
@@ -45,6 +55,11 @@ else:
     core.quit()  # the user hit cancel so exit
 subject = expInfo['subject']
 group = expInfo['group']
+startup.mark('dialog')
+
+from psychopy import visual, event, logging, info
+from psychopy.visual.ratingscale import RatingScale
+startup.mark('import psychopy.visual')
 
     
 ##############################################################################################################
@@ -79,6 +94,23 @@ page = {'intro': '''(To be read aloud to the participant)\n
 # To create a randomly selected sequence of digits that is created while running the experiment as
 # opposed to a pre-fixed one: replace /selectionmode = sequence with /replace = false
 
+# threshold engine (see threshold.py): 'psi' places every trial where it is most informative and stops
+# once the posterior SD of the threshold is below stop_sd; 'staircase' is the original 0.1 mA up /
+# 0.3 mA down rule (8 percepts). target 0.25: the P(felt) the staircase converges to, so thresholds
+# stay comparable with earlier sessions
+threshold_params = {
+    'target' : 0.25,
+    'stop_sd' : 0.2, # mA
+    'min_trials' : 8,
+    'max_trials' : 40,
+    'max_step_up' : 0.5 # mA above the highest amplitude given so far
+}
+
+def make_engine(method, start):
+    if method == 'staircase':
+        return UpDownStaircase(start=start)
+    return PsiThreshold(start=start, **threshold_params)
+
 
 ##############################################################################################################
 ##############################################################################################################
@@ -86,10 +118,11 @@ page = {'intro': '''(To be read aloud to the participant)\n
 ##############################################################################################################
 ##############################################################################################################
 
-system = nidaqmx.system.System.local()
-system.driver_version
+system, devices = startup.wait('DAQ discovery', daq_discovery)
+import daq
+from daq import nidaqmx, constants # nidaqmx, or simdaq with TAVNS_SIMULATE_DAQ=1
 
-for device in system.devices:
+for device in devices:
     print(device)
 
 def biphasic_waveform(amp, pw, ipd=0, sr=24414.0625):
@@ -104,36 +137,26 @@ def biphasic_waveform(amp, pw, ipd=0, sr=24414.0625):
     return wf
 
 
-def constant_rate_pulser(f, dur, sr=24414.0625):
-
-    ipis = np.floor(sr/f)
-    durs = np.floor(dur*sr)
-
-    pt = np.zeros(int(durs))
-    for i in range(0, int(durs-ipis),int(ipis)):
-        pt[i] = 1
-
-    return pt
-
-
 def MakeStimBuffer(params):
     #print params
     # %% generate the biphasic waveform
     wf = biphasic_waveform(params["amp"], params["pw"],ipd=50)
     #print wf
     # %% generate the train for the test block
-    # % create the 30Hz train
-    ptTest = constant_rate_pulser(params["freq"], params["duration_test"])
-    #plt.plot(ptTest)
-    yTest = signal.convolve(ptTest, wf)
-    ypad = np.zeros(100)
-    yTest = np.concatenate((ypad, yTest),axis=0)
+    # % place the pulse at every onset of the 25Hz train (same buffer as convolving the pulse train with wf)
+    yTest = pulse_train(wf, params["freq"], params["duration_test"], pad=100)
     # %% generate the buffer
     # buf = np.zeros((params["nchan"],len(yTest)))
     # buf[1,:] = np.tile(yTest,[1,1])
 
     return yTest
 
+# the staircase keeps revisiting the same amplitudes, so only synthesize each buffer once
+stim_cache = StimBufferCache(MakeStimBuffer)
+
+# timestamps of every delivered train, reported at the end of the session
+latency = LatencyLog()
+
 
 ##############################################################################################################
 ##############################################################################################################
@@ -160,7 +183,7 @@ maskperiod = core.StaticPeriod()
 
 # might be better to make each column a dictionary
 data = {'columns':('build','computer.platform','date','time','subject','group',
-    'trial','amplitude','pulsewidth','response','runningmean')
+    'trial','amplitude','pulsewidth','response','runningmean','method','threshold_sd')
 }
 
 ##############################################################################################################
@@ -189,6 +212,7 @@ build = '{}'.format(sys.version[0:6])
 # initialize window
 mywin = visual.Window(monitor="testMonitor", units="deg",
     color=defaults['screencolor'],fullscr=True) # this initializes the window as black, which is what I seem to remember. 
+startup.mark('window')
 
 intro_page = visual.TextStim(mywin, text=page['intro'],
     font='Arial', # To do: not sure we have the 'Symbol' font, may need to add
@@ -213,6 +237,9 @@ responsePrompt = visual.TextStim(mywin, text="1 = Didn't feel it.\t 2 = Felt it.
     color=(1,1,1))
 responsePrompt.autoDraw = False  # Automatically draw every frame
 
+startup.mark('stimuli')
+print(startup.report())
+
 ###################################################################################################################
 ###################################################################################################################
 #	RESPONSES
@@ -276,9 +303,16 @@ def record_data(raw_data_writer,trial_data): # add all the variables that change
 # that elicited a correct response before a digit3 trial
 # latencies of Go-success trials are stored in validgolatencies to calculate Std
 
-def trial(params, nreversals, buf):
+def show_fixation():
+    fixation.draw()
+    mywin.flip()
+
+def trial(buf):
     # update buffer
+    timing = StimTiming(None)
+    timing.t_write_start = perf_counter()
     writer.write_many_sample(buf)
+    timing.t_write_done = perf_counter()
     
     # Set up fixation
     fixation.draw()
@@ -290,15 +324,19 @@ def trial(params, nreversals, buf):
 
     # Show fixation
     mywin.flip()
+    timing.t_ref = perf_counter()
     core.wait(0.1) # wait for 100ms
 
-    # Stimulate
-    start_time = time.time()
-    task.start()
-    core.wait(0.601) # just in case
-    task.wait_until_done(10)
+    # Stimulate (the DAQ done event ends the wait as soon as the last sample is out; the fixation
+    # stays on screen in the meantime)
+    timing.t_request = timing.t_start_call = perf_counter()
+    train_done.start()
+    timing.t_started = perf_counter()
+    timing.t_done = train_done.wait(10, poll=show_fixation)
     task.stop()
-    print("--- %s seconds ---" % (time.time() - start_time))
+    timing.t_stopped = perf_counter()
+    latency.add(timing)
+    print("--- %s seconds ---" % (timing.t_stopped - timing.t_start_call))
     # Draw digit while mask is displayed 
     responsePrompt.draw()
     mywin.flip()
@@ -315,21 +353,10 @@ def trial(params, nreversals, buf):
         raw_data_log.close()
         mywin.close()
         core.quit()
-    elif response == '1':
-        if nreversals==0:
-            params['amp'] = params['amp']+0.2
-        else:
-            params['amp'] = params['amp']+0.1
-    elif response == '2':
-        nreversals+=1
-        params['amp'] = params['amp']-0.3
-
-    params['amp'] = np.round(params['amp'],2)
-    
 
-    return params, nreversals, response
+    return response
 
-def debug_trial(params, nreversals, buf):
+def debug_trial(duration):
     # update buffer
     #writer.write_many_sample(buf)
     
@@ -345,12 +372,9 @@ def debug_trial(params, nreversals, buf):
     mywin.flip()
     core.wait(0.1) # wait for 100ms
 
-    # Stimulate
+    # Stimulate (no DAQ: wait for as long as the train would play)
     start_time = time.time()
-    #task.start()
-    core.wait(0.601) # just in case
-    #task.wait_until_done(10)
-    #task.stop()
+    core.wait(duration)
     print("--- %s seconds ---" % (time.time() - start_time))
     # Draw digit while mask is displayed 
     responsePrompt.draw()
@@ -368,30 +392,22 @@ def debug_trial(params, nreversals, buf):
         raw_data_log.close()
         mywin.close()
         core.quit()
-    elif response == '1':
-        if nreversals==0:
-            params['amp'] = params['amp']+0.2
-        else:
-            params['amp'] = params['amp']+0.1
-    elif response == '2':
-        nreversals+=1
-        params['amp'] = params['amp']-0.3
-
-    params['amp'] = np.round(params['amp'],2)
-    
 
-    return params, nreversals, response
+    return response
 
 def expr(expInfo):
     global defaults
 
     debug = expInfo['debug'] # change to True to run without stimulation
+    method = expInfo['method']
     # set tVNS params
     params = {}
     params.update({"sr":24000.00, "amp":expInfo['amplitude'], "freq":25, "pw":expInfo['pulse width'], 'npulse':50})
     params.update({"duration_test":params['npulse']/params["freq"]}) 
-    buf = MakeStimBuffer(params)
-    fake_buf = np.zeros(len(buf))
+    # only the amplitude changes between trials: the unit-amplitude train sets the task length, the
+    # trains themselves come from the amplitude bank built once the DAQ writer exists
+    stim_buffer = stim_cache.unit(params)
+    buf = stim_buffer.scale(params['amp'])
 
     # get computer info
     computer = platform.system()
@@ -406,39 +422,25 @@ def expr(expInfo):
     if bool(debug):
         blockcode = 'staircase_debug'
         raw_data_log, raw_data_writer = createdata()
-        nreversals = 0
+        engine = make_engine(method, params['amp'])
 
         trialn = 0
-        ampvec = []
         plotvec = []
 
-        while (nreversals < 8) and (params['amp'] > 0) and (params['amp']<3):
+        while not engine.done:
             trialn+=1
+            params['amp'] = engine.next()
             plotvec.append(params['amp'])
 
             #buf = MakeStimBuffer(params)
-            params, nreversals, response = debug_trial(params, nreversals,buf)
+            response = debug_trial(len(buf)/params['sr'])
+            engine.update(params['amp'], response == '2')
+            runningmean = engine.estimate()
             print(params['amp'])
-            if nreversals == 1:
-                ampvec.append(params['amp'])
-                runningmean = 0
-            elif nreversals > 2:
-                ampvec.append(params['amp'])
-                runningmean = np.mean(ampvec)
-            else:
-                runningmean = 0
             
-            trial_data = [build, computer, current_date, current_time, subject, group,trialn, params['amp'],params['pw'],response,runningmean]
+            trial_data = [build, computer, current_date, current_time, subject, group,trialn, params['amp'],params['pw'],response,runningmean,
+                method,engine.sd()]
             record_data(raw_data_writer,trial_data)
-            #print(trial_data)
-            #print(ampvec)
-
-            # update buf
-            if params['amp']>3:
-                params['amp']=3
-
-            elif params['amp']<0.1:
-                params['amp']=0.0
 
     else:
             
@@ -449,61 +451,62 @@ def expr(expInfo):
             task.timing.cfg_samp_clk_timing(rate=params["sr"],
                                     sample_mode=constants.AcquisitionType.FINITE,  # FINITE or CONTINUOUS
                                     samps_per_chan=len(buf))
-            writer = AnalogSingleChannelWriter(task.out_stream,auto_start=False)
+            # buffers are written unscaled as int16 DAC codes
+            writer = Int16Writer(task)
+            # every amplitude the engines can ask for (0 to 3 mA in 0.1 mA steps) is synthesized and
+            # quantized once, as the rows of one array; a trial only picks its row
+            bank = AmplitudeBank(MakeStimBuffer, params, quantize=writer.quantize)
+            print('amplitude bank: {} rows, {:.1f} MB, built in {:.1f} ms'.format(len(bank), bank.nbytes/2**20,
+                bank.build_time*1000))
+
+            # every train ends on the DAQ done event instead of a fixed wait
+            global train_done
+            train_done = TrainDone(task)
 
             # run first buffer as zeros (hack)
-            writer.write_many_sample(fake_buf)
-            task.start()
-            core.wait(0.601) # just in case
-            task.wait_until_done(10)
+            writer.write_many_sample(bank.get(0))
+            train_done.start()
+            train_done.wait(10)
             task.stop()
             
             
             blockcode = 'staircase'
             #global raw_data_log
             raw_data_log, raw_data_writer = createdata()
-            nreversals = 0
+            engine = make_engine(method, params['amp'])
 
             trialn = 0
-            ampvec = []
             plotvec = []
 
-            while (nreversals < 8) and (params['amp'] > 0) and (params['amp']<3):
+            # the engine picks every amplitude and decides when to stop (1 = didn't feel it, 2 = felt it)
+            while not engine.done:
                 trialn+=1
+                params['amp'] = engine.next()
                 plotvec.append(params['amp'])
 
-                buf = MakeStimBuffer(params)
-                params, nreversals, response = trial(params, nreversals,buf)
+                response = trial(bank.get(params['amp']))
+                engine.update(params['amp'], response == '2')
+                runningmean = engine.estimate()
                 print(params['amp'])
-                if nreversals == 1:
-                    ampvec.append(params['amp'])
-                    runningmean = 0
-                elif nreversals > 2:
-                    ampvec.append(params['amp'])
-                    runningmean = np.mean(ampvec)
-                else:
-                    runningmean = 0
-
-                trial_data = [build, computer, current_date, current_time, subject, group,trialn, params['amp'],params['pw'],response,runningmean]
-                record_data(raw_data_writer,trial_data)
-                #print(trial_data)
-                #print(ampvec)
-
-                # update buf
-                if params['amp']>3:
-                    params['amp']=3
 
-                elif params['amp']<0.1:
-                    params['amp']=0.0
+                trial_data = [build, computer, current_date, current_time, subject, group,trialn, params['amp'],params['pw'],response,runningmean,
+                    method,engine.sd()]
+                record_data(raw_data_writer,trial_data)
                     
             task.close()
+            print('amplitude bank: {}'.format(bank.stats()))
+            print(latency.report())
+            latency.save('logs/G{}S{}_staircase_stim_latency.csv'.format(group,subject))
+            daq.report('logs/G{}S{}_simdaq_staircase_trains.csv'.format(group,subject))
             
     raw_data_log.close()                    
-    print('----\nThreshold = {}, stim level = {}\n----'.format(np.round(runningmean,2),np.round(runningmean,2)-0.2))
+    print('----\nThreshold = {} (sd {:.2f} mA, {}, {} trials), stim level = {}\n----'.format(np.round(runningmean,2),
+        engine.sd(),method,engine.ntrials,np.round(runningmean,2)-0.2))
 
     mywin.close()
     
     # plot staircase (this doesn't seem to work, psychopy problem)
+    import matplotlib.pyplot as plt
     plt.plot(np.arange(1,len(plotvec)+1),plotvec)
     plt.hlines(y=runningmean,xmin=1,xmax=len(plotvec)+1)
     plt.show()
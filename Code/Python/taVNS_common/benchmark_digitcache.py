@@ -0,0 +1,39 @@
+# Times draw+flip of the SART digits when a single TextStim is updated before every flip (the old
+# way) and when the pre-built stims from digitcache.DigitStimCache are drawn.
+# Run from this folder: python benchmark_digitcache.py  (opens a full screen window, needs psychopy)
+from __future__ import division
+import os
+import random
+from psychopy import visual
+from digitcache import DigitStimCache, benchmark_draw_flip, report_draw_flip
+from frametrial import measure_refresh
+
+fontsizes = [0.1,0.13,0.16,0.19,0.21]
+mask = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','SART_Python','mask.png')
+
+
+def run(nrep=3, fullscr=True):
+    win = visual.Window(monitor="testMonitor", units="deg", color=(-1,-1,-1), fullscr=fullscr)
+    try:
+        refresh = measure_refresh(win)
+        textstim_args = dict(font='Arial', units='height', color=(1,1,1))
+        digit = visual.TextStim(win, text='', height=0.05, **textstim_args)
+        fixation = visual.ImageStim(win, image=mask, units='height', size=0.2)
+
+        cache = DigitStimCache(win, fontsizes, **textstim_args)
+        cache.warm(fixation)
+
+        # every (digit, fontsize) pair in a shuffled order, like a block of trials
+        combos = [(d, f) for f in fontsizes for d in range(1, 10)]
+        random.shuffle(combos)
+
+        results = benchmark_draw_flip(win, cache, digit, combos, nrep)
+        print('refresh {:.2f} Hz, {} stims, {} flips each'.format(refresh, len(cache), len(combos)*nrep))
+        print(report_draw_flip(results, refresh))
+    finally:
+        win.close()
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,120 @@
+# Compares the original loop + scipy.signal.convolve buffer construction with stimbuffer.pulse_train
+# over a grid of sampling rates, pulse frequencies and train durations, and the staircase's
+# per-trial rescale + quantize with a row lookup in the prebuilt stimbuffer.AmplitudeBank.
+# Run from this folder: python benchmark_stimbuffer.py
+from __future__ import division
+from time import perf_counter
+import numpy as np
+from scipy import signal
+from stimbuffer import pulse_train, UnitStimBuffer, AmplitudeBank
+from daqcodes import DeviceScaling
+
+
+##############################################################################################################
+#   Original implementation (copied from taVNS_custom_expr.py)
+##############################################################################################################
+
+def biphasic_waveform(amp, pw, ipd, sr):
+    if sr < 1000:
+        divisor = 1e4
+    elif (sr >=1000) and (sr < 9999):
+        divisor = 1e5
+    elif (sr >= 10000) and (sr < 99999):
+        divisor = 1e6
+    elif sr >= 100000:
+        divisor = 1e7
+    pws = np.ceil(pw*sr/divisor)
+    ipds = np.ceil(ipd*sr/divisor)
+    wf = np.zeros(int(pws*2+ipds))
+    wf[0:int(pws)] = -amp
+    wf[-int(pws):] = amp
+    wf = np.append(wf,0)
+    return wf
+
+
+def constant_rate_pulser(f, dur, sr):
+    ipis = np.floor(sr/f)
+    durs = np.floor(dur*sr)
+    pt = np.zeros(int(durs))
+    for i in range(0, int(durs-ipis),int(ipis)):
+        pt[i] = 1
+    return pt
+
+
+def legacy_buffer(wf, f, dur, sr, pad, method='auto'):
+    ptTest = constant_rate_pulser(f, dur, sr)
+    yTest = signal.convolve(ptTest, wf, method=method)
+    ypad = np.zeros(pad)
+    return np.concatenate((ypad, yTest),axis=0)
+
+
+def best_time(fun, nrep):
+    best = np.inf
+    for _ in range(nrep):
+        t0 = perf_counter()
+        fun()
+        best = min(best, perf_counter()-t0)
+    return best
+
+
+##############################################################################################################
+#   Benchmark
+##############################################################################################################
+
+def run(srs=(24000.0, 24414.0625, 44100.0), freqs=(1, 5, 25, 30, 100), durations=(0.6, 2.0, 30.0),
+    amp=1.0, pw=200, ipd=50, pad=10, nrep=5):
+
+    print('{:>10} {:>6} {:>7} {:>10} {:>12} {:>12} {:>8} {:>9}'.format(
+        'sr', 'freq', 'dur', 'nsamples', 'legacy (ms)', 'engine (ms)', 'speedup', 'identical'))
+    all_identical = True
+    for sr in srs:
+        wf = biphasic_waveform(amp, pw, ipd, sr)
+        for f in freqs:
+            for dur in durations:
+                # the direct convolution is the exact reference; the 'auto' method is what the
+                # scripts actually ran and is what gets timed
+                reference = legacy_buffer(wf, f, dur, sr, pad, method='direct')
+                buf = pulse_train(wf, f, dur, sr=sr, pad=pad)
+                identical = np.array_equal(reference, buf)
+                all_identical = all_identical and identical
+
+                t_legacy = best_time(lambda: legacy_buffer(wf, f, dur, sr, pad), nrep)
+                t_engine = best_time(lambda: pulse_train(wf, f, dur, sr=sr, pad=pad), nrep)
+                print('{:>10} {:>6} {:>7} {:>10} {:>12.3f} {:>12.3f} {:>8.1f} {:>9}'.format(
+                    sr, f, dur, len(buf), t_legacy*1e3, t_engine*1e3, t_legacy/t_engine, str(identical)))
+
+    print('\nall buffers identical: {}'.format(all_identical))
+    return all_identical
+
+
+def run_bank(sr=24000.0, freq=25, dur=2.0, pw=200, ipd=50, pad=100, nrep=5):
+    # taVNS_Staircase.py train: startup cost of the bank and per-trial cost against rescaling
+    params = {'sr': sr, 'freq': freq, 'pw': pw, 'amp': 1.0, 'duration_test': dur}
+    make_buffer = lambda p: pulse_train(biphasic_waveform(p['amp'], p['pw'], ipd, p['sr']), p['freq'],
+        p['duration_test'], sr=p['sr'], pad=pad)
+    quantize = DeviceScaling.simulated().to_codes
+
+    def per_amplitude():
+        return [quantize(make_buffer(dict(params, amp=amp))) for amp in np.round(np.arange(0, 3.01, 0.1), 2)]
+
+    bank = AmplitudeBank(make_buffer, params, quantize=quantize)
+    t_loop = best_time(per_amplitude, nrep)
+    t_bank = best_time(lambda: AmplitudeBank(make_buffer, params, quantize=quantize), nrep)
+    identical = all(np.array_equal(a, b) for a, b in zip(per_amplitude(), bank.buffers))
+
+    unit = UnitStimBuffer(make_buffer, params)
+    codes = np.empty(len(unit), dtype=np.int16)
+    amps = np.round(np.arange(0.1, 3.01, 0.1), 2)
+    t_scale = best_time(lambda: [quantize(unit.scale(amp), out=codes) for amp in amps], nrep)/len(amps)
+    t_row = best_time(lambda: [bank.get(amp) for amp in amps], nrep)/len(amps)
+    print('\namplitude bank: {} rows x {} samples, {:.1f} MB int16'.format(len(bank), bank.buffers.shape[1],
+        bank.nbytes/2**20))
+    print('  build: {:.2f} ms (one buffer per amplitude: {:.2f} ms), identical: {}'.format(t_bank*1e3,
+        t_loop*1e3, identical))
+    print('  per trial: {:.1f} us row lookup, {:.1f} us rescale + quantize'.format(t_row*1e6, t_scale*1e6))
+    return identical
+
+
+if __name__ == '__main__':
+    run()
+    run_bank()
@@ -0,0 +1,53 @@
+# Compares the original 0.1 mA up / 0.3 mA down staircase of taVNS_Staircase.py with the psi method
+# (threshold.PsiThreshold) on simulated observers: thresholds drawn over the range seen in the
+# staircase logs, random slopes, 2% false alarms and lapses. Reports the number of stimulation
+# trials and the error of the estimate against the observer's true 25% point (the point the
+# staircase converges to, and the target the script uses).
+# With 500 observers the psi method (stop sd 0.2 mA) needs about half the trials of the staircase for
+# less than half its RMS error; the staircase also undershoots by ~0.12 mA.
+# Run from this folder: python benchmark_threshold.py [nobservers]
+from __future__ import division
+import sys
+from time import perf_counter
+import numpy as np
+from threshold import UpDownStaircase, PsiThreshold, SimulatedObserver, simulate
+
+TARGET = 0.25
+# seconds per trial in taVNS_Staircase.py: 0.5 s + 0.1 s waits, a 2 s train, ~1 s to answer
+TRIAL_TIME = 3.6
+
+
+def run(make_engine, observers, seed):
+    estimates, ntrials, truths = [], [], []
+    t0 = perf_counter()
+    for i, (threshold, slope) in enumerate(observers):
+        observer = SimulatedObserver(threshold, slope, rng=seed+i)
+        estimate, n = simulate(make_engine(), observer)
+        estimates.append(estimate)
+        ntrials.append(n)
+        truths.append(observer.amplitude_at(TARGET))
+    elapsed = perf_counter()-t0
+    err = np.array(estimates)-np.array(truths)
+    ntrials = np.array(ntrials)
+    return {'trials': ntrials.mean(), 'trials_max': ntrials.max(), 'bias': err.mean(),
+        'rmse': np.sqrt(np.mean(err**2)), 'p90': np.percentile(np.abs(err), 90),
+        'ms_per_trial': elapsed/ntrials.sum()*1000}
+
+
+if __name__ == '__main__':
+    nobservers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rng = np.random.default_rng(0)
+    observers = list(zip(rng.uniform(0.5, 2.0, nobservers), rng.uniform(3, 12, nobservers)))
+
+    engines = [('staircase (original)', lambda: UpDownStaircase(start=0.1))]
+    for stop_sd in (0.25, 0.2, 0.15, 0.1):
+        engines.append(('psi, stop sd {:.2f} mA'.format(stop_sd),
+            lambda stop_sd=stop_sd: PsiThreshold(start=0.1, target=TARGET, stop_sd=stop_sd)))
+
+    print('{} simulated observers, error against the true {:.0f}% point'.format(nobservers, TARGET*100))
+    print('{:<24}{:>8}{:>6}{:>10}{:>8}{:>8}{:>8}{:>10}'.format('engine', 'trials', 'max', 'session', 'bias',
+        'rmse', '|e|90', 'ms/trial'))
+    for name, make_engine in engines:
+        r = run(make_engine, observers, seed=1)
+        print('{:<24}{:8.1f}{:6d}{:9.0f}s{:8.3f}{:8.3f}{:8.3f}{:10.3f}'.format(name, r['trials'], r['trials_max'],
+            r['trials']*TRIAL_TIME, r['bias'], r['rmse'], r['p90'], r['ms_per_trial']))
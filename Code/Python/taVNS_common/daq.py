@@ -0,0 +1,39 @@
+# Picks the DAQ backend for the stimulation scripts.
+#
+# Set the environment variable TAVNS_SIMULATE_DAQ=1 to run the real stimulation code paths against
+# the simulated backend (simdaq) instead of the NI driver, e.g. to test a script without hardware
+# or to measure its stim timing:
+#   TAVNS_SIMULATE_DAQ=1 python SART_taVNS.py
+# The scripts import the backend as
+#   from daq import nidaqmx, constants, AnalogSingleChannelWriter
+import os
+
+SIMULATED = os.environ.get('TAVNS_SIMULATE_DAQ', '0').strip().lower() not in ('', '0', 'false', 'no')
+
+if SIMULATED:
+    import simdaq as nidaqmx
+    from simdaq import constants, stream_writers, system
+else:
+    import nidaqmx
+    import nidaqmx.system
+    import nidaqmx.stream_writers
+    from nidaqmx import constants, stream_writers, system
+
+AnalogSingleChannelWriter = stream_writers.AnalogSingleChannelWriter
+AnalogUnscaledWriter = stream_writers.AnalogUnscaledWriter
+DigitalSingleChannelWriter = stream_writers.DigitalSingleChannelWriter
+
+
+def connect(line, terminal):
+    # a digital output line cabled to a trigger terminal: wired in simdaq, a physical cable on hardware
+    if SIMULATED:
+        nidaqmx.connect(line, terminal)
+
+
+def report(filename=None):
+    # print (and optionally save) what the simulated backend put out; no-op on real hardware
+    if not SIMULATED:
+        return
+    print(nidaqmx.recorder.summary())
+    if filename is not None:
+        nidaqmx.recorder.save(filename)
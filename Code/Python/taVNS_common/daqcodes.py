@@ -0,0 +1,135 @@
+##############################################################################################################
+##############################################################################################################
+#   int16 (unscaled) DAQ output
+##############################################################################################################
+##############################################################################################################
+# AnalogSingleChannelWriter.write_many_sample takes float64 volts and the driver converts them to
+# DAC codes on every write. The conversion is a polynomial given by the channel's
+# ao_dev_scaling_coeff (code = c0 + c1*v + ...), rounded and clipped to the DAC range. Stim buffers
+# only change a few times per session, so we do that conversion once ourselves, keep the buffer as
+# int16 (4x smaller than float64) and write the codes with AnalogUnscaledWriter.write_int16.
+#
+# DeviceScaling.simulated() is a stand-in for a typical 16 bit, +-10 V NI output channel so the
+# quantized path can be checked without hardware (see verify_quantization and __main__ below).
+from __future__ import division
+import numpy as np
+
+
+class DeviceScaling(object):
+
+    def __init__(self, coeff, resolution=16):
+        # coeff: polynomial coefficients volts -> codes, lowest order first (as reported by nidaqmx)
+        # resolution: DAC resolution in bits
+        self.coeff = np.asarray(coeff, dtype=float)
+        self.resolution = int(resolution)
+        self.code_min = -2**(self.resolution-1)
+        self.code_max = 2**(self.resolution-1)-1
+
+    @classmethod
+    def from_channel(cls, chan):
+        # chan: nidaqmx AOChannel, e.g. task.ao_channels[0]
+        return cls(chan.ao_dev_scaling_coeff, int(chan.ao_resolution))
+
+    @classmethod
+    def simulated(cls, vmin=-10.0, vmax=10.0, resolution=16, offset=0.0, gain=1.0):
+        # ideal bipolar DAC, optionally with a calibration offset (in codes) and gain error
+        slope = gain*2**resolution/(vmax-vmin)
+        return cls([offset, slope], resolution)
+
+    @property
+    def lsb(self):
+        # volts per code for a linear scaling
+        return 1/self.coeff[1]
+
+    def to_float_codes(self, volts):
+        # unrounded codes (Horner's rule over the coefficients)
+        volts = np.asarray(volts, dtype=float)
+        codes = np.full(volts.shape, self.coeff[-1])
+        for c in self.coeff[-2::-1]:
+            codes *= volts
+            codes += c
+        return codes
+
+    def to_codes(self, volts, out=None):
+        # volts -> int16 device codes, rounded to nearest and clipped to the DAC range
+        codes = np.rint(self.to_float_codes(volts))
+        np.clip(codes, self.code_min, self.code_max, out=codes)
+        if out is None:
+            return codes.astype(np.int16)
+        out[...] = codes
+        return out
+
+    def to_volts(self, codes):
+        # inverse of a linear scaling (what the DAC puts out for a code)
+        if len(self.coeff) > 2 and np.any(self.coeff[2:]):
+            raise ValueError('to_volts only supports linear scaling coefficients')
+        return (np.asarray(codes, dtype=float)-self.coeff[0])/self.coeff[1]
+
+
+class Int16Writer(object):
+    # wraps AnalogUnscaledWriter so the scripts can write pre-quantized buffers
+
+    def __init__(self, task, scaling=None, auto_start=False):
+        from daq import AnalogUnscaledWriter
+        if scaling is None:
+            scaling = DeviceScaling.from_channel(task.ao_channels[0])
+        self.scaling = scaling
+        self.writer = AnalogUnscaledWriter(task.out_stream, auto_start=auto_start)
+
+    def quantize(self, buf, out=None):
+        return self.scaling.to_codes(buf, out=out)
+
+    def write_codes(self, codes, timeout=10.0):
+        # codes: 1-D int16 array for the single output channel
+        return self.writer.write_int16(np.ascontiguousarray(codes, dtype=np.int16).reshape(1, -1),
+            timeout=timeout)
+
+    def write_many_sample(self, buf, timeout=10.0):
+        # float buffers are quantized here, int16 buffers are written as they are
+        if np.asarray(buf).dtype != np.int16:
+            buf = self.quantize(buf)
+        return self.write_codes(buf, timeout=timeout)
+
+
+def driver_codes(volts, scaling):
+    # stand-in for the driver's conversion of a float64 write (the path used by write_many_sample),
+    # written independently of DeviceScaling.to_codes: polyval and round-half-up
+    codes = np.polyval(scaling.coeff[::-1], np.asarray(volts, dtype=float))
+    codes = np.clip(np.floor(codes+0.5), scaling.code_min, scaling.code_max)
+    return codes.astype(np.int16)
+
+
+def verify_quantization(buf, scaling):
+    # compare the codes the driver would produce from the float buffer with the pre-quantized
+    # int16 buffer; returns (max code difference, max output error in volts)
+    if len(buf) == 0:
+        return 0, 0.0
+    float_path = driver_codes(buf, scaling).astype(int)
+    int16_path = scaling.to_codes(buf).astype(int)
+    max_lsb = int(np.max(np.abs(float_path-int16_path)))
+    max_volts = float(np.max(np.abs(scaling.to_volts(int16_path)-buf)))
+    return max_lsb, max_volts
+
+
+if __name__ == '__main__':
+    from stimbuffer import pulse_train
+
+    def biphasic(amp, pw, ipd, sr):
+        pws = int(np.floor(pw*sr/1e6))
+        ipds = int(np.floor(ipd*sr/1e6))
+        wf = np.zeros(pws*2+ipds+1)
+        wf[:pws] = -amp
+        wf[pws+ipds:pws*2+ipds] = amp
+        return wf
+
+    for scaling in (DeviceScaling.simulated(), DeviceScaling.simulated(offset=-3.2, gain=1.0004)):
+        worst_lsb = 0
+        worst_volts = 0.0
+        for amp in np.round(np.arange(0, 3.01, 0.1), 2):
+            buf = pulse_train(biphasic(amp, 200, 50, 24000.0), 25, 2.0, sr=24000.0, pad=100)
+            max_lsb, max_volts = verify_quantization(buf, scaling)
+            worst_lsb = max(worst_lsb, max_lsb)
+            worst_volts = max(worst_volts, max_volts)
+        print('coeff {}: max difference {} LSB, max error {:.2e} V (1 LSB = {:.2e} V), {} -> {} bytes'.format(
+            scaling.coeff, worst_lsb, worst_volts, scaling.lsb, buf.nbytes, scaling.to_codes(buf).nbytes))
+        assert worst_lsb <= 1 and worst_volts <= scaling.lsb
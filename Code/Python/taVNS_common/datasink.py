@@ -0,0 +1,176 @@
+##############################################################################################################
+##############################################################################################################
+#   Background trial data writer
+##############################################################################################################
+##############################################################################################################
+# record_data wrote every trial row to the csv from inside the trial loop, and SART.py never closed
+# the file, so rows still in the file buffer were lost when the script crashed. TrialDataSink
+# takes the rows off the trial loop:
+#
+#   - writerow() only appends the row to a collections.deque (atomic, no lock is taken) and wakes
+#     the writer thread
+#   - the writer thread appends whatever has queued up in one batch to a write-ahead journal
+#     (<file>.journal) and fsyncs it, so a row is on disk within flush_interval of the trial
+#   - the csv itself is only written at sync() (block boundaries) and close() (end of session,
+#     quit): both wait until every queued row is in the journal, then write the rows the csv does
+#     not have yet and fsync it; close() then removes the journal
+#
+# The csv is therefore always a prefix of the journal. A journal left behind means the session did
+# not close cleanly: recover() keeps the complete rows of the csv and replays the journal rows past
+# them, and a new TrialDataSink on the same file name first moves the recovered data out of the way
+# (<file>.recovered-<time>.csv) instead of overwriting it.
+#
+# The sink has the writerow/close interface of the csv writer + file pair it replaces:
+#   raw_data_writer = raw_data_log = TrialDataSink(filename, data['columns'])
+from __future__ import division
+from collections import deque
+from datetime import datetime
+import atexit
+import csv
+import io
+import os
+import threading
+
+
+class TrialDataSink(object):
+
+    def __init__(self, filename, columns, flush_interval=0.5):
+        # filename: csv to write; columns: header row
+        # flush_interval: longest time (s) a row waits in the queue before it reaches the journal
+        self.filename = filename
+        self.journal = filename+'.journal'
+        self.flush_interval = flush_interval
+        if os.path.exists(self.journal):
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            recovered = recover(filename, '{}.recovered-{}.csv'.format(os.path.splitext(filename)[0], stamp))
+            print('{}: previous session was not closed, {} rows recovered'.format(filename, recovered))
+
+        self._rows = deque()
+        self._wake = threading.Event()
+        self._written = threading.Condition()
+        self._nqueued = 0
+        self._nwritten = 0
+        self._error = None
+        self._pending = []          # journaled batches not yet in the csv
+        self._closed = False
+        self._journal = open(self.journal, 'w', newline='', encoding='utf-8')
+        self._file = open(filename, 'w', newline='', encoding='utf-8')
+        self.writerow(columns)
+        self._thread = threading.Thread(target=self._run, name='TrialDataSink', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def writerow(self, row):
+        # queue one row (returns immediately)
+        if self._closed:
+            raise ValueError('write to closed TrialDataSink {}'.format(self.filename))
+        if self._error is not None:
+            raise self._error
+        self._rows.append(list(row))
+        self._nqueued += 1
+        self._wake.set()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def sync(self, timeout=None):
+        # block until every queued row is journaled, then write it to the csv and fsync
+        # (call at block boundaries)
+        self._wait_written(timeout)
+        with self._written:
+            self._file.write(''.join(self._pending))
+            self._pending = []
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        # write the remaining rows, fsync, stop the writer thread and remove the journal
+        if self._closed:
+            return
+        self.sync()
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self._file.close()
+        self._journal.close()
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        atexit.unregister(self.close)
+
+    def _wait_written(self, timeout=None):
+        target = self._nqueued
+        self._wake.set()
+        with self._written:
+            if not self._written.wait_for(lambda: self._nwritten >= target or self._error is not None, timeout):
+                raise RuntimeError('timed out waiting for {} to be written'.format(self.filename))
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            batch = []
+            while self._rows:
+                batch.append(self._rows.popleft())
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as err:
+                    self._error = err
+            with self._written:
+                self._nwritten += len(batch)
+                self._written.notify_all()
+            if self._closed and not self._rows:
+                break
+
+    def _write_batch(self, batch):
+        text = io.StringIO()
+        csv.writer(text).writerows(batch)
+        text = text.getvalue()
+        # write-ahead: the batch is on disk in the journal before it counts as written; the csv
+        # gets it at the next sync()
+        self._journal.write(text)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        with self._written:
+            self._pending.append(text)
+
+
+def _complete_lines(filename):
+    # the lines of a file up to its last newline (a row cut off by a crash is dropped)
+    if not os.path.exists(filename):
+        return []
+    with open(filename, newline='', encoding='utf-8') as f:
+        text = f.read()
+    return text[:text.rfind('\n')+1].splitlines(True)
+
+
+def recover(filename, target=None):
+    # complete rows of the csv + the journal rows past them; returns the number of data rows
+    # target: where to write the rebuilt csv (default: filename itself)
+    journal = filename+'.journal'
+    lines = _complete_lines(filename)
+    lines += _complete_lines(journal)[len(lines):]
+    text = ''.join(lines)
+    with open(target or filename, 'w', newline='', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(journal)
+    nrows = len(list(csv.reader(io.StringIO(text))))
+    return max(0, nrows-1)
+
+
+if __name__ == '__main__':
+    # python datasink.py <file.csv>: rebuild a csv from the journal left by a crashed session
+    import sys
+    for name in sys.argv[1:]:
+        print('{}: {} rows recovered'.format(name, recover(name)))
@@ -0,0 +1,119 @@
+##############################################################################################################
+##############################################################################################################
+#   Low-CPU deadline scheduler
+##############################################################################################################
+##############################################################################################################
+# The experiment loops used to wait with `while t < target: t = perf_counter()-start`, which keeps
+# one core at 100% for the whole session and competes with the DAQ driver and the display.
+# DeadlineScheduler sleeps until shortly before each deadline and only spins for the last
+# millisecond. Deadlines are absolute (seconds since the session start), so an event that is late
+# does not shift the ones after it, and the lateness of every event is kept for a summary at the end.
+#
+#   clock = DeadlineScheduler()
+#   clock.start()
+#   for onset in onsets:
+#       clock.wait_until(onset, 'stim')     # seconds from session start
+#       ...
+#   print(clock.report())
+#
+# time.sleep can overshoot by several ms (the default Windows timer runs at ~15.6 ms), so the
+# margin before a deadline follows the largest recent overshoot (up to max_margin).
+from __future__ import division
+from time import perf_counter
+import time
+import numpy as np
+
+
+class DeadlineScheduler(object):
+
+    def __init__(self, spin=1e-3, max_margin=20e-3, clock=perf_counter, sleep=time.sleep):
+        # spin: time before a deadline that is busy-waited instead of slept
+        # max_margin: upper bound for the sleep overshoot correction
+        # clock/sleep: time source and sleep function (replaceable for simulated runs)
+        self.spin = spin
+        self.max_margin = max_margin
+        self.margin = spin
+        self.clock = clock
+        self.sleep = sleep
+        self.t0 = None
+        self.deadline = 0.0
+        self.labels = []
+        self.deadlines = []
+        self.lateness = []
+
+    def start(self, t0=None):
+        # session start; all deadlines are relative to it
+        self.t0 = self.clock() if t0 is None else t0
+        self.deadline = 0.0
+        return self.t0
+
+    def elapsed(self):
+        return self.clock()-self.t0
+
+    def wait_until(self, deadline, label=''):
+        # block until `deadline` seconds after start(); returns the lateness in seconds
+        if self.t0 is None:
+            self.start()
+        target = self.t0+deadline
+        remaining = target-self.clock()
+        if remaining > self.margin:
+            wake = target-self.margin
+            self.sleep(remaining-self.margin)
+            # follow the largest recent overshoot, decaying back towards spin
+            overshoot = self.clock()-wake
+            self.margin = min(self.max_margin, max(overshoot+self.spin, self.spin+0.9*(self.margin-self.spin)))
+        while self.clock() < target:
+            pass
+        late = self.clock()-target
+        self.deadline = deadline
+        self.labels.append(label)
+        self.deadlines.append(deadline)
+        self.lateness.append(late)
+        return late
+
+    def wait(self, seconds, label=''):
+        # next deadline `seconds` after the previous deadline (not after now), so errors don't add up
+        return self.wait_until(self.deadline+seconds, label)
+
+    def stats(self, label=None):
+        # lateness summary in seconds, for all events or the ones with the given label
+        late = np.asarray([l for l, lab in zip(self.lateness, self.labels) if label is None or lab == label])
+        if late.size == 0:
+            return {'n': 0}
+        return {'n': late.size, 'mean': late.mean(), 'median': np.median(late),
+            'p95': np.percentile(late, 95), 'p99': np.percentile(late, 99), 'max': late.max()}
+
+    def report(self):
+        lines = ['{:>10} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'event', 'n', 'mean (ms)', 'median', 'p95', 'p99', 'max')]
+        labels = [None] + sorted(set(self.labels))
+        for label in labels:
+            s = self.stats(label)
+            if s['n'] == 0:
+                continue
+            lines.append('{:>10} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                'all' if label is None else label, s['n'], s['mean']*1e3, s['median']*1e3, s['p95']*1e3,
+                s['p99']*1e3, s['max']*1e3))
+        lines.append('sleep margin {:.2f} ms'.format(self.margin*1e3))
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        import csv
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('event', 'label', 'deadline_s', 'lateness_s'))
+            for i, (label, deadline, late) in enumerate(zip(self.labels, self.deadlines, self.lateness)):
+                writer.writerow((i+1, label, deadline, late))
+
+
+if __name__ == '__main__':
+    # lateness and CPU time for 50 events ~20 ms apart (a busy-wait would use cpu == wall)
+    import random
+    clock = DeadlineScheduler()
+    cpu = time.process_time()
+    clock.start()
+    for i in range(50):
+        clock.wait(0.02+random.random()*0.005, 'event')
+    cpu = time.process_time()-cpu
+    print(clock.report())
+    print('wall {:.3f} s, cpu {:.3f} s'.format(clock.elapsed(), cpu))
@@ -0,0 +1,93 @@
+##############################################################################################################
+##############################################################################################################
+#   Pre-rendered SART digit stimuli
+##############################################################################################################
+##############################################################################################################
+# The SART trials set digit.height and digit.text on one TextStim right before the digit flip,
+# which makes PsychoPy lay out the text again and upload a new glyph texture in the time critical
+# frame. There are only 9 digits x 5 fontsizes, so DigitStimCache builds one TextStim per
+# (digit, fontsize) pair at startup and draws each of them (and the mask) once to the back buffer
+# so the textures are on the GPU before the first trial. A trial then only picks a stim:
+#
+#   digit_stims = DigitStimCache(mywin, fontsizes, font='Arial', units='height', color=(1,1,1))
+#   digit_stims.warm(fixation)
+#   ...
+#   frame_scheduler.run(digit_stims.get(digitvalue, fontsize), fixation)
+#
+# benchmark_draw_flip() times draw+flip for the cached stims against updating a single TextStim.
+from __future__ import division
+from time import perf_counter
+import numpy as np
+
+
+def _key(digit, fontsize):
+    # digits come as int, numpy int or str depending on the script
+    return int(digit), round(float(fontsize), 6)
+
+
+class DigitStimCache(object):
+
+    def __init__(self, win, fontsizes, digits=range(1, 10), **textstim_args):
+        # win: psychopy Window; textstim_args: passed to every visual.TextStim (font, units, color, ...)
+        self.win = win
+        self.textstim_args = textstim_args
+        self.stims = {}
+        for fontsize in fontsizes:
+            for digit in digits:
+                self._build(digit, fontsize)
+
+    def __len__(self):
+        return len(self.stims)
+
+    def _build(self, digit, fontsize):
+        from psychopy import visual
+        stim = visual.TextStim(self.win, text=str(int(digit)), height=fontsize, **self.textstim_args)
+        self.stims[_key(digit, fontsize)] = stim
+        return stim
+
+    def get(self, digit, fontsize):
+        # the pre-built stim (a pair that was not built up front is built, and kept, on first use)
+        stim = self.stims.get(_key(digit, fontsize))
+        if stim is None:
+            stim = self._build(digit, fontsize)
+        return stim
+
+    def warm(self, *others):
+        # draw every stim (and e.g. the mask) once into the back buffer, then clear it unseen
+        for stim in list(self.stims.values())+list(others):
+            stim.draw()
+        self.win.clearBuffer()
+
+
+def benchmark_draw_flip(win, cache, digit, combos, nrep=3):
+    # draw+flip for every (digit, fontsize) pair in combos, nrep times, once by updating `digit`
+    # (a single TextStim, the old way) and once from the cache
+    # returns {'single':..., 'cached':...} with the draw times (s) and flip intervals (s)
+    results = {}
+    for name in ('single', 'cached'):
+        draw_times = []
+        flips = [win.flip()]
+        for _ in range(nrep):
+            for value, fontsize in combos:
+                t0 = perf_counter()
+                if name == 'single':
+                    digit.height = fontsize
+                    digit.text = value
+                    digit.draw()
+                else:
+                    cache.get(value, fontsize).draw()
+                draw_times.append(perf_counter()-t0)
+                flips.append(win.flip())
+        results[name] = {'draw': np.array(draw_times), 'intervals': np.diff(flips)}
+    return results
+
+
+def report_draw_flip(results, refresh):
+    # text summary of benchmark_draw_flip; a flip interval over 1.5 frames counts as a dropped frame
+    lines = ['{:>8} {:>12} {:>12} {:>14} {:>10}'.format('', 'draw (ms)', 'max draw', 'max frame (ms)',
+        'dropped')]
+    for name, r in results.items():
+        dropped = int(np.sum(r['intervals'] > 1.5/refresh))
+        lines.append('{:>8} {:>12.3f} {:>12.3f} {:>14.3f} {:>10}'.format(name, r['draw'].mean()*1e3,
+            r['draw'].max()*1e3, r['intervals'].max()*1e3, dropped))
+    return '\n'.join(lines)
@@ -0,0 +1,195 @@
+##############################################################################################################
+##############################################################################################################
+#   Binary trial event stream
+##############################################################################################################
+##############################################################################################################
+# The SART scripts logged 'digit start', 'fixation start', 'stim start' and 'stim stop' as lines of
+# text through psychopy's LogFile, and extract_SART_data_from_log.py had to find them again with
+# str.contains after skipping a hard coded number of lines. EventRecorder appends fixed width
+# binary records to a memory-mapped file instead:
+#
+#   t      float64   perf_counter seconds (the clock of the StimTiming timestamps)
+#   code   uint16    event code (EVENT_CODES)
+#   block  int16     block number (0: practice), set with start_block()
+#   trial  int32     trial number within the block (-1: not a trial event)
+#   value  float64   event value (key press: RT in s, stim: amplitude / train duration, block: seed)
+#
+# A record is one store into the mapped pages plus the record count in the file header (a few
+# microseconds, no system call); the pages reach the disk through the OS even if the script dies.
+# read_events() maps the file back as a NumPy structured array without copying or parsing:
+#
+#   events = EventRecorder('logs/G1S1_sart_events.bin')
+#   events.start_block(1)
+#   events.record(DIGIT_START, trial=12)
+#   events.close()
+#   ...
+#   ev = read_events('logs/G1S1_sart_events.bin')
+#   rts = ev['value'][ev['code'] == KEY_SPACE]
+from __future__ import division
+from time import perf_counter
+import os
+import threading
+import time
+import numpy as np
+
+EVENT_DTYPE = np.dtype([
+    ('t', '<f8'),
+    ('code', '<u2'),
+    ('block', '<i2'),
+    ('trial', '<i4'),
+    ('value', '<f8'),
+])
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('itemsize', '<u4'),
+    ('count', '<u8'),
+    ('t0', '<f8'),              # perf_counter when the file was created
+    ('created', '<f8'),         # time.time() at the same moment, to convert t to wall clock time
+    ('pad', 'V24'),
+])
+
+MAGIC = b'TVNSEVT1'
+VERSION = 1
+
+# event codes
+BLOCK_START = 1
+DIGIT_START = 2
+FIXATION_START = 3
+DIGIT_CLEARED = 4
+KEY_SPACE = 5
+KEY_QUIT = 6
+KEY_OTHER = 7
+STIM_START = 8
+STIM_STOP = 9
+STIM_ERROR = 10
+
+EVENT_CODES = {
+    'block start': BLOCK_START,
+    'digit start': DIGIT_START,
+    'fixation start': FIXATION_START,
+    'digit cleared': DIGIT_CLEARED,
+    'key space': KEY_SPACE,
+    'key q': KEY_QUIT,
+    'key other': KEY_OTHER,
+    'stim start': STIM_START,
+    'stim stop': STIM_STOP,
+    'stim error': STIM_ERROR,
+}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+
+
+def key_code(name):
+    return EVENT_CODES.get('key {}'.format(name), KEY_OTHER)
+
+
+class EventRecorder(object):
+
+    def __init__(self, filename, capacity=1 << 16):
+        # capacity: records mapped up front (the file grows by doubling when it is full)
+        self.filename = filename
+        self.block = 0
+        self._lock = threading.Lock()
+        self._count = 0
+        self._capacity = 0
+        with open(filename, 'wb'):
+            pass
+        self._map(capacity)
+        header = self._header[0]
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['itemsize'] = EVENT_DTYPE.itemsize
+        header['count'] = 0
+        header['t0'] = perf_counter()
+        header['created'] = time.time()
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _map(self, capacity):
+        size = HEADER_DTYPE.itemsize+capacity*EVENT_DTYPE.itemsize
+        with open(self.filename, 'r+b') as f:
+            f.truncate(size)
+        self._mm = np.memmap(self.filename, dtype=np.uint8, mode='r+', shape=(size,))
+        self._header = self._mm[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        self._records = self._mm[HEADER_DTYPE.itemsize:].view(EVENT_DTYPE)
+        self._capacity = capacity
+
+    def _unmap(self):
+        self._mm.flush()
+        # the mapping is only released once no view of it is left (needed to resize it on Windows)
+        del self._header, self._records, self._mm
+
+    def record(self, code, trial=-1, value=np.nan, t=None):
+        # append one event; t: perf_counter time of the event (now when None)
+        if t is None:
+            t = perf_counter()
+        with self._lock:
+            i = self._count
+            if i == self._capacity:
+                self._unmap()
+                self._map(2*i)
+            self._records[i] = (t, code, self.block, trial, value)
+            self._count = i+1
+            self._header['count'] = i+1
+
+    def start_block(self, block, value=np.nan):
+        # following events belong to `block`; records a BLOCK_START event (value e.g. the plan seed)
+        self.block = block
+        self.record(BLOCK_START, -1, value)
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        # flush and cut the file to the records written
+        if self._capacity == 0:
+            return
+        with self._lock:
+            self._unmap()
+            with open(self.filename, 'r+b') as f:
+                f.truncate(HEADER_DTYPE.itemsize+self._count*EVENT_DTYPE.itemsize)
+            self._capacity = 0
+
+
+def read_header(filename):
+    header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != MAGIC:
+        raise ValueError('{} is not an event file'.format(filename))
+    return header[0]
+
+
+def read_events(filename):
+    # the recorded events as a read-only structured array (EVENT_DTYPE) mapped from the file
+    count = int(read_header(filename)['count'])
+    if count == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.memmap(filename, dtype=EVENT_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(count,))
+
+
+def event_names(codes):
+    return np.array([EVENT_NAMES.get(int(c), str(int(c))) for c in codes])
+
+
+if __name__ == '__main__':
+    # self-check and cost per record
+    import tempfile
+    filename = os.path.join(tempfile.mkdtemp(), 'events.bin')
+    n = 100000
+    with EventRecorder(filename, capacity=1024) as events:
+        events.start_block(1, 12345)
+        t0 = perf_counter()
+        for i in range(n):
+            events.record(DIGIT_START, i)
+        elapsed = perf_counter()-t0
+    ev = read_events(filename)
+    assert len(ev) == n+1 and (ev['trial'][1:] == np.arange(n)).all() and (ev['block'] == 1).all()
+    assert os.path.getsize(filename) == HEADER_DTYPE.itemsize+(n+1)*EVENT_DTYPE.itemsize
+    print('{:.2f} us per record, {} records read back'.format(elapsed/n*1e6, len(ev)))
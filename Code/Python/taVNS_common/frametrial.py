@@ -0,0 +1,288 @@
+##############################################################################################################
+##############################################################################################################
+#   Frame-locked SART trial scheduler
+##############################################################################################################
+##############################################################################################################
+# The SART trials timed the digit and the mask with core.wait/core.StaticPeriod and read the keys
+# once after the mask, so the digit duration snapped to whichever refresh came after the period
+# and the key time was only known relative to a clock reset before the flip. FrameTrialScheduler
+# counts frames instead:
+#
+#   - the refresh rate is measured once (win.getActualFrameRate) and the digit and mask durations
+#     are converted to whole frames
+#   - the digit and the mask are drawn and flipped every frame, and the keyboard is polled after
+#     every flip and once more at the end of the last mask frame (and of the ITI, iti=), so no key
+#     is left for the next trial to clear; a stop key ('q') anywhere in a poll ends the trial
+#   - onsets are the timestamps returned by win.flip() (core.getTime() seconds) and response times
+#     are measured from the digit flip (the keyboard clock is reset on that flip)
+#   - the digit flip is also stamped with time.perf_counter (win.callOnFlip), the clock of the stim
+#     timing, and that time is passed to on_digit_flip (e.g. as the t_ref of a stim train)
+#
+#   scheduler = FrameTrialScheduler(mywin, 0.25, 0.9)
+#   result = scheduler.run(digit, fixation, on_digit_flip=start_stim)
+#   result.response, result.rt, result.digit_duration, ...
+#
+# Keys come from psychopy.hardware.keyboard.Keyboard (psychtoolbox timestamps where available);
+# with use_keyboard=False psychopy.event is polled on every frame instead (frame resolution).
+#
+# Display timing:
+#   - preflight(win) flips a run of blank frames before the first block and reports the refresh
+#     interval and its jitter (and dropped frames); pass its refresh rate to the scheduler
+#   - every result has its frame intervals, dropped frames and the SOA from the previous trial's
+#     digit onset (reset_soa() at the start of a block, or after anything that is not a trial)
+#   - with clear=False the mask stays up until the next trial's digit flip, so back to back trials
+#     are exactly ITI + digit + mask apart (the clearing flip would add a frame to every SOA)
+#   - with an eventlog.EventRecorder (events=) the digit, mask and clear flips and the key presses
+#     are recorded there instead of psychopy.logging
+#   - flag_soa() lists the trials of a saved data file whose SOA deviated from the nominal one
+from __future__ import division
+from time import perf_counter
+import csv
+import numpy as np
+
+import eventlog
+
+
+class FrameTrialResult(object):
+
+    __slots__ = ('flips', 'ndigit', 'period', 'cleared', 'soa', 'response', 'rt', 'keys', 't_onset')
+
+    def __init__(self, ndigit, period):
+        self.flips = []         # timestamp of every flip: digit frames, mask frames, then the clearing flip
+        self.ndigit = ndigit    # number of digit frames
+        self.period = period    # nominal frame period (s)
+        self.cleared = True     # False: no clearing flip, the mask is up until the next flip
+        self.soa = None         # time from the previous trial's digit flip (s), None for the first trial
+        self.response = '0'     # first key pressed ('0' for none)
+        self.rt = 0             # its time from the digit flip in seconds (0 for none)
+        self.keys = []          # (name, rt) of every key collected
+        self.t_onset = None     # perf_counter time of the digit flip
+
+    @property
+    def t_digit(self):
+        return self.flips[0]
+
+    @property
+    def t_mask(self):
+        return self.flips[self.ndigit]
+
+    @property
+    def t_clear(self):
+        # end of the mask: the clearing flip, or one frame after the last mask flip
+        return self.flips[-1] if self.cleared else self.flips[-1]+self.period
+
+    @property
+    def digit_duration(self):
+        return self.t_mask-self.t_digit
+
+    @property
+    def mask_duration(self):
+        return self.t_clear-self.t_mask
+
+    @property
+    def duration(self):
+        return self.t_clear-self.t_digit
+
+    def frame_intervals(self):
+        return [b-a for a, b in zip(self.flips[:-1], self.flips[1:])]
+
+    def dropped_frames(self):
+        # refreshes missed between the flips of this trial
+        intervals = np.diff(self.flips)
+        return int(np.sum(np.maximum(np.round(intervals/self.period)-1, 0)))
+
+    def max_interval(self):
+        return max(self.frame_intervals() or [0.0])
+
+
+class RefreshCheck(object):
+    # frame intervals of a run of blank flips
+
+    def __init__(self, intervals):
+        self.intervals = np.asarray(intervals)
+        self.period = float(np.median(self.intervals))
+        self.refresh = 1/self.period
+        self.jitter = float(np.std(self.intervals))
+        self.dropped = int(np.sum(np.maximum(np.round(self.intervals/self.period)-1, 0)))
+
+    def __str__(self):
+        return ('refresh {:.3f} Hz: interval {:.3f} ms (median), jitter {:.3f} ms (sd), min {:.3f} ms, '
+            'max {:.3f} ms, {} dropped frames in {} flips').format(self.refresh, self.period*1e3,
+            self.jitter*1e3, self.intervals.min()*1e3, self.intervals.max()*1e3, self.dropped,
+            len(self.intervals))
+
+
+def preflight(win, nframes=240, nwarmup=20):
+    # flip nwarmup + nframes blank frames and measure the refresh interval and jitter
+    for _ in range(nwarmup):
+        win.flip()
+    flips = [win.flip() for _ in range(nframes+1)]
+    return RefreshCheck(np.diff(flips))
+
+
+def save_display_check(filename, check, scheduler):
+    # the display timing of the session (pre-flight result and frames per digit/mask) as a small text
+    # file, written as soon as it is measured
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('display pre-flight: {}\n'.format(check))
+        f.write('refresh {:.3f} Hz: digit {} frames, mask {} frames\n'.format(scheduler.refresh,
+            scheduler.digit_frames, scheduler.mask_frames))
+
+
+def measure_refresh(win, fallback=60.0):
+    # measured refresh rate in Hz (the monitor's nominal rate can be off, e.g. 59.94 Hz)
+    from psychopy import logging
+    rate = win.getActualFrameRate(nIdentical=20, nMaxFrames=240, nWarmUpFrames=20, threshold=1)
+    if rate is None:
+        logging.warning('could not measure the refresh rate, assuming {} Hz'.format(fallback))
+        rate = fallback
+    return rate
+
+
+class FrameTrialScheduler(object):
+
+    def __init__(self, win, digit_time, mask_time, keyList=('q', 'space'), refresh=None, use_keyboard=True,
+        events=None):
+        # win: psychopy Window; digit_time/mask_time: durations in seconds
+        # refresh: refresh rate in Hz (measured when not given)
+        # events: eventlog.EventRecorder for the flip and key events (else they go to psychopy.logging)
+        self.win = win
+        self.events = events
+        self.keyList = list(keyList)
+        self.refresh = measure_refresh(win) if refresh is None else refresh
+        self.frame_period = 1/self.refresh
+        self.digit_frames = self.frames(digit_time)
+        self.mask_frames = self.frames(mask_time)
+        self.last_onset = None
+        self.poll_lead = min(0.002, self.frame_period/4)
+        if use_keyboard:
+            from psychopy.hardware import keyboard
+            self.kb = keyboard.Keyboard()
+        else:
+            from psychopy import core
+            self.kb = None
+            self.clock = core.Clock()
+
+    def frames(self, seconds):
+        # nearest whole number of frames (at least one)
+        return max(1, int(round(seconds*self.refresh)))
+
+    @property
+    def digit_time(self):
+        return self.digit_frames*self.frame_period
+
+    @property
+    def mask_time(self):
+        return self.mask_frames*self.frame_period
+
+    def reset_soa(self):
+        # the next trial does not follow a trial (start of a block, after an instruction screen)
+        self.last_onset = None
+
+    def _clear_keys(self):
+        if self.kb is not None:
+            self.kb.clearEvents()
+            self.win.callOnFlip(self.kb.clock.reset)
+        else:
+            from psychopy import event
+            event.clearEvents()
+            self.win.callOnFlip(self.clock.reset)
+
+    def _log_on_flip(self, msg, trial):
+        if self.events is not None:
+            self.win.callOnFlip(self.events.record, eventlog.EVENT_CODES[msg], trial)
+        else:
+            from psychopy import logging
+            self.win.logOnFlip(level=logging.EXP, msg=msg)
+
+    def _stamp_onset(self, result):
+        result.t_onset = perf_counter()
+
+    def _poll(self, result, trial=-1, stop_on=()):
+        # collect the keys pressed since the last poll; returns True when one of them is in stop_on
+        # (a stop key becomes the response, so the script's quit check sees it)
+        if self.kb is not None:
+            keys = [(k.name, k.rt) for k in self.kb.getKeys(keyList=self.keyList, waitRelease=False)]
+        else:
+            from psychopy import event
+            keys = event.getKeys(keyList=self.keyList, timeStamped=self.clock)
+        stop = False
+        for name, rt in keys:
+            if self.events is not None:
+                self.events.record(eventlog.key_code(name), trial, rt)
+            if not result.keys or (name in stop_on and not stop):
+                result.response = name
+                result.rt = rt
+            result.keys.append((name, rt))
+            stop = stop or name in stop_on
+        return stop
+
+    def _poll_until(self, t_end, result, trial=-1):
+        # wait until t_end (core.getTime seconds), then collect the keys pressed in the meantime
+        from psychopy import core
+        remaining = t_end-core.getTime()
+        if remaining > 0:
+            core.wait(remaining)
+        self._poll(result, trial)
+
+    def run(self, digit_stim, mask_stim, on_digit_flip=None, stop_on=('q',), clear=True, trial=-1, iti=0):
+        # show the digit for digit_frames, the mask for mask_frames, then clear the screen
+        # on_digit_flip(t_onset) is called right after the digit is on screen (e.g. to start a stim train),
+        # with the perf_counter time taken on the digit flip
+        # stop_on: keys that end the trial immediately (the screen is still cleared)
+        # clear: False leaves the mask up for the next trial's digit flip to replace
+        # trial: trial number recorded with the events
+        # iti: seconds after the mask (mask or blank screen) in which keys still count for this trial;
+        # the keys of the last mask frame and the ITI are collected before returning, since the next
+        # run() starts by clearing the keyboard
+        win = self.win
+        result = FrameTrialResult(self.digit_frames, self.frame_period)
+        self._clear_keys()
+        stims = [digit_stim]*self.digit_frames + [mask_stim]*self.mask_frames
+        for frame, stim in enumerate(stims):
+            if frame == 0:
+                self._log_on_flip('digit start', trial)
+                win.callOnFlip(self._stamp_onset, result)
+            elif frame == self.digit_frames:
+                self._log_on_flip('fixation start', trial)
+            stim.draw()
+            result.flips.append(win.flip())
+            if frame == 0:
+                if self.last_onset is not None:
+                    result.soa = result.flips[0]-self.last_onset
+                self.last_onset = result.flips[0]
+                if on_digit_flip is not None:
+                    on_digit_flip(result.t_onset)
+            if self._poll(result, trial, stop_on):
+                self._log_on_flip('digit cleared', trial)
+                result.flips.append(win.flip(clearBuffer=True))
+                return result
+        if clear:
+            self._log_on_flip('digit cleared', trial)
+            result.flips.append(win.flip(clearBuffer=True))
+            self._poll_until(result.flips[-1]+iti, result, trial)
+        else:
+            # stop a little ahead of the next refresh so the next digit flip still makes it
+            result.cleared = False
+            self._poll_until(result.flips[-1]+self.frame_period+iti-self.poll_lead, result, trial)
+        return result
+
+
+def flag_soa(filename, nominal=1150, tolerance=None, refresh=60.0):
+    # trials of a SART data file whose SOA (values.soa, ms) deviates from `nominal` ms by more than
+    # tolerance ms (default: half a frame); returns (summary, flagged rows)
+    if tolerance is None:
+        tolerance = 500/refresh
+    with open(filename, newline='', encoding='utf-8') as f:
+        rows = [r for r in csv.DictReader(f) if r.get('values.soa')]
+    soa = np.array([float(r['values.soa']) for r in rows])
+    dropped = np.array([int(r['values.droppedframes'] or 0) for r in rows])
+    deviation = soa-nominal
+    bad = np.abs(deviation) > tolerance
+    flagged = [(r['blocknum'], r['trialnum'], round(float(s), 3), round(float(d), 3), int(n))
+        for r, s, d, n, b in zip(rows, soa, deviation, dropped, bad) if b]
+    summary = {'ntrials': len(rows), 'nflagged': int(bad.sum()), 'tolerance': tolerance,
+        'mean_soa': float(soa.mean()) if len(soa) else float('nan'),
+        'max_deviation': float(np.abs(deviation).max()) if len(soa) else float('nan'),
+        'dropped_frames': int(dropped.sum())}
+    return summary, flagged
@@ -0,0 +1,168 @@
+##############################################################################################################
+##############################################################################################################
+#   Headless simulated participant ("monkey") sessions
+##############################################################################################################
+##############################################################################################################
+# Inquisit runs a script without a participant in monkey mode (SART.py still has the
+# <monkey> latencydistribution = normal(300, 250) note). run_session does the same for the Python
+# scripts: psychopy is replaced by simpsychopy (no window, virtual clock, key presses from a
+# SyntheticResponder), the DAQ by simdaq without sleeping, and the script runs unchanged in an
+# output folder of its own. The virtual session takes ~18 min; the run takes well under a second.
+#
+#   result = run_session(seed=1, commission_rate=0.3)           # SART_taVNS.py, practice + 4 blocks
+#   result['percent_commissions'], result['meanRT_go'], result['virtual_time'], ...
+#
+#   results = run_sessions(2000, processes=8, seed=1)          # process pool, one result per session
+#   save_results(results, 'monkey_sessions.csv')
+#
+# From the command line (from this folder):
+#   python monkey.py --sessions 2000 --seed 1 --commission-rate 0.3 --out monkey_sessions.csv
+#
+# time.perf_counter is replaced by the virtual clock in the process that runs the sessions (so the
+# stim controller and simdaq timestamps are virtual too); run sessions in their own process, e.g.
+# through run_sessions.
+from __future__ import division
+from collections import OrderedDict
+from contextlib import redirect_stdout
+import csv
+import multiprocessing
+import os
+import random
+import runpy
+import sys
+import tempfile
+import time
+import numpy as np
+
+import simpsychopy
+from simpsychopy import SyntheticResponder, session
+
+SART_TAVNS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SART_Python', 'SART_taVNS.py')
+
+# dialog values for SART_taVNS.py (the subject number sets the AABB/BBAA order)
+DEFAULT_DIALOG = {'group': '0', 'amplitude': 1.0, 'pulse width': 200, 'debug': 0, 'nblocks': 4}
+
+_real_perf_counter = time.perf_counter
+
+
+def install():
+    # make `import psychopy` give simpsychopy, the DAQ simdaq without sleeping, and perf_counter virtual
+    sys.modules['psychopy'] = simpsychopy
+    for name in ('core', 'event', 'gui', 'hardware', 'info', 'logging', 'visual'):
+        sys.modules['psychopy.'+name] = getattr(simpsychopy, name)
+    sys.modules['psychopy.hardware.keyboard'] = simpsychopy.hardware.keyboard
+    os.environ['TAVNS_SIMULATE_DAQ'] = '1'
+    import simdaq
+    simdaq.timing_model.sleep = False
+    time.perf_counter = session.clock.time
+    return simdaq
+
+
+def run_session(script=SART_TAVNS, seed=None, outdir=None, dialog=None, refresh=60.0, drop_rate=0.0, quiet=True,
+    **responder_args):
+    # run one session; returns an OrderedDict with the session settings and its SART summary
+    # outdir: folder for the logs/ the script writes (a temporary folder, removed afterwards, when None)
+    # dialog: values for the start dialog (DEFAULT_DIALOG, subject 'monkey<seed>')
+    # refresh, drop_rate: refresh rate of the simulated screen and the probability of a late flip
+    # responder_args: SyntheticResponder settings (rt_mean, rt_sd, commission_rate, omission_rate, ...)
+    simdaq = install()
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2**32)
+    responder = SyntheticResponder(seed=seed, **responder_args)
+    values = dict(DEFAULT_DIALOG, subject='monkey{}'.format(seed))
+    values.update(dialog or {})
+    session.reset(responder, refresh, values, drop_rate, seed)
+    simdaq.recorder.clear()
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    tmp = tempfile.TemporaryDirectory(prefix='monkey_') if outdir is None else None
+    outdir = tmp.name if tmp is not None else outdir
+    os.makedirs(os.path.join(outdir, 'logs'), exist_ok=True)
+    cwd = os.getcwd()
+    t0 = _real_perf_counter()
+    try:
+        os.chdir(outdir)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull if quiet else sys.stdout):
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except SystemExit:
+                pass
+        result = OrderedDict((('seed', seed), ('subject', values['subject'])))
+        result.update(responder.params())
+        result['real_time'] = _real_perf_counter()-t0
+        result['virtual_time'] = session.clock.t
+        result['nflips'] = session.nflips
+        result['ntrains'] = len(simdaq.recorder.finished())
+        result.update(_read_summary(os.path.join('logs', 'G{}S{}_sart_summary_tvns_expr.csv'.format(
+            values['group'], values['subject']))))
+    finally:
+        os.chdir(cwd)
+        if tmp is not None:
+            tmp.cleanup()
+    return result
+
+
+def _read_summary(filename):
+    # the 'session' row of a summary written by record_summary_data (empty if there is none)
+    if not os.path.exists(filename):
+        return OrderedDict()
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['scope'] == 'session':
+                return OrderedDict((k, v) for k, v in row.items()
+                    if k not in ('subject', 'group', 'date', 'time', 'scope'))
+    return OrderedDict()
+
+
+def _run_one(args):
+    seed, kwargs = args
+    return run_session(seed=seed, **kwargs)
+
+
+def run_sessions(nsessions, processes=None, seed=None, **kwargs):
+    # run nsessions sessions on a process pool; kwargs are passed to run_session
+    # seed: seeds the per-session seeds, so the same call gives the same sessions
+    seeds = np.random.SeedSequence(seed).generate_state(nsessions)
+    jobs = [(int(s), kwargs) for s in seeds]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_run_one, jobs, chunksize=max(1, nsessions//(4*(processes or os.cpu_count() or 1))))
+
+
+def save_results(results, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(results[0].keys())
+        for result in results:
+            writer.writerow(result.values())
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run simulated participant sessions of a SART script.')
+    parser.add_argument('script', nargs='?', default=SART_TAVNS)
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--rt-mean', type=float, default=0.3)
+    parser.add_argument('--rt-sd', type=float, default=0.25)
+    parser.add_argument('--commission-rate', type=float, default=0.4)
+    parser.add_argument('--omission-rate', type=float, default=0.02)
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='probability of a late flip')
+    parser.add_argument('--out', default=None, help='csv with one row per session')
+    args = parser.parse_args()
+
+    kwargs = dict(script=os.path.abspath(args.script), rt_mean=args.rt_mean, rt_sd=args.rt_sd,
+        commission_rate=args.commission_rate, omission_rate=args.omission_rate, drop_rate=args.drop_rate)
+    t0 = _real_perf_counter()
+    if args.sessions == 1:
+        results = [run_session(seed=args.seed, **kwargs)]
+    else:
+        results = run_sessions(args.sessions, args.processes, args.seed, **kwargs)
+    elapsed = _real_perf_counter()-t0
+    for name in ('real_time', 'virtual_time', 'percent_commissions', 'percent_omissions', 'meanRT_go', 'CV_go'):
+        values = np.array([float(r.get(name, 'nan') or 'nan') for r in results])
+        print('{:>20}: mean {:.4f}, sd {:.4f}'.format(name, np.nanmean(values), np.nanstd(values)))
+    print('{} sessions in {:.2f} s'.format(len(results), elapsed))
+    if args.out:
+        save_results(results, args.out)
@@ -0,0 +1,217 @@
+##############################################################################################################
+##############################################################################################################
+#   Precompiled SART trial plans
+##############################################################################################################
+##############################################################################################################
+# The SART blocks drew their trial parameters while running: the digit sequence and the fontsize
+# list were shuffled with random.shuffle in the trial loop and the stimulation sequence was built
+# with a loop over the NoGo trials. compile_sart_plan does all of that before the block starts and
+# returns one NumPy structured array (one row per trial); the trial loop only indexes it. The plan
+# is written next to the data with save_plan, and a block can be rerun exactly from the file
+# (load_plan) or from the seed stored in every row.
+#
+#   plan = compile_sart_plan(blocknum, 225, fontsizes, trial_period=1.15, min_nogo_spacing=2, nogo_free_start=2)
+#   save_plan(plan, 'logs/G1S1_sart_plan_block1.csv')
+#   for row in plan:
+#       trial(row['digit'], row['fontsize'], row['dostim'])
+#
+# The digit sequences come from draw_sequences, which draws a whole batch of constrained sequences
+# as one (nsequences, ntrials) matrix:
+#   - NoGo digits are at least min_nogo_spacing trials apart and none is in the first
+#     nogo_free_start trials (the NoGo positions are drawn directly from the allowed placements,
+#     uniformly, so no candidate has to be rejected; check_sequences tests the same constraints)
+#   - every digit is shown equally often at every fontsize (balance_fontsizes)
+#   - stim windows around NoGo trials are clipped at the block edges (stim_windows)
+# compile_session_plans precomputes the counterbalanced plans of every block for a list of subjects.
+from __future__ import division
+from collections import OrderedDict
+import csv
+import numpy as np
+
+PLAN_DTYPE = np.dtype([
+    ('block', np.int16),
+    ('trial', np.int16),        # trial number within the block, from 1
+    ('digit', np.int8),
+    ('trialtype', 'U4'),        # 'go' or 'nogo'
+    ('fontsize', np.float64),
+    ('dostim', np.int8),        # 1: fire a stim train at the digit onset
+    ('onset', np.float64),      # planned digit onset in seconds from the block start
+    ('seed', np.uint32),        # seed the block was compiled with
+])
+
+
+def new_seed():
+    # a fresh 32 bit seed, drawn so that it can be written down with the plan
+    # (from numpy's global generator, so seeding np.random, as monkey.py does, fixes the plans too)
+    return int(np.random.randint(2**32, dtype=np.uint64))
+
+
+def stim_windows(digits, nogo_digit=3, before=2, after=2, clip=True):
+    # 1 for the trials from `before` trials before to `after` trials after every NoGo digit
+    # digits: one sequence, or a (nsequences, ntrials) matrix
+    # Windows are clipped at the block edges. clip=False gives the trials of the loop this replaced,
+    # which set expr_stimsequence[idx-2:idx+3] = 1: for a NoGo in the first `before` trials the
+    # slice start is negative, so the slice was empty and that NoGo got no stim window.
+    digits = np.asarray(digits)
+    nogo = np.atleast_2d(digits == nogo_digit)
+    if not clip:
+        nogo = nogo.copy()
+        nogo[:, :before] = False
+    n = nogo.shape[1]
+    dostim = np.zeros(nogo.shape, dtype=bool)
+    for shift in range(-min(before, n), min(after, n-1)+1):
+        if shift >= 0:
+            dostim[:, shift:] |= nogo[:, :n-shift]
+        else:
+            dostim[:, :n+shift] |= nogo[:, -shift:]
+    return dostim.astype(np.int8).reshape(digits.shape)
+
+
+def check_sequences(digits, nogo_digit=3, min_nogo_spacing=1, nogo_free_start=0):
+    # True for every sequence (row) that meets the NoGo constraints
+    nogo = np.atleast_2d(np.asarray(digits) == nogo_digit)
+    ok = ~nogo[:, :nogo_free_start].any(axis=1)
+    for gap in range(1, min_nogo_spacing):
+        ok &= ~(nogo[:, :-gap] & nogo[:, gap:]).any(axis=1)
+    return ok
+
+
+def draw_sequences(nsequences, ntrials, rng, nogo_digit=3, min_nogo_spacing=1, nogo_free_start=0):
+    # (nsequences, ntrials) matrix of digit sequences, every digit ntrials/9 times
+    # min_nogo_spacing: smallest distance between two NoGo trials (1: NoGos may follow each other)
+    # nogo_free_start: number of trials at the start without a NoGo
+    per_digit = ntrials//9
+    if per_digit*9 != ntrials:
+        raise ValueError('ntrials ({}) must be a multiple of 9'.format(ntrials))
+    # m NoGo positions with gaps of at least s after the first N trials: m sorted positions out of
+    # the n-N-(m-1)(s-1) free slots, then the i-th one shifted by N+i*(s-1)
+    m, s = per_digit, max(1, min_nogo_spacing)
+    free = ntrials-nogo_free_start-(m-1)*(s-1)
+    if free < m:
+        raise ValueError('{} NoGo trials do not fit in {} trials with spacing {} after trial {}'.format(
+            m, ntrials, s, nogo_free_start))
+    slots = np.sort(np.argsort(rng.random((nsequences, free)), axis=1)[:, :m], axis=1)
+    positions = slots+np.arange(m)*(s-1)+nogo_free_start
+    nogo = np.zeros((nsequences, ntrials), dtype=bool)
+    np.put_along_axis(nogo, positions, True, axis=1)
+
+    # the Go digits, shuffled per sequence, fill the remaining trials in order
+    go = np.repeat([d for d in range(1, 10) if d != nogo_digit], per_digit)
+    go = go[np.argsort(rng.random((nsequences, len(go))), axis=1)]
+    digits = np.full((nsequences, ntrials), nogo_digit, dtype=np.int8)
+    digits[~nogo] = go.ravel()
+    return digits
+
+
+def balance_fontsizes(digits, nfontsizes, rng):
+    # fontsize index for every trial so that each digit is shown equally often at every fontsize
+    # (within one when its count is not a multiple of nfontsizes); digits: sequence or matrix
+    digits = np.asarray(digits)
+    d = np.atleast_2d(digits)
+    nseq, n = d.shape
+    # list the trials digit after digit (each digit's trials in random order) and deal the sizes out
+    # round robin in a per sequence shuffled order: every digit gets every size in turn, and the
+    # left over sizes of one digit continue with the next
+    order = np.lexsort((rng.random(d.shape), d), axis=-1)
+    rank = np.broadcast_to(np.arange(n), d.shape)
+    sizes = np.argsort(rng.random((nseq, nfontsizes)), axis=1)
+    fs = np.empty(d.shape, dtype=np.intp)
+    np.put_along_axis(fs, order, np.take_along_axis(sizes, rank % nfontsizes, axis=1), axis=1)
+    return fs.reshape(digits.shape)
+
+
+def _plans(block, digits, fontsize_index, fontsizes, seed, nogo_digit, trial_period, stim_before, stim_after):
+    # plan rows for a (nsequences, ntrials) digit matrix, shape (nsequences, ntrials)
+    plans = np.zeros(digits.shape, dtype=PLAN_DTYPE)
+    plans['block'] = block
+    plans['trial'] = np.arange(1, digits.shape[1]+1)
+    plans['digit'] = digits
+    plans['trialtype'] = np.where(digits == nogo_digit, 'nogo', 'go')
+    plans['fontsize'] = np.asarray(fontsizes, dtype=float)[fontsize_index]
+    plans['dostim'] = stim_windows(digits, nogo_digit, stim_before, stim_after)
+    plans['onset'] = np.arange(digits.shape[1])*trial_period
+    plans['seed'] = seed
+    return plans
+
+
+def compile_sart_plan(block, ntrials, fontsizes, seed=None, digits=None, nogo_digit=3, trial_period=1.15,
+    stim_before=2, stim_after=2, min_nogo_spacing=1, nogo_free_start=0):
+    # block: block number stored in the plan
+    # ntrials: number of trials (a multiple of 9 when the digits are drawn)
+    # fontsizes: digit heights; every digit is shown equally often at every size
+    # seed: seed for the digit and fontsize order (drawn when None)
+    # digits: fixed digit sequence (e.g. the pre-fixed Robertson et al. list), else every digit
+    #   appears ntrials/9 times in random order, with the NoGo constraints below
+    # trial_period: ITI + digit + mask duration in seconds, for the planned onsets
+    # min_nogo_spacing, nogo_free_start: see draw_sequences
+    if seed is None:
+        seed = new_seed()
+    rng = np.random.default_rng(seed)
+    if digits is None:
+        digits = draw_sequences(1, ntrials, rng, nogo_digit, min_nogo_spacing, nogo_free_start)
+    digits = np.atleast_2d(np.asarray(digits).astype(int)[:ntrials])
+    fontsize_index = balance_fontsizes(digits, len(fontsizes), rng)
+    return _plans(block, digits, fontsize_index, fontsizes, seed, nogo_digit, trial_period, stim_before,
+        stim_after)[0]
+
+
+def subject_number(subject):
+    # the number in a subject id ('S012' -> 12)
+    return int(''.join(filter(str.isdigit, str(subject))))
+
+
+def stim_order(subject, nblocks=4):
+    # counterbalanced active (A) / sham (B) block order: AABB for even subject numbers, BBAA for odd
+    half = nblocks//2
+    order = 'A'*half+'B'*(nblocks-half)
+    return order if subject_number(subject) % 2 == 0 else order[::-1]
+
+
+def compile_session_plans(subjects, nblocks, ntrials, fontsizes, seed=None, nogo_digit=3, trial_period=1.15,
+    stim_before=2, stim_after=2, min_nogo_spacing=1, nogo_free_start=0):
+    # plans of every block for every subject: {subject: (stim order, [plan of block 1, ...])}
+    # All sequences are drawn in one batch from `seed` (stored in every row), so the same subjects
+    # and seed give the same plans again.
+    if seed is None:
+        seed = new_seed()
+    rng = np.random.default_rng(seed)
+    digits = draw_sequences(len(subjects)*nblocks, ntrials, rng, nogo_digit, min_nogo_spacing, nogo_free_start)
+    fontsize_index = balance_fontsizes(digits, len(fontsizes), rng)
+    blocks = np.tile(np.arange(1, nblocks+1), len(subjects))[:, None]
+    plans = _plans(blocks, digits, fontsize_index, fontsizes, seed, nogo_digit, trial_period, stim_before,
+        stim_after).reshape(len(subjects), nblocks, ntrials)
+    return OrderedDict((subject, (stim_order(subject, nblocks), list(subject_plans)))
+        for subject, subject_plans in zip(subjects, plans))
+
+
+def save_plan(plan, filename):
+    # csv with one row per trial (python writes floats with repr, so load_plan gives the same array back)
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(plan.dtype.names)
+        for row in plan:
+            writer.writerow(row.tolist())
+
+
+def load_plan(filename):
+    return np.genfromtxt(filename, delimiter=',', skip_header=1, dtype=PLAN_DTYPE, encoding='utf-8',
+        ndmin=1)
+
+
+if __name__ == '__main__':
+    # self-check: constraints hold on a large batch, and the time to plan a 100 subject study
+    from time import perf_counter
+    fontsizes = [0.1, 0.13, 0.16, 0.19, 0.21]
+    rng = np.random.default_rng(0)
+    digits = draw_sequences(10000, 225, rng, min_nogo_spacing=3, nogo_free_start=2)
+    assert check_sequences(digits, 3, 3, 2).all()
+    assert (np.sort(digits, axis=1) == np.repeat(np.arange(1, 10), 25)).all()
+    counts = np.zeros((len(digits), 10, 5), dtype=int)
+    np.add.at(counts, (np.arange(len(digits))[:, None], digits, balance_fontsizes(digits, 5, rng)), 1)
+    assert (counts[:, 1:] == 5).all()
+    assert (stim_windows([3, 1, 1, 1, 1, 1, 3]) == [1, 1, 1, 0, 1, 1, 1]).all()
+    assert (stim_windows([3, 1, 1, 1, 1, 1, 3], clip=False) == [0, 0, 0, 0, 1, 1, 1]).all()
+    subjects = ['S{:03d}'.format(i) for i in range(1, 101)]
+    t0 = perf_counter()
+    plans = compile_session_plans(subjects, 4, 225, fontsizes, seed=1, min_nogo_spacing=2, nogo_free_start=2)
+    print('{} subjects x 4 blocks planned in {:.1f} ms'.format(len(plans), (perf_counter()-t0)*1e3))
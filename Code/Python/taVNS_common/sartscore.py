@@ -0,0 +1,226 @@
+##############################################################################################################
+##############################################################################################################
+#   SART scoring
+##############################################################################################################
+##############################################################################################################
+# The SART scripts scored trials with ~20 module level globals (the RT1-RT4 shift register,
+# fourfilled, the count_* counters, validgolatencies) and never produced the summary statistics.
+# SARTScorer keeps the same state in one object and updates every running metric in O(1) per
+# trial (the valid Go mean/SD with Welford's algorithm, the last four Go RTs in a 4 slot ring):
+#
+#   score = SARTScorer()
+#   RT, latencytype, responsetype, correct = score.update(trialtype, response, latency)
+#   score.summary()     # nr/percent commissions and omissions, anticipatory count, meanRT_go,
+#                       # stdRT_go, CV_go, meanRT_GObeforesuccessNOGO, meanRT_GObeforefailedNOGO
+#
+# score_trials/score_csv compute the same summary from a saved trial csv in one vectorized pass.
+#
+# Scoring rules (from the Inquisit script):
+#   RT is the latency of a response with the response key, 0 otherwise
+#   Go:   RT == 0 omission; RT < anticipatory (100 ms) anticipatory; RT < valid (200 ms) ambiguous;
+#         otherwise success (a valid Go, used for meanRT_go/stdRT_go/CV_go)
+#   NoGo: RT == 0 success (correct suppression), otherwise failure (commission)
+#   meanRT_GObefore*NOGO: mean RT of the four Go successes right before a NoGo, counted when the
+#         four are consecutive (no omission, anticipatory/ambiguous response or NoGo in between)
+# stdRT_go is the sample standard deviation (n-1).
+from __future__ import division
+from collections import OrderedDict
+import csv
+import numpy as np
+
+
+def classify(trialtype, RT, anticipatory=100, valid=200):
+    # (latencytype, responsetype, correct) for one trial; trialtype 'go'/'nogo' (or 'practice_go'/...)
+    if RT == 0:
+        latencytype = 0
+    elif RT < anticipatory:
+        latencytype = 1
+    elif RT < valid:
+        latencytype = 2
+    else:
+        latencytype = 3
+    if trialtype.endswith('nogo'):
+        responsetype = 'NoGo Success' if RT == 0 else 'NoGo Failure'
+    else:
+        responsetype = ('Omission', 'Go Anticipatory', 'Go Ambiguous', 'Go Success')[latencytype]
+    correct = int(responsetype in ('NoGo Success', 'Go Success'))
+    return latencytype, responsetype, correct
+
+
+class SARTScorer(object):
+
+    __slots__ = ('responsekey', 'anticipatory', 'valid',
+        'count_Go', 'count_NoGo', 'correctsuppressions', 'incorrectsuppressions', 'count_anticipatory',
+        'count_validGo', 'mean_validGo', 'm2_validGo',
+        'last4', 'nrun',
+        'count_4RTs_successsuppression', 'sumRT_successsuppression',
+        'count_4RTs_failedsuppression', 'sumRT_failedsuppression')
+
+    def __init__(self, responsekey='space', anticipatory=100, valid=200):
+        # anticipatory/valid: response time limits in ms (parameters['anticipatoryresponsetime'] etc.)
+        self.responsekey = responsekey
+        self.anticipatory = anticipatory
+        self.valid = valid
+        self.reset()
+
+    def reset(self):
+        self.count_Go = 0
+        self.count_NoGo = 0
+        self.correctsuppressions = 0
+        self.incorrectsuppressions = 0     # omissions
+        self.count_anticipatory = 0
+        self.count_validGo = 0
+        self.mean_validGo = 0.0
+        self.m2_validGo = 0.0
+        self.last4 = [0, 0, 0, 0]          # RTs of the last Go successes, written round robin
+        self.nrun = 0                      # number of consecutive Go successes
+        self.count_4RTs_successsuppression = 0
+        self.sumRT_successsuppression = 0
+        self.count_4RTs_failedsuppression = 0
+        self.sumRT_failedsuppression = 0
+
+    @property
+    def fourfilled(self):
+        return int(self.nrun >= 4)
+
+    def update(self, trialtype, response, latency):
+        # score one trial ('go' or 'nogo'); returns RT, latencytype, responsetype, correct
+        RT = latency if response == self.responsekey else 0
+        latencytype, responsetype, correct = classify(trialtype, RT, self.anticipatory, self.valid)
+        if trialtype == 'nogo':
+            self.count_NoGo += 1
+            if correct:
+                self.correctsuppressions += 1
+            if self.nrun >= 4:
+                if correct:
+                    self.count_4RTs_successsuppression += 1
+                    self.sumRT_successsuppression += sum(self.last4)
+                else:
+                    self.count_4RTs_failedsuppression += 1
+                    self.sumRT_failedsuppression += sum(self.last4)
+            self.nrun = 0
+        else:
+            self.count_Go += 1
+            if latencytype == 0:
+                self.incorrectsuppressions += 1
+            elif latencytype == 1:
+                self.count_anticipatory += 1
+            if latencytype == 3:
+                self.count_validGo += 1
+                delta = RT-self.mean_validGo
+                self.mean_validGo += delta/self.count_validGo
+                self.m2_validGo += delta*(RT-self.mean_validGo)
+                self.last4[self.nrun % 4] = RT
+                self.nrun += 1
+            else:
+                self.nrun = 0
+        return RT, latencytype, responsetype, correct
+
+    # ------------------------------------------------------------------ summary statistics
+
+    @property
+    def nr_commissions(self):
+        return self.count_NoGo-self.correctsuppressions
+
+    @property
+    def nr_omissions(self):
+        return self.incorrectsuppressions
+
+    @property
+    def stdRT_go(self):
+        if self.count_validGo < 2:
+            return float('nan')
+        return (self.m2_validGo/(self.count_validGo-1))**0.5
+
+    def summary(self):
+        return summarize(self.count_Go, self.count_NoGo, self.correctsuppressions, self.incorrectsuppressions,
+            self.count_anticipatory, self.count_validGo,
+            self.mean_validGo if self.count_validGo else float('nan'), self.stdRT_go,
+            self.count_4RTs_successsuppression, self.sumRT_successsuppression,
+            self.count_4RTs_failedsuppression, self.sumRT_failedsuppression)
+
+
+def _ratio(a, b):
+    return a/b if b else float('nan')
+
+
+def summarize(count_Go, count_NoGo, correctsuppressions, incorrectsuppressions, count_anticipatory,
+    count_validGo, meanRT_go, stdRT_go, count_4RTs_success, sumRT_success, count_4RTs_failed, sumRT_failed):
+    # summary columns named as in the Inquisit summary data file
+    nr_commissions = count_NoGo-correctsuppressions
+    return OrderedDict((
+        ('count_Go', int(count_Go)),
+        ('count_NoGo', int(count_NoGo)),
+        ('nr_commissions', int(nr_commissions)),
+        ('percent_commissions', 100*_ratio(nr_commissions, count_NoGo)),
+        ('nr_omissions', int(incorrectsuppressions)),
+        ('percent_omissions', 100*_ratio(incorrectsuppressions, count_Go)),
+        ('count_anticipatory', int(count_anticipatory)),
+        ('count_validGo', int(count_validGo)),
+        ('meanRT_go', float(meanRT_go)),
+        ('stdRT_go', float(stdRT_go)),
+        ('CV_go', _ratio(stdRT_go, meanRT_go)),
+        ('meanRT_GObeforesuccessNOGO', _ratio(sumRT_success, 4*count_4RTs_success)),
+        ('meanRT_GObeforefailedNOGO', _ratio(sumRT_failed, 4*count_4RTs_failed)),
+    ))
+
+
+def score_trials(trialtype, response, latency, responsekey='space', anticipatory=100, valid=200):
+    # vectorized scoring of whole arrays of trials; returns the same summary as SARTScorer.summary()
+    trialtype = np.asarray(trialtype)
+    RT = np.where(np.asarray(response) == responsekey, np.asarray(latency, dtype=float), 0.0)
+    nogo = trialtype == 'nogo'
+    go = ~nogo
+    success = go & (RT >= valid)
+    validRT = RT[success]
+
+    # length of the run of consecutive Go successes that ends at every trial
+    n = len(RT)
+    index = np.arange(n)
+    last_break = np.maximum.accumulate(np.where(success, -1, index))
+    run = index-last_break
+    # NoGo trials preceded by at least four consecutive Go successes, and the sum of those four RTs
+    before = index[nogo]-1
+    has4 = np.zeros(len(before), dtype=bool)
+    has4[before >= 0] = run[before[before >= 0]] >= 4
+    csum = np.concatenate(([0.0], np.cumsum(RT)))
+    sum4 = csum[index[nogo]]-csum[np.maximum(index[nogo]-4, 0)]
+    nogo_success = RT[nogo] == 0
+
+    return summarize(go.sum(), nogo.sum(), np.sum(nogo_success), np.sum(go & (RT == 0)),
+        np.sum(go & (RT > 0) & (RT < anticipatory)), success.sum(),
+        validRT.mean() if validRT.size else float('nan'),
+        validRT.std(ddof=1) if validRT.size > 1 else float('nan'),
+        np.sum(has4 & nogo_success), sum4[has4 & nogo_success].sum(),
+        np.sum(has4 & ~nogo_success), sum4[has4 & ~nogo_success].sum())
+
+
+def score_csv(filename, by=None, responsekey='space', anticipatory=100, valid=200):
+    # score a saved SART trial csv (columns values.trialtype, response, latency)
+    # by: column to group by (e.g. 'blocknum'); returns {value: summary}, or one summary when None
+    with open(filename, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    trialtype = np.array([r['values.trialtype'] for r in rows])
+    response = np.array([r['response'] for r in rows])
+    latency = np.array([float(r['latency'] or 0) for r in rows])
+
+    def score(mask):
+        return score_trials(trialtype[mask], response[mask], latency[mask], responsekey, anticipatory, valid)
+
+    if by is None:
+        return score(np.ones(len(rows), dtype=bool))
+    groups = np.array([r[by] for r in rows])
+    return OrderedDict((value, score(groups == value)) for value in OrderedDict.fromkeys(groups))
+
+
+def write_summary(filename, summaries, extra_columns=()):
+    # summaries: list of (label, summary) rows; extra_columns: (name, value) pairs written on every row
+    names = [name for name, _ in extra_columns]
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        header = None
+        for label, summary in summaries:
+            if header is None:
+                header = names+['scope']+list(summary.keys())
+                writer.writerow(header)
+            writer.writerow([value for _, value in extra_columns]+[label]+list(summary.values()))
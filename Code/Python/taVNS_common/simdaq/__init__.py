@@ -0,0 +1,20 @@
+# simdaq: simulated stand-in for the parts of nidaqmx used by the taVNS scripts
+#
+#   import simdaq as nidaqmx
+#   with nidaqmx.Task() as task:
+#       task.ao_channels.add_ao_voltage_chan("Dev1/ao1")
+#       task.timing.cfg_samp_clk_timing(rate=24000, sample_mode=constants.AcquisitionType.FINITE, samps_per_chan=len(buf))
+#       ...
+#   print(nidaqmx.recorder.summary())
+#
+# Digital output lines reach start trigger terminals through simdaq.connect(line, terminal), the
+# software stand-in for the cable (daq.connect() does this when the backend is simulated).
+#
+# Use taVNS_common/daq.py to switch the scripts between nidaqmx and simdaq.
+from . import constants
+from . import errors
+from . import stream_writers
+from . import system
+from .errors import DaqError
+from .recorder import recorder, Recorder
+from .task import Task, TimingModel, timing_model, connect, disconnect_all
@@ -0,0 +1,37 @@
+# Subset of nidaqmx.constants used by the stimulation scripts (same names and values as nidaqmx)
+from enum import Enum
+
+
+class AcquisitionType(Enum):
+    CONTINUOUS = 10123
+    FINITE = 10178
+    HW_TIMED_SINGLE_POINT = 12522
+
+
+class RegenerationMode(Enum):
+    ALLOW_REGENERATION = 10097
+    DONT_ALLOW_REGENERATION = 10158
+
+
+class TaskMode(Enum):
+    TASK_START = 0
+    TASK_STOP = 1
+    TASK_VERIFY = 2
+    TASK_COMMIT = 3
+    TASK_RESERVE = 4
+    TASK_UNRESERVE = 5
+    TASK_ABORT = 6
+
+
+class Edge(Enum):
+    RISING = 10280
+    FALLING = 10171
+
+
+class LineGrouping(Enum):
+    CHAN_PER_LINE = 0
+    CHAN_FOR_ALL_LINES = 1
+
+
+READ_ALL_AVAILABLE = -1
+WAIT_INFINITELY = -1.0
@@ -0,0 +1,18 @@
+# Mirrors nidaqmx.errors so scripts can catch the same exception type
+
+
+class DaqError(Exception):
+
+    def __init__(self, message, error_code=-200000):
+        super(DaqError, self).__init__(message)
+        self.error_code = error_code
+
+
+class DaqWarning(Warning):
+    pass
+
+
+# error codes the simulator raises
+WAIT_UNTIL_DONE_TIMEOUT = -200560
+TASK_NOT_CONFIGURED = -200462
+NO_DATA_WRITTEN = -200462
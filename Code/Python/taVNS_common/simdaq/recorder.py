@@ -0,0 +1,108 @@
+# Record of everything the simulated tasks put out
+from __future__ import division
+import threading
+import numpy as np
+
+
+class Generation(object):
+    # one start()..stop() run of a task
+
+    def __init__(self, task_name, channels, t_start, rate):
+        self.task_name = task_name
+        self.channels = channels
+        self.t_start = t_start
+        self.rate = rate
+        self.samples = None
+        self.t_stop = None
+
+    @property
+    def nsamples(self):
+        return 0 if self.samples is None else len(self.samples)
+
+    @property
+    def duration(self):
+        return self.nsamples/self.rate
+
+    def timestamps(self):
+        return self.t_start+np.arange(self.nsamples)/self.rate
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.generations = []
+        self.edges = []             # (line, constants.Edge, time) of every digital output edge
+
+    def clear(self):
+        with self._lock:
+            self.generations = []
+            self.edges = []
+
+    def begin(self, task, t_start, rate):
+        gen = Generation(task.name, task.channel_names, t_start, rate)
+        with self._lock:
+            self.generations.append(gen)
+        return gen
+
+    def end(self, gen, samples):
+        gen.samples = samples
+        gen.t_stop = gen.t_start+len(samples)/gen.rate
+
+    def edge(self, line, edge, t):
+        with self._lock:
+            self.edges.append((line, edge, t))
+
+    def edge_times(self, line=None, edge=None):
+        return np.array([t for l, e, t in self.edges if (line is None or l == line) and (edge is None or e == edge)])
+
+    def finished(self, task_name=None):
+        return [g for g in self.generations
+            if g.samples is not None and (task_name is None or g.task_name == task_name)]
+
+    def onsets(self, task_name=None, threshold=0.0):
+        # time of the first sample whose magnitude exceeds threshold, one per generation
+        # (generations that only put out zeros, e.g. sham trains, are skipped)
+        onsets = []
+        for gen in self.finished(task_name):
+            idx = np.flatnonzero(np.abs(gen.samples) > threshold)
+            if len(idx):
+                onsets.append(gen.t_start+idx[0]/gen.rate)
+        return np.array(onsets)
+
+    def emitted(self, task_name=None):
+        # (timestamps, samples) of everything emitted, concatenated over generations
+        gens = self.finished(task_name)
+        if not gens:
+            return np.zeros(0), np.zeros(0)
+        return (np.concatenate([g.timestamps() for g in gens]),
+            np.concatenate([g.samples for g in gens]))
+
+    def summary(self, task_name=None):
+        gens = self.finished(task_name)
+        if not gens:
+            return 'simdaq: no output generated'
+        starts = np.array([g.t_start for g in gens])
+        durations = np.array([g.duration for g in gens])
+        lines = ['simdaq: {} generations, {} samples, {:.3f} s of output'.format(
+            len(gens), sum(g.nsamples for g in gens), durations.sum())]
+        if len(gens) > 1:
+            gaps = np.diff(starts)
+            lines.append('  start-to-start interval: mean {:.4f} s, min {:.4f} s, max {:.4f} s'.format(
+                gaps.mean(), gaps.min(), gaps.max()))
+        lines.append('  train duration: mean {:.4f} s, min {:.4f} s, max {:.4f} s'.format(
+            durations.mean(), durations.min(), durations.max()))
+        return '\n'.join(lines)
+
+    def save(self, filename, task_name=None):
+        # one row per generation: task, start, stop, rate, nsamples, peak amplitude
+        import csv
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('task', 't_start', 't_stop', 'rate', 'nsamples', 'peak'))
+            for g in self.finished(task_name):
+                peak = float(np.max(np.abs(g.samples))) if g.nsamples else 0.0
+                writer.writerow((g.task_name, g.t_start, g.t_stop, g.rate, g.nsamples, peak))
+
+
+recorder = Recorder()
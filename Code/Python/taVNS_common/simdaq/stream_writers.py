@@ -0,0 +1,45 @@
+# nidaqmx.stream_writers stand-ins for the single channel analog and digital writers
+import numpy as np
+
+
+class _Writer(object):
+
+    def __init__(self, task_out_stream, auto_start=False):
+        self._out_stream = task_out_stream
+        self._task = task_out_stream._task
+        self.auto_start = auto_start
+
+    def _maybe_start(self):
+        if self.auto_start and not self._task._running:
+            self._task.start()
+
+
+class AnalogSingleChannelWriter(_Writer):
+
+    def write_many_sample(self, data, timeout=10.0):
+        n = self._task._write(np.asarray(data, dtype=float))
+        self._maybe_start()
+        return n
+
+    def write_one_sample(self, data, timeout=10):
+        return self.write_many_sample(np.array([data], dtype=float), timeout)
+
+
+class AnalogUnscaledWriter(_Writer):
+
+    def write_int16(self, data, reg_start_with_first_channel=False, timeout=10.0):
+        # data: (number of channels, number of samples) int16 codes
+        data = np.asarray(data)
+        if data.dtype != np.int16:
+            raise TypeError('write_int16 expects int16 data, got {}'.format(data.dtype))
+        n = self._task._write_codes(data[0] if data.ndim == 2 else data)
+        self._maybe_start()
+        return n
+
+
+class DigitalSingleChannelWriter(_Writer):
+
+    def write_one_sample_one_line(self, data, timeout=10):
+        n = self._task._write_lines([bool(data)])
+        self._maybe_start()
+        return n
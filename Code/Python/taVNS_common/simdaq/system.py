@@ -0,0 +1,22 @@
+# nidaqmx.system stand-in: one simulated device
+
+
+class Device(object):
+
+    def __init__(self, name, product_type='USB-6211 (simulated)'):
+        self.name = name
+        self.product_type = product_type
+
+    def __repr__(self):
+        return 'Device(name={})'.format(self.name)
+
+
+class System(object):
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.driver_version = 'simdaq'
+
+    @staticmethod
+    def local():
+        return System([Device('Dev1')])
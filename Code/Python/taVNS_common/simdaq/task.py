@@ -0,0 +1,503 @@
+# Simulated nidaqmx.Task for analog (and digital) output
+#
+# Timing model (all times are time.perf_counter seconds):
+#   - write_many_sample / write_int16 block for write_overhead + nbytes/transfer_rate (buffer transfer)
+#   - start() returns after start_overhead (or committed_start_overhead once the task was committed)
+#     and the first sample leaves start_latency after start() returns
+#   - a finite task generates samps_per_chan samples paced by the sample clock, so it is done
+#     samps_per_chan/rate after the first sample; the done event fires at that time (with
+#     sleep=False it fires from start(), the same way wait_until_done returns at once)
+#   - a continuous task regenerates its buffer until stop(), or with DONT_ALLOW_REGENERATION plays
+#     the written samples in order (write blocks while the output buffer is full); once every
+#     written sample has been generated the task has underflowed, which is raised (-200290) by the
+#     next write, total_samp_per_chan_generated read or stop(), as on the device
+#   - with a digital edge start trigger, start() only arms the task; the first sample leaves on the
+#     first sample clock tick after the edge. A retriggerable finite task plays its buffer again on
+#     every edge; edges that arrive while it is still generating are ignored (and counted)
+#   - a digital output write (do_write_overhead) changes its lines at once; edges on a line reach
+#     the trigger terminals it was connected to with connect(line, terminal) (the cable)
+# Every generation is recorded in simdaq.recorder with its start/stop time and the samples emitted,
+# every digital edge in recorder.edges.
+from __future__ import division
+import threading
+import time
+import numpy as np
+
+from . import constants
+from .errors import DaqError, WAIT_UNTIL_DONE_TIMEOUT, TASK_NOT_CONFIGURED
+from .recorder import recorder as default_recorder
+
+
+class TimingModel(object):
+
+    def __init__(self, start_overhead=2e-3, committed_start_overhead=50e-6, start_latency=20e-6,
+        write_overhead=30e-6, transfer_rate=20e6, stop_overhead=100e-6, do_write_overhead=15e-6, sleep=True):
+        self.start_overhead = start_overhead
+        self.committed_start_overhead = committed_start_overhead
+        self.start_latency = start_latency
+        self.write_overhead = write_overhead
+        self.transfer_rate = transfer_rate   # bytes per second from host to device
+        self.stop_overhead = stop_overhead
+        self.do_write_overhead = do_write_overhead
+        self.sleep = sleep                   # False: account for the latencies without sleeping
+
+    def transfer_time(self, nbytes):
+        return self.write_overhead + nbytes/self.transfer_rate
+
+
+timing_model = TimingModel()
+
+
+def _wait(seconds, model):
+    if model.sleep and seconds > 0:
+        time.sleep(seconds)
+
+
+##############################################################################################################
+#   Digital lines and trigger terminals
+##############################################################################################################
+
+_wiring = {}            # digital output line -> trigger terminals it is cabled to
+_armed = {}             # trigger terminal -> tasks waiting for an edge on it
+_wiring_lock = threading.Lock()
+
+
+def _terminal(name):
+    return name.strip().strip('/').lower()
+
+
+def connect(line, terminal):
+    # cable a digital output line (e.g. 'Dev1/port0/line0') to a trigger terminal (e.g. '/Dev1/PFI0')
+    with _wiring_lock:
+        _wiring.setdefault(_terminal(line), set()).add(_terminal(terminal))
+
+
+def disconnect_all():
+    with _wiring_lock:
+        _wiring.clear()
+
+
+def _edge(line, edge, t):
+    with _wiring_lock:
+        tasks = [task for terminal in _wiring.get(_terminal(line), ()) for task in _armed.get(terminal, ())]
+    for task in tasks:
+        task._on_trigger(edge, t)
+
+
+class AOChannel(object):
+
+    def __init__(self, physical_channel, name, min_val, max_val):
+        self.physical_channel = physical_channel
+        self.name = name or physical_channel
+        self.ao_min = min_val
+        self.ao_max = max_val
+        self.ao_resolution = 16.0
+        # ideal bipolar 16 bit DAC over +-10 V, lowest order coefficient first
+        self.ao_dev_scaling_coeff = [0.0, 2**16/20.0]
+
+    def codes_to_volts(self, codes):
+        return (np.asarray(codes, dtype=float)-self.ao_dev_scaling_coeff[0])/self.ao_dev_scaling_coeff[1]
+
+
+class DOChannel(object):
+
+    def __init__(self, lines, name):
+        self.physical_channel = lines
+        self.name = name or lines
+        self.state = False
+
+
+class _ChannelCollection(object):
+
+    def __init__(self, task):
+        self._task = task
+        self._channels = []
+
+    def __getitem__(self, index):
+        return self._channels[index]
+
+    def __len__(self):
+        return len(self._channels)
+
+    def __iter__(self):
+        return iter(self._channels)
+
+
+class AOChannelCollection(_ChannelCollection):
+
+    def add_ao_voltage_chan(self, physical_channel, name_to_assign_to_channel='', min_val=-10.0,
+        max_val=10.0, units=None, custom_scale_name=''):
+        chan = AOChannel(physical_channel, name_to_assign_to_channel, min_val, max_val)
+        self._channels.append(chan)
+        return chan
+
+
+class DOChannelCollection(_ChannelCollection):
+
+    def add_do_chan(self, lines, name_to_assign_to_lines='', line_grouping=None):
+        chan = DOChannel(lines, name_to_assign_to_lines)
+        self._channels.append(chan)
+        return chan
+
+
+class StartTrigger(object):
+
+    def __init__(self, task):
+        self._task = task
+        self.dig_edge_src = None
+        self.dig_edge_edge = constants.Edge.RISING
+        self.retriggerable = False
+
+    def cfg_dig_edge_start_trig(self, trigger_source, trigger_edge=constants.Edge.RISING):
+        self._task._check_not_running()
+        self.dig_edge_src = trigger_source
+        self.dig_edge_edge = trigger_edge
+
+    def disable_start_trig(self):
+        self._task._check_not_running()
+        self.dig_edge_src = None
+        self.retriggerable = False
+
+
+class Triggers(object):
+
+    def __init__(self, task):
+        self.start_trigger = StartTrigger(task)
+
+
+class Timing(object):
+
+    def __init__(self, task):
+        self._task = task
+        self.samp_clk_rate = None
+        self.samp_quant_samp_mode = None
+        self.samp_quant_samp_per_chan = None
+
+    def cfg_samp_clk_timing(self, rate, source='', active_edge=constants.Edge.RISING,
+        sample_mode=constants.AcquisitionType.FINITE, samps_per_chan=1000):
+        self._task._check_not_running()
+        self.samp_clk_rate = float(rate)
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = int(samps_per_chan)
+        self._task.out_stream.output_buf_size = int(samps_per_chan)
+        self._task._committed = False
+
+
+class OutStream(object):
+
+    def __init__(self, task):
+        self._task = task
+        self.regen_mode = constants.RegenerationMode.ALLOW_REGENERATION
+        self.output_buf_size = 0
+        self.auto_start = False
+        self.timeout = 10.0
+
+    @property
+    def total_samp_per_chan_generated(self):
+        now = time.perf_counter()
+        self._task._check_underflow(now)
+        return self._task._samples_generated(now)
+
+    @property
+    def curr_write_pos(self):
+        return self._task._nwritten
+
+    @property
+    def space_avail(self):
+        task = self._task
+        if not task._running:
+            return self.output_buf_size
+        return max(0, self.output_buf_size-(task._nwritten-task._samples_generated(time.perf_counter())))
+
+
+class Task(object):
+
+    def __init__(self, new_task_name='', timing=None, recorder=None):
+        self.name = new_task_name or 'simTask{}'.format(id(self))
+        self.ao_channels = AOChannelCollection(self)
+        self.do_channels = DOChannelCollection(self)
+        self.timing = Timing(self)
+        self.triggers = Triggers(self)
+        self.out_stream = OutStream(self)
+        self.timing_model = timing or timing_model
+        self.recorder = recorder or default_recorder
+        self._lock = threading.RLock()
+        self._buffer = np.zeros(0)
+        self._chunks = []
+        self._nwritten = 0
+        self._running = False
+        self._committed = False
+        self._closed = False
+        self._t_start = None
+        self._t_done = None
+        self._generation = None
+        self._done_callback = None
+        self._done_timer = None
+        self._underflow = False
+        self._armed = False
+        self.ignored_triggers = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return 'Task(name={})'.format(self.name)
+
+    @property
+    def channel_names(self):
+        return [c.name for c in self.ao_channels] + [c.name for c in self.do_channels]
+
+    # ------------------------------------------------------------------ configuration
+
+    def _check_not_running(self):
+        if self._running:
+            raise DaqError('Specified operation cannot be performed while the task is running.', -200479)
+
+    def _rate(self):
+        if self.timing.samp_clk_rate is None:
+            raise DaqError('Sample clock timing has not been configured for {}.'.format(self.name),
+                TASK_NOT_CONFIGURED)
+        return self.timing.samp_clk_rate
+
+    def _finite(self):
+        return self.timing.samp_quant_samp_mode in (None, constants.AcquisitionType.FINITE)
+
+    def _streaming(self):
+        return (not self._finite() and
+            self.out_stream.regen_mode == constants.RegenerationMode.DONT_ALLOW_REGENERATION)
+
+    def control(self, action):
+        if action == constants.TaskMode.TASK_COMMIT:
+            self._rate()
+            self._committed = True
+        elif action in (constants.TaskMode.TASK_UNRESERVE, constants.TaskMode.TASK_ABORT):
+            self.stop()
+            self._committed = False
+
+    def register_done_event(self, callback_method):
+        # callback_method(task_handle, status, callback_data) like nidaqmx; None unregisters
+        self._check_not_running()
+        self._done_callback = callback_method
+
+    # ------------------------------------------------------------------ writing
+
+    def _write(self, volts, nbytes=None):
+        # nbytes: bytes moved to the device (float64 unless the codes were written unscaled)
+        volts = np.array(volts, dtype=float).ravel()
+        _wait(self.timing_model.transfer_time(volts.size*8 if nbytes is None else nbytes), self.timing_model)
+        with self._lock:
+            if self._streaming() and self._running:
+                self._stream_write(volts)
+            elif self._streaming():
+                # filling the output buffer before start
+                self._chunks.append(volts)
+                self._nwritten += volts.size
+            else:
+                # before start (or between finite runs) a write replaces the buffer from position 0
+                self._buffer = volts
+                self._chunks = [volts]
+                self._nwritten = volts.size
+        return volts.size
+
+    def _write_codes(self, codes):
+        codes = np.asarray(codes, dtype=np.int16)
+        return self._write(self.ao_channels[0].codes_to_volts(codes), nbytes=codes.nbytes)
+
+    def _stream_write(self, volts):
+        # non-regenerating continuous output: wait for room in the output buffer
+        rate = self._rate()
+        while True:
+            now = time.perf_counter()
+            self._check_underflow(now)
+            generated = self._samples_generated(now)
+            free = self.out_stream.output_buf_size-(self._nwritten-generated)
+            if free >= volts.size or not self.timing_model.sleep:
+                break
+            time.sleep((volts.size-free)/rate)
+        self._chunks.append(volts)
+        self._nwritten += volts.size
+
+    def _check_underflow(self, now):
+        # a running non-regenerating task that has generated every written sample
+        if self._running and self._streaming() and self._samples_generated(now) >= self._nwritten:
+            self._underflow = True
+        if self._underflow:
+            raise DaqError('The application is not able to keep up with the hardware acquisition.', -200290)
+
+    def _write_lines(self, values):
+        # on demand digital output: one value per line, edges go to the connected trigger terminals
+        values = np.atleast_1d(np.asarray(values, dtype=bool))
+        if len(values) != len(self.do_channels):
+            raise DaqError('{} values written to {} digital lines'.format(len(values), len(self.do_channels)), -200524)
+        _wait(self.timing_model.do_write_overhead, self.timing_model)
+        now = time.perf_counter()
+        for chan, value in zip(self.do_channels, values):
+            if bool(value) != chan.state:
+                chan.state = bool(value)
+                edge = constants.Edge.RISING if chan.state else constants.Edge.FALLING
+                self.recorder.edge(chan.physical_channel, edge, now)
+                _edge(chan.physical_channel, edge, now)
+        return 1
+
+    def write(self, data, auto_start=False, timeout=10.0):
+        if len(self.do_channels) and not len(self.ao_channels):
+            return self._write_lines(data)
+        n = self._write(data)
+        if auto_start and not self._running:
+            self.start()
+        return n
+
+    # ------------------------------------------------------------------ running
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                raise DaqError('The task is already running.', -200479)
+            if len(self.do_channels) and not len(self.ao_channels) and self.timing.samp_clk_rate is None:
+                # on demand digital output: writes go straight to the lines
+                self._running = True
+                return
+            rate = self._rate()
+            if self._nwritten == 0:
+                raise DaqError('No data was written before the task was started.', -200462)
+            model = self.timing_model
+            _wait(model.committed_start_overhead if self._committed else model.start_overhead, model)
+            self._committed = True
+            self._running = True
+            self._underflow = False
+            trigger = self.triggers.start_trigger
+            if trigger.dig_edge_src is not None:
+                # armed: the generation starts on the trigger edge
+                self._armed = True
+                self._triggered = False
+                with _wiring_lock:
+                    _armed.setdefault(_terminal(trigger.dig_edge_src), set()).add(self)
+                return
+            self._t_start = time.perf_counter()+model.start_latency
+            if self._finite():
+                self._t_done = self._t_start+self.timing.samp_quant_samp_per_chan/rate
+            else:
+                self._t_done = None
+            self._generation = self.recorder.begin(self, self._t_start, rate)
+            fire_now = False
+            if self._done_callback is not None and self._t_done is not None:
+                if model.sleep:
+                    self._done_timer = threading.Timer(max(0.0, self._t_done-time.perf_counter()), self._fire_done)
+                    self._done_timer.daemon = True
+                    self._done_timer.start()
+                else:
+                    # without sleeping the train counts as generated right away (as in wait_until_done)
+                    fire_now = True
+        if fire_now:
+            self._fire_done()
+
+    def _on_trigger(self, edge, t):
+        trigger = self.triggers.start_trigger
+        with self._lock:
+            if not self._armed or edge != trigger.dig_edge_edge:
+                return
+            if self._triggered and (not trigger.retriggerable or (self._t_done is not None and t < self._t_done)):
+                # not retriggerable, or still generating the previous train
+                self.ignored_triggers += 1
+                return
+            rate = self._rate()
+            self._end_generation(self._t_done)
+            self._triggered = True
+            # first sample on the next sample clock tick
+            self._t_start = t+1/rate
+            self._t_done = self._t_start+self.timing.samp_quant_samp_per_chan/rate if self._finite() else None
+            self._generation = self.recorder.begin(self, self._t_start, rate)
+
+    def _end_generation(self, now):
+        if self._generation is not None:
+            self.recorder.end(self._generation, self._emitted(self._samples_generated(now)))
+            self._generation = None
+
+    def _fire_done(self):
+        callback = self._done_callback
+        if callback is not None:
+            callback(self.name, 0, None)
+
+    def _samples_generated(self, now):
+        if self._t_start is None:
+            return 0
+        n = int(np.floor((now-self._t_start)*self.timing.samp_clk_rate+1e-6))
+        n = max(0, n)
+        if self._finite():
+            n = min(n, self.timing.samp_quant_samp_per_chan)
+        elif self._streaming():
+            n = min(n, self._nwritten)
+        return n
+
+    def is_task_done(self):
+        if not self._running:
+            return True
+        if self._armed and self.triggers.start_trigger.retriggerable:
+            return False
+        return self._t_done is not None and time.perf_counter() >= self._t_done
+
+    def wait_until_done(self, timeout=10.0):
+        if not self._running:
+            return
+        if self._t_done is None:
+            remaining = np.inf
+        else:
+            remaining = self._t_done-time.perf_counter()
+        if timeout is not None and timeout >= 0 and remaining > timeout:
+            if self.timing_model.sleep:
+                time.sleep(timeout)
+            raise DaqError('Wait Until Done did not indicate all samples were generated within the timeout.',
+                WAIT_UNTIL_DONE_TIMEOUT)
+        if remaining > 0 and self.timing_model.sleep:
+            time.sleep(remaining)
+
+    def stop(self):
+        with self._lock:
+            if not self._running:
+                return
+            _wait(self.timing_model.stop_overhead, self.timing_model)
+            if self._done_timer is not None:
+                self._done_timer.cancel()
+                self._done_timer = None
+            now = time.perf_counter()
+            if not self.timing_model.sleep and self._t_done is not None:
+                # without sleeping, a stopped finite task counts as completed
+                now = max(now, self._t_done)
+            underflow = self._underflow or (self._streaming() and self._samples_generated(now) >= self._nwritten)
+            self._end_generation(now)
+            if self._armed:
+                with _wiring_lock:
+                    _armed.get(_terminal(self.triggers.start_trigger.dig_edge_src), set()).discard(self)
+                self._armed = False
+            self._running = False
+            self._t_start = None
+            self._t_done = None
+            if self._streaming():
+                self._chunks = []
+                self._nwritten = 0
+            self._underflow = False
+        # the task is stopped either way; the device reports the underflow from stop()
+        if underflow:
+            raise DaqError('The application is not able to keep up with the hardware acquisition.', -200290)
+
+    def _emitted(self, n):
+        if self._finite():
+            buf = self._buffer
+            if buf.size < n:
+                buf = np.resize(buf, n)
+            return buf[:n].copy()
+        if self._streaming():
+            return np.concatenate(self._chunks)[:n] if self._chunks else np.zeros(0)
+        # continuous with regeneration: the buffer repeats
+        if self._buffer.size == 0:
+            return np.zeros(0)
+        return np.resize(self._buffer, n)
+
+    def close(self):
+        if self._closed:
+            return
+        self.stop()
+        self._closed = True
@@ -0,0 +1,21 @@
+# simpsychopy: headless stand-in for the parts of psychopy used by the SART scripts
+#
+# Nothing is drawn and nobody presses keys: time is a virtual clock (session.clock) that only moves
+# when the script waits (core.wait, event.waitKeys) or flips the window (to the next refresh), and
+# the key presses come from a synthetic participant (responder.SyntheticResponder) that reacts to
+# every digit the window shows. A full SART session runs as fast as the Python code allows.
+#
+#   session.reset(SyntheticResponder(seed=1), refresh=60.0, dialog={'subject': 'monkey1'})
+#   sys.modules['psychopy'] = simpsychopy ...
+#
+# monkey.py installs the package in place of psychopy, points the DAQ at simdaq and runs the
+# scripts unchanged; use it rather than importing simpsychopy directly.
+from .session import VirtualClock, Session, session
+from .responder import SyntheticResponder
+from . import core
+from . import event
+from . import gui
+from . import hardware
+from . import info
+from . import logging
+from . import visual
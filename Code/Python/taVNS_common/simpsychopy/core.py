@@ -0,0 +1,46 @@
+# psychopy.core stand-in: clocks and waits run on the virtual clock
+from __future__ import division
+import sys
+
+from .session import session
+
+
+def getTime():
+    return session.clock.t
+
+
+class Clock(object):
+
+    def __init__(self):
+        self._t0 = session.clock.t
+
+    def getTime(self):
+        return session.clock.t-self._t0
+
+    def reset(self, newT=0.0):
+        # as psychopy: getTime() counts from -newT
+        self._t0 = session.clock.t+newT
+
+    def add(self, t):
+        self._t0 += t
+
+
+MonotonicClock = Clock
+
+
+class CountdownTimer(Clock):
+
+    def __init__(self, start=0):
+        Clock.__init__(self)
+        self._t0 += start
+
+    def getTime(self):
+        return self._t0-session.clock.t
+
+
+def wait(secs, hogCPUperiod=0.2):
+    session.clock.advance(secs)
+
+
+def quit():
+    sys.exit(0)
@@ -0,0 +1,29 @@
+# psychopy.event stand-in: keys come from the session's synthetic responder
+from __future__ import division
+
+from .session import session
+
+
+def _stamp(t, name, timeStamped):
+    if timeStamped is False:
+        return name
+    if timeStamped is True:
+        return [name, t]
+    return [name, t-(session.clock.t-timeStamped.getTime())]
+
+
+def clearEvents(eventType=None):
+    session.clear_keys()
+
+
+def getKeys(keyList=None, modifiers=False, timeStamped=False):
+    return [_stamp(t, name, timeStamped) for t, name in session.pop_keys(keyList)]
+
+
+def waitKeys(maxWait=float('inf'), keyList=None, modifiers=False, timeStamped=False, clearEvents=True):
+    if clearEvents:
+        session.clear_keys()
+    key = session.wait_for_continue(keyList, maxWait)
+    if key is None:
+        return None
+    return [_stamp(key[0], key[1], timeStamped)]
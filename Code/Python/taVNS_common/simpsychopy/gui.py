@@ -0,0 +1,12 @@
+# psychopy.gui stand-in: dialogs are accepted at once with the session's dialog values
+
+
+class DlgFromDict(object):
+
+    def __init__(self, dictionary, title='', fixed=None, order=None, tip=None, sortKeys=True, copyDict=False,
+        show=True, **kwargs):
+        from .session import session
+        self.dictionary = dict(dictionary) if copyDict else dictionary
+        self.dictionary.update(session.dialog)
+        self.data = list(self.dictionary.values())
+        self.OK = True
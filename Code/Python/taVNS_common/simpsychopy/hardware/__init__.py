@@ -0,0 +1,2 @@
+# psychopy.hardware stand-in
+from . import keyboard
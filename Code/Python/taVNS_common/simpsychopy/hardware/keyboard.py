@@ -0,0 +1,30 @@
+# psychopy.hardware.keyboard stand-in: key times are the exact virtual press times
+from __future__ import division
+
+from ..session import session
+from .. import core
+
+
+class KeyPress(object):
+
+    def __init__(self, name, tDown, rt):
+        self.name = name
+        self.tDown = tDown
+        self.rt = rt
+        self.duration = None
+
+
+class Keyboard(object):
+
+    def __init__(self, device=-1, bufferSize=10000, waitForStart=False, clock=None, backend=None):
+        self.clock = clock or core.Clock()
+
+    def getKeys(self, keyList=None, waitRelease=True, clear=True):
+        keys = session.pop_keys(keyList)
+        if not keys:
+            return keys
+        offset = session.clock.t-self.clock.getTime()
+        return [KeyPress(name, t, t-offset) for t, name in keys]
+
+    def clearEvents(self, eventType=None):
+        session.clear_keys()
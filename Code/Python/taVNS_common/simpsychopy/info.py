@@ -0,0 +1 @@
+# psychopy.info stand-in (imported by the scripts, not used)
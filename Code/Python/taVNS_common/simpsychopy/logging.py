@@ -0,0 +1,58 @@
+# psychopy.logging stand-in: messages are kept in session.messages with their virtual time
+from .session import session
+
+CRITICAL = 50
+ERROR = 40
+WARNING = 30
+DATA = 25
+EXP = 22
+INFO = 20
+DEBUG = 10
+
+
+class LogFile(object):
+    # no file is written; everything logged is in session.messages
+
+    def __init__(self, f=None, level=WARNING, filemode='a', logger=None, encoding='utf8'):
+        self.f = f
+        self.level = level
+
+
+def setDefaultClock(clock):
+    pass
+
+
+def log(msg, level, t=None, obj=None):
+    session.log(level, msg)
+
+
+def flush(logger=None):
+    pass
+
+
+def critical(msg, t=None, obj=None):
+    log(msg, CRITICAL, t, obj)
+
+
+def error(msg, t=None, obj=None):
+    log(msg, ERROR, t, obj)
+
+
+def warning(msg, t=None, obj=None):
+    log(msg, WARNING, t, obj)
+
+
+def data(msg, t=None, obj=None):
+    log(msg, DATA, t, obj)
+
+
+def exp(msg, t=None, obj=None):
+    log(msg, EXP, t, obj)
+
+
+def info(msg, t=None, obj=None):
+    log(msg, INFO, t, obj)
+
+
+def debug(msg, t=None, obj=None):
+    log(msg, DEBUG, t, obj)
@@ -0,0 +1,41 @@
+# Synthetic SART participant
+from __future__ import division
+import numpy as np
+
+
+class SyntheticResponder(object):
+    # Presses `key` after every Go digit, except for a fraction omission_rate of them, and after a
+    # fraction commission_rate of the NoGo digits. Response times are drawn from
+    # normal(rt_mean, rt_sd) seconds, redrawn until above rt_min; the defaults are the Inquisit
+    # monkey's normal(300, 250) ms. Instruction screens are answered with continue_key after
+    # read_time seconds.
+
+    def __init__(self, rt_mean=0.3, rt_sd=0.25, commission_rate=0.4, omission_rate=0.02, rt_min=0.0,
+        read_time=1.0, key='space', continue_key='space', nogo_digit=3, seed=None):
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self.commission_rate = commission_rate
+        self.omission_rate = omission_rate
+        self.rt_min = rt_min
+        self.read_time = read_time
+        self.key = key
+        self.continue_key = continue_key
+        self.nogo_digit = str(nogo_digit)
+        self.rng = np.random.default_rng(seed)
+
+    def params(self):
+        return {'rt_mean': self.rt_mean, 'rt_sd': self.rt_sd, 'commission_rate': self.commission_rate,
+            'omission_rate': self.omission_rate, 'rt_min': self.rt_min}
+
+    def respond(self, digit):
+        # response time (s from the digit onset) to a digit shown as text, or None for no response
+        if digit == self.nogo_digit:
+            respond = self.rng.random() < self.commission_rate
+        else:
+            respond = self.rng.random() >= self.omission_rate
+        if not respond:
+            return None
+        rt = self.rng.normal(self.rt_mean, self.rt_sd)
+        while rt <= self.rt_min:
+            rt = self.rng.normal(self.rt_mean, self.rt_sd)
+        return rt
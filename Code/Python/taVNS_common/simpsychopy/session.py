@@ -0,0 +1,114 @@
+# Virtual clock and the state shared by the simulated psychopy modules
+from __future__ import division
+import math
+import numpy as np
+
+from .responder import SyntheticResponder
+
+
+class VirtualClock(object):
+    # seconds since the session was reset; only moves when advanced
+
+    def __init__(self):
+        self.t = 0.0
+
+    def time(self):
+        return self.t
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.t += seconds
+        return self.t
+
+    def next_frame(self, refresh, skip=0):
+        # time of the next screen refresh (a flip always waits for one), `skip` refreshes later
+        self.t = (math.floor(self.t*refresh+1e-6)+1+skip)/refresh
+        return self.t
+
+
+class Session(object):
+
+    def __init__(self):
+        self.clock = VirtualClock()
+        self.reset()
+
+    def reset(self, responder=None, refresh=60.0, dialog=None, drop_rate=0.0, seed=None):
+        # responder: SyntheticResponder (None: one with the default settings)
+        # refresh: refresh rate of the simulated screen in Hz
+        # dialog: values gui.DlgFromDict fills in (the rest keep the script defaults)
+        # drop_rate: probability that a flip misses its refresh and lands one frame late
+        self.clock.t = 0.0
+        self.responder = SyntheticResponder() if responder is None else responder
+        self.refresh = refresh
+        self.drop_rate = drop_rate
+        self.rng = np.random.default_rng(seed)
+        self.dialog = dict(dialog or {})
+        self.keys = []              # pending key presses (time, name), in time order
+        self.messages = []          # (time, level, message) of everything logged
+        self.nflips = 0
+        self._digit = None          # digit stim on screen after the last flip
+
+    # ------------------------------------------------------------------ keys
+
+    def press(self, name, t):
+        self.keys.append((t, name))
+        self.keys.sort()
+
+    def pop_keys(self, keyList=None):
+        # key presses up to now (removed from the queue); presses not in keyList are discarded
+        now = self.clock.t
+        if not self.keys or self.keys[0][0] > now:
+            return []
+        n = 0
+        while n < len(self.keys) and self.keys[n][0] <= now:
+            n += 1
+        keys, self.keys = self.keys[:n], self.keys[n:]
+        return [(t, name) for t, name in keys if keyList is None or name in keyList]
+
+    def clear_keys(self):
+        self.pop_keys()
+
+    def wait_for_continue(self, keyList=None, maxWait=float('inf')):
+        # an instruction screen: the responder presses its continue key after reading it
+        # returns (time, name) of the press, or None when maxWait ran out first
+        keys = self.pop_keys(keyList)
+        if keys:
+            return keys[0]
+        responder = self.responder
+        if keyList is not None and responder.continue_key not in keyList:
+            if math.isinf(maxWait):
+                raise RuntimeError('the responder never presses any of {}'.format(keyList))
+            self.clock.advance(maxWait)
+            return None
+        if responder.read_time > maxWait:
+            self.clock.advance(maxWait)
+            return None
+        return (self.clock.advance(responder.read_time), responder.continue_key)
+
+    # ------------------------------------------------------------------ screen
+
+    def flip_time(self, refresh):
+        skip = 1 if self.drop_rate and self.rng.random() < self.drop_rate else 0
+        return self.clock.next_frame(refresh, skip)
+
+    def on_flip(self, drawn, t):
+        # a digit that was not on screen before is a new trial for the responder
+        self.nflips += 1
+        digit = None
+        for stim in drawn:
+            text = getattr(stim, 'text', None)
+            if text and text.isdigit():
+                digit = stim
+        if digit is not None and digit is not self._digit:
+            # a response still pending for the previous digit is dropped
+            self.keys = [k for k in self.keys if k[0] <= t]
+            rt = self.responder.respond(digit.text)
+            if rt is not None:
+                self.press(self.responder.key, t+rt)
+        self._digit = digit
+
+    def log(self, level, msg):
+        self.messages.append((self.clock.t, level, msg))
+
+
+session = Session()
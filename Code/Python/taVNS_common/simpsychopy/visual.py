@@ -0,0 +1,68 @@
+# psychopy.visual stand-in: a window that draws nothing and flips on the virtual refresh
+from __future__ import division
+
+from .session import session
+from . import logging
+
+
+class Window(object):
+
+    def __init__(self, size=(800, 600), **kwargs):
+        self.size = size
+        self.__dict__.update(kwargs)
+        self.refresh = session.refresh
+        self._drawn = []
+        self._on_flip = []
+        self._closed = False
+
+    def flip(self, clearBuffer=True):
+        # wait for the next refresh; returns its time like psychopy (core.getTime seconds)
+        t = session.flip_time(self.refresh)
+        for function, args, kwargs in self._on_flip:
+            function(*args, **kwargs)
+        self._on_flip = []
+        session.on_flip(self._drawn, t)
+        if clearBuffer:
+            self._drawn = []
+        return t
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._on_flip.append((function, args, kwargs))
+
+    def logOnFlip(self, msg, level, obj=None):
+        self._on_flip.append((logging.log, (msg, level), {}))
+
+    def clearBuffer(self, color=True, depth=False, stencil=False):
+        self._drawn = []
+
+    def getActualFrameRate(self, nIdentical=10, nMaxFrames=100, nWarmUpFrames=10, threshold=1):
+        return self.refresh
+
+    def close(self):
+        self._closed = True
+
+
+class _Stim(object):
+
+    def __init__(self, win, **kwargs):
+        self.win = win
+        self.autoDraw = False
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        (win or self.win)._drawn.append(self)
+
+
+class TextStim(_Stim):
+
+    def __init__(self, win, text='Hello World', **kwargs):
+        _Stim.__init__(self, win, text=str(text), **kwargs)
+
+    def setText(self, text):
+        self.text = str(text)
+
+
+class ImageStim(_Stim):
+
+    def __init__(self, win, image=None, **kwargs):
+        _Stim.__init__(self, win, image=image, **kwargs)
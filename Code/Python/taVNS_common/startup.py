@@ -0,0 +1,91 @@
+##############################################################################################################
+##############################################################################################################
+#   Script startup: deferred imports and timing breakdown
+##############################################################################################################
+##############################################################################################################
+# The experiment scripts imported psychopy.visual, nidaqmx (and matplotlib) and listed the DAQ
+# devices before the participant dialog appeared. They now import only psychopy.gui before the
+# dialog and hand the DAQ driver import + device discovery to a background thread, so it runs while
+# the operator fills in the form. The window has to be created on the main thread (its OpenGL
+# context belongs to that thread), so it is opened right after the dialog. StartupTimer records how
+# long each step took:
+#
+#   startup = StartupTimer()
+#   from psychopy import core, gui
+#   startup.mark('import psychopy.gui')
+#   daq_discovery = startup.background('DAQ discovery', discover_daq)
+#   dlg = gui.DlgFromDict(expInfo)
+#   startup.mark('dialog')
+#   system, devices = startup.wait('DAQ discovery', daq_discovery)
+#   ...
+#   print(startup.report())
+#
+# startup.t0 is the time the timer was created; the interpreter start before the script's first
+# line is not included.
+from __future__ import division
+from concurrent.futures import Future
+from time import perf_counter
+import threading
+
+
+class StartupTimer(object):
+
+    def __init__(self):
+        self.t0 = perf_counter()
+        self.last = self.t0
+        self.phases = []            # (name, seconds, ran in the background)
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        # time since the previous mark (main thread)
+        now = perf_counter()
+        self._add(name, now-self.last, False)
+        self.last = now
+        return now-self.t0
+
+    def _add(self, name, seconds, background):
+        with self._lock:
+            self.phases.append((name, seconds, background))
+
+    def background(self, name, function, *args, **kwargs):
+        # run function(*args, **kwargs) on a daemon thread; returns a Future for its result
+        future = Future()
+
+        def run():
+            t = perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as err:
+                self._add(name, perf_counter()-t, True)
+                future.set_exception(err)
+            else:
+                self._add(name, perf_counter()-t, True)
+                future.set_result(result)
+
+        threading.Thread(target=run, name=name, daemon=True).start()
+        return future
+
+    def wait(self, name, future):
+        # result of a background step; the time the main thread was held up is its own phase
+        result = future.result()
+        self.mark('waiting for {}'.format(name))
+        return result
+
+    def total(self):
+        return self.last-self.t0
+
+    def report(self):
+        lines = ['startup timing:']
+        with self._lock:
+            phases = list(self.phases)
+        for name, seconds, background in phases:
+            lines.append('  {:<32} {:8.3f} s{}'.format(name, seconds, '  (background)' if background else ''))
+        lines.append('  {:<32} {:8.3f} s'.format('total', self.total()))
+        return '\n'.join(lines)
+
+
+def discover_daq():
+    # import the DAQ driver (nidaqmx, or simdaq, see daq.py) and list the devices
+    import daq
+    system = daq.system.System.local()
+    return system, list(system.devices)
@@ -0,0 +1,358 @@
+##############################################################################################################
+##############################################################################################################
+#   Stim buffer synthesis shared by the Python_taVNS and SART_Python scripts
+##############################################################################################################
+##############################################################################################################
+# The scripts used to build a train by filling a dense 0/1 pulse train in a python loop
+# (constant_rate_pulser) and convolving it with the pulse kernel (scipy.signal.convolve).
+# Because the pulse train only contains ones at the onsets, the same buffer can be built
+# by writing the kernel straight into the output at each onset. pulse_train does that with
+# a single strided write when the pulses do not overlap, and with one vectorized add per
+# kernel sample when they do. The result is bit-identical to the direct convolution.
+#
+# Timing conventions are the same as constant_rate_pulser:
+#   ipis = floor(sr/f), durs = floor(dur*sr), onsets = 0, ipis, 2*ipis, ... < durs-ipis
+# and the buffer is [pad zeros] + [convolution output of length durs+len(wf)-1].
+from __future__ import division
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+
+
+def pulse_onsets(f, dur, sr=24414.0625):
+    # sample index of every pulse in a constant rate train
+    ipis = int(np.floor(sr/f))
+    durs = int(np.floor(dur*sr))
+    return np.arange(0, durs-ipis, ipis)
+
+
+def constant_rate_pulser(f, dur, sr=24414.0625):
+    # same output as the loop version in the scripts (used for plotting the pulse train)
+    pt = np.zeros(int(np.floor(dur*sr)))
+    pt[pulse_onsets(f, dur, sr)] = 1
+    return pt
+
+
+def train_length(nwf, f, dur, sr=24414.0625, pad=0):
+    # length of the buffer returned by pulse_train for a kernel of nwf samples
+    return int(pad) + int(np.floor(dur*sr)) + int(nwf) - 1
+
+
+def pulse_train(wf, f, dur, sr=24414.0625, pad=0, out=None):
+    # place the pulse kernel wf at every onset of a constant rate train
+    # out: optional preallocated float64 array of length train_length(len(wf),f,dur,sr,pad)
+    wf = np.asarray(wf, dtype=float)
+    nwf = len(wf)
+    n = train_length(nwf, f, dur, sr, pad)
+    if out is None:
+        out = np.zeros(n)
+    else:
+        if len(out) != n:
+            raise ValueError('out has {} samples, train needs {}'.format(len(out), n))
+        out[:] = 0
+
+    onsets = pulse_onsets(f, dur, sr)
+    npulse = len(onsets)
+    if npulse == 0 or nwf == 0:
+        return out
+
+    ipis = int(np.floor(sr/f))
+    body = out[int(pad):]
+    if nwf <= ipis:
+        # pulses never overlap: view the train as (npulse, ipis) and broadcast the kernel
+        # into the first nwf columns of every row
+        body[:npulse*ipis].reshape(npulse, ipis)[:, :nwf] = wf
+    else:
+        # overlapping pulses (kernel longer than the inter-pulse interval) have to be summed
+        for k in range(nwf):
+            body[onsets+k] += wf[k]
+    return out
+
+
+
+##############################################################################################################
+#   Pulse shapes
+##############################################################################################################
+# The triangular pulse of taVNS_custom_expr.py, shared so that a threshold measured with triangle
+# pulses (taVNS_MultiStaircase.py) is measured on the same samples the experiment delivers.
+
+def biphasic_triangular_waveform(amp, pw, ipd, sr):
+# %
+# % amp [uA]        +----+
+# % pw  [us]        |    |
+# % ipd [us]        |    |
+# %                 |    |
+# % -------+    +---+    +-------
+# %        |    | \
+# % (amp)--|    |  (ipd)
+# %        |    |
+# %        +----+
+# %           \
+# %            (pw)
+# %
+# % ipd defaults to 0 us
+# % sr defaults 24414.0625 Hz
+
+# duration of a single pulse cycle is 
+# pw*2+ipd
+
+    # set divisor based on sampling rate
+    if sr < 1000:
+        divisor = 1e4
+    elif (sr >=1000) and (sr < 9999):
+        divisor = 1e5
+    elif (sr >= 10000) and (sr < 99999):
+        divisor = 1e6
+    elif sr >= 100000:
+        divisor = 1e7
+    
+    # get pulse width and ipd in samples for a given sampling rate
+    pws = np.ceil(pw*sr/divisor) 
+    ipds = np.ceil(ipd*sr/divisor)
+
+    # generate waveform
+    wf = np.zeros(int(pws*2+ipds))
+    halfwave_length = len(wf[0:int(pws)])
+    # still need to fix this
+    if  pws==2:
+        neg_waveform = np.array([0, -amp])
+        pos_waveform = np.array([amp, 0])       
+    elif pws==1:
+        neg_waveform = np.array([-amp])
+        pos_waveform = np.array([amp])
+    elif halfwave_length%2==0: # if even number of samples, then triangle will not be equal
+        neg_waveform1 = np.linspace(0,-amp,round(pws/2)) # create the first part, going to maximum amplitude
+        neg_waveform2 = np.linspace(neg_waveform1[-2],0,round(pws/2)) # create the second part, based on first
+        neg_waveform = np.concatenate((neg_waveform1,neg_waveform2))
+        pos_waveform1 = np.linspace(0,amp,round(pws/2))
+        pos_waveform2 = np.linspace(pos_waveform1[-2],0,round(pws/2))
+        pos_waveform = np.concatenate((pos_waveform1,pos_waveform2))  
+    else:
+        neg_waveform = np.concatenate([np.linspace(0,-amp, np.ceil(pws/2).astype(int))[0:-1],np.array([-amp]),np.linspace(-amp,0, np.floor(pws/2+1).astype(int))[1:]])
+        pos_waveform = np.concatenate([np.linspace(0,amp, np.ceil(pws/2).astype(int))[0:-1],np.array([amp]),np.linspace(amp,0, np.floor(pws/2+1).astype(int))[1:]])
+
+
+    wf[0:int(pws)] = neg_waveform
+    wf[-int(pws):] = pos_waveform
+    wf = np.append(wf,0) # ensure that last sample is zero
+    return wf
+
+
+##############################################################################################################
+#   Amplitude-separable buffers
+##############################################################################################################
+# The amplitude only enters the buffer as a scalar on the pulse kernel, so a train at any amplitude
+# is the unit-amplitude train times amp. UnitStimBuffer synthesizes the unit train once per timing
+# configuration and rescales it into one reusable output array, so changing the amplitude between
+# trials allocates nothing. For the square pulses the result is identical to MakeStimBuffer at that
+# amplitude (every sample is 0 or +-1 times amp).
+
+class UnitStimBuffer(object):
+
+    def __init__(self, make_buffer, params):
+        # make_buffer: the script's MakeStimBuffer(params), called once with amp = 1
+        unit_params = dict(params)
+        unit_params['amp'] = 1.0
+        self.unit = np.asarray(make_buffer(unit_params), dtype=float)
+        self.unit.setflags(write=False)
+        self.out = np.empty_like(self.unit)
+        self.amp = None
+
+    def __len__(self):
+        return len(self.unit)
+
+    def scale(self, amp):
+        # rescale in place; the returned array is overwritten by the next call
+        if amp != self.amp:
+            np.multiply(self.unit, amp, out=self.out)
+            self.amp = amp
+        return self.out
+
+
+##############################################################################################################
+#   Amplitude-grid buffer bank
+##############################################################################################################
+# A staircase only ever asks for amplitudes on a 0.1 mA grid between 0 and 3 mA. AmplitudeBank
+# builds the train for every grid amplitude at startup from the unit train (quantized to DAC codes
+# when a quantize function is given) and stores them as the rows of one contiguous 2-D array. A
+# trial then only picks a row:
+#
+#   bank = AmplitudeBank(MakeStimBuffer, params, quantize=writer.quantize)   # 31 rows, int16
+#   writer.write_many_sample(bank.get(params['amp']))
+#
+# An amplitude that is not on the grid (e.g. an odd start amplitude) is synthesized into a spare row
+# and counted in bank.misses.
+
+# 0 to 3 mA in 0.1 mA steps
+BANK_AMPLITUDES = np.round(np.arange(0, 3.0+1e-9, 0.1), 2)
+
+
+class AmplitudeBank(object):
+
+    def __init__(self, make_buffer, params, amplitudes=BANK_AMPLITUDES, quantize=None, length=None):
+        # make_buffer: the script's MakeStimBuffer(params), called once with amp = 1
+        # quantize: e.g. Int16Writer.quantize, to keep the rows as int16 DAC codes (float64 volts when None)
+        # length: zero-pad the rows to this many samples (banks of different trains for one task)
+        t0 = perf_counter()
+        self.amplitudes = np.round(np.asarray(amplitudes, dtype=float), 2)
+        self.unit = UnitStimBuffer(make_buffer, params).unit
+        if length is not None:
+            if length < len(self.unit):
+                raise ValueError('train has {} samples, bank rows are {}'.format(len(self.unit), length))
+            self.unit = np.concatenate((self.unit, np.zeros(length-len(self.unit))))
+        self.quantize = quantize
+        # the unit train only takes a few distinct values (0, +-1 for square pulses): scale and quantize
+        # those for every amplitude, then gather the whole bank from that table in one indexing step
+        levels, inverse = np.unique(self.unit, return_inverse=True)
+        table = np.multiply.outer(self.amplitudes, levels)
+        if quantize is not None:
+            table = quantize(table, out=np.empty(table.shape, dtype=np.int16))
+        self.buffers = np.take(table, inverse.ravel(), axis=1)
+        self.buffers.setflags(write=False)
+        self._spare = np.empty(len(self.unit), dtype=self.buffers.dtype)
+        self._spare_amp = None
+        self.hits = 0
+        self.misses = 0
+        self.build_time = perf_counter()-t0
+
+    def __len__(self):
+        return len(self.amplitudes)
+
+    @property
+    def nbytes(self):
+        return self.buffers.nbytes
+
+    def index(self, amp):
+        # row of amp, or -1 when amp is not on the grid
+        i = int(np.searchsorted(self.amplitudes, round(float(amp), 2)))
+        if i < len(self.amplitudes) and abs(self.amplitudes[i]-amp) < 1e-6:
+            return i
+        return -1
+
+    def get(self, amp):
+        # read-only row for amp (the spare row, overwritten by the next off-grid amplitude, otherwise)
+        i = self.index(amp)
+        if i >= 0:
+            self.hits += 1
+            return self.buffers[i]
+        self.misses += 1
+        if amp != self._spare_amp:
+            row = self.unit*amp
+            if self.quantize is None:
+                self._spare[:] = row
+            else:
+                self.quantize(row, out=self._spare)
+            self._spare_amp = amp
+        return self._spare
+
+    def stats(self):
+        return {'rows': len(self), 'nbytes': self.nbytes, 'build_time': self.build_time,
+            'hits': self.hits, 'misses': self.misses}
+
+
+def timing_key(params, digits=9):
+    # stim_key without the amplitude
+    key = stim_key(params, digits)
+    return key[:1] + key[2:]
+
+
+##############################################################################################################
+#   Buffer cache
+##############################################################################################################
+# Staircases and SART blocks ask for the same buffers over and over (the staircase revisits the
+# same amplitude levels, every active SART block uses the same amplitude). StimBufferCache sits in
+# front of a script's MakeStimBuffer and returns the stored buffer when the parameters repeat.
+# Cached buffers are marked read-only so a caller cannot modify a buffer that will be handed out again.
+
+def stim_key(params, digits=9):
+    # normalized (waveshape, amp, freq, pw, ipd, sr, duration) key for a params dict
+    # floats are rounded so that e.g. 0.1+0.2 and 0.3 map to the same buffer
+    if 'duration_test' in params:
+        duration = params['duration_test']
+    elif 'duration_stim' in params:
+        duration = params['duration_stim']
+    else:
+        duration = params['npulse']/params['freq']
+
+    def norm(value):
+        if value is None:
+            return None
+        return round(float(value), digits)
+
+    return (params.get('waveshape', 'square'), norm(params.get('amp')), norm(params.get('freq')),
+        norm(params.get('pw')), norm(params.get('ipd')), norm(params.get('sr')), norm(duration))
+
+
+def _nbytes(buf):
+    if isinstance(buf, UnitStimBuffer):
+        return buf.unit.nbytes + buf.out.nbytes
+    return buf.nbytes
+
+
+class StimBufferCache(object):
+
+    def __init__(self, make_buffer, max_bytes=64*1024*1024):
+        # make_buffer: the script's MakeStimBuffer(params)
+        # max_bytes: least recently used buffers are evicted once the cached buffers exceed this size
+        self.make_buffer = make_buffer
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._buffers = OrderedDict()
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def __contains__(self, params):
+        return stim_key(params) in self._buffers
+
+    def get(self, params):
+        key = stim_key(params)
+        buf = self._buffers.get(key)
+        if buf is not None:
+            self._buffers.move_to_end(key)
+            self.hits += 1
+            return buf
+
+        self.misses += 1
+        buf = np.asarray(self.make_buffer(params))
+        buf.setflags(write=False)
+        self._store(key, buf)
+        return buf
+
+    __call__ = get
+
+    def _store(self, key, buf):
+        if _nbytes(buf) > self.max_bytes:
+            # larger than the whole cache, hand it out without storing it
+            return
+        self._buffers[key] = buf
+        self.nbytes += _nbytes(buf)
+        while self.nbytes > self.max_bytes:
+            _, old = self._buffers.popitem(last=False)
+            self.nbytes -= _nbytes(old)
+            self.evictions += 1
+
+    def unit(self, params):
+        # UnitStimBuffer for the timing configuration in params (amplitude-separable mode)
+        key = ('unit',) + timing_key(params)
+        scaled = self._buffers.get(key)
+        if scaled is not None:
+            self._buffers.move_to_end(key)
+            self.hits += 1
+            return scaled
+
+        self.misses += 1
+        scaled = UnitStimBuffer(self.make_buffer, params)
+        self._store(key, scaled)
+        return scaled
+
+    def clear(self):
+        self._buffers.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'buffers': len(self._buffers), 'nbytes': self.nbytes}
@@ -0,0 +1,209 @@
+##############################################################################################################
+##############################################################################################################
+#   Non-blocking stimulation controller
+##############################################################################################################
+##############################################################################################################
+# The trial loops used to call task.start() and later task.wait_until_done()/task.stop() themselves,
+# so a train that outlasted the trial held up the next digit. StimController owns the DAQ task on a
+# background thread: the trial only posts commands and gets a concurrent.futures.Future back.
+#
+#   stim = StimController(task, writer)
+#   stim.load(buf)              # queued buffer write (between trains / at block start)
+#   future = stim.fire()        # returns immediately
+#   ...
+#   timing = future.result()    # StimTiming with the actual start/stop times (perf_counter seconds)
+#   stim.close()                # finishes the queued work and stops the task
+#
+# Every fire is also added to stim.latency (a stimlatency.LatencyLog) for the end of session
+# latency report, and every load to its separate buffer load count.
+#
+# Commands run in the order they were posted, so a load() posted while a train is playing takes
+# effect after that train has been stopped.
+from __future__ import division
+from concurrent.futures import Future
+from time import perf_counter
+import queue
+import threading
+
+from stimlatency import LatencyLog
+
+
+class StimTiming(object):
+    # timestamps of one train, all perf_counter seconds
+
+    __slots__ = ('t_ref', 't_request', 't_write_start', 't_write_done', 't_start_call', 't_started', 't_done',
+        't_stopped')
+
+    def __init__(self, t_request, t_ref=None):
+        self.t_ref = t_ref              # reference event the train belongs to (e.g. the digit flip)
+        self.t_request = t_request      # fire() was called
+        self.t_write_start = None       # buffer write started (if the buffer was written for this train)
+        self.t_write_done = None        # buffer write returned
+        self.t_start_call = None        # task.start() was called on the worker thread
+        self.t_started = None           # task.start() returned
+        self.t_done = None              # wait_until_done() returned (last sample generated)
+        self.t_stopped = None           # task.stop() returned
+
+    @property
+    def queue_delay(self):
+        return self.t_start_call-self.t_request
+
+    @property
+    def duration(self):
+        return self.t_done-self.t_started
+
+    def __repr__(self):
+        return 'StimTiming(queue_delay={:.4f}, start={:.4f}, duration={:.4f})'.format(
+            self.queue_delay, self.t_started-self.t_start_call, self.duration)
+
+
+class TrainDone(object):
+    # completion of a finite task signalled by the DAQ done event instead of a fixed wait
+    #
+    #   train_done = TrainDone(task)        # registers the done event (task must not be running)
+    #   train_done.start()                  # task.start()
+    #   t_done = train_done.wait(10, poll=keep_screen_up)
+    #   task.stop()
+    #
+    # The driver calls the done event from its own thread the moment the last sample has been
+    # generated; wait() returns then, calling poll() (e.g. draw + flip) in the meantime so the
+    # display keeps running.
+
+    def __init__(self, task):
+        self.task = task
+        self.event = threading.Event()
+        self.t_done = None              # perf_counter time the done event arrived
+        self.status = 0                 # DAQmx status passed to the done event
+        task.register_done_event(self._on_done)
+
+    def _on_done(self, task_handle, status, callback_data):
+        self.t_done = perf_counter()
+        self.status = status
+        self.event.set()
+        return 0
+
+    def start(self):
+        self.event.clear()
+        self.t_done = None
+        self.task.start()
+
+    def is_done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=10.0, poll=None):
+        # block until the done event (poll() is called repeatedly while waiting); returns t_done
+        if poll is None:
+            done = self.event.wait(timeout)
+        else:
+            deadline = perf_counter()+timeout
+            while not self.event.is_set() and perf_counter() < deadline:
+                poll()
+            done = self.event.is_set()
+        if not done:
+            raise RuntimeError('train did not finish within {} s'.format(timeout))
+        if self.status != 0:
+            raise RuntimeError('train finished with DAQ status {}'.format(self.status))
+        return self.t_done
+
+    def close(self):
+        # unregister the done event (before the task is handed to something else)
+        self.task.register_done_event(None)
+
+
+class StimController(object):
+
+    def __init__(self, task, writer, timeout=10.0, latency=None):
+        # task: configured nidaqmx (or simdaq) Task; writer: the writer used for its buffers
+        # timeout: wait_until_done timeout per train; latency: LatencyLog to record into
+        self.task = task
+        self.writer = writer
+        self.timeout = timeout
+        self.latency = LatencyLog() if latency is None else latency
+        self.busy = threading.Event()
+        self._commands = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='StimController', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _post(self, command, *args):
+        if self._closed:
+            raise RuntimeError('StimController is closed')
+        future = Future()
+        self._commands.put((command, args, future))
+        return future
+
+    def load(self, buf):
+        # queue a buffer write; the future resolves to the number of samples written
+        return self._post('load', buf)
+
+    def fire(self, t_ref=None):
+        # queue a train; the future resolves to its StimTiming once the task has been stopped
+        # t_ref: perf_counter time of the event the train belongs to (e.g. the digit flip)
+        return self._post('fire', StimTiming(perf_counter(), t_ref))
+
+    def wait_idle(self, timeout=None):
+        # block until everything posted so far has run
+        return self._post('noop').result(timeout)
+
+    def close(self, timeout=None):
+        # let queued commands finish, then stop the worker (the task is left stopped)
+        if self._closed:
+            return
+        self._commands.put(None)
+        self._closed = True
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._commands.get()
+            if item is None:
+                break
+            command, args, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.busy.set()
+            try:
+                if command == 'load':
+                    result = self._load(args[0])
+                elif command == 'fire':
+                    result = self._fire(args[0])
+                else:
+                    result = None
+            except BaseException as err:
+                future.set_exception(err)
+                self._safe_stop()
+            else:
+                future.set_result(result)
+            finally:
+                self.busy.clear()
+
+    def _load(self, buf):
+        timing = StimTiming(perf_counter())
+        timing.t_write_start = perf_counter()
+        result = self.writer.write_many_sample(buf)
+        timing.t_write_done = perf_counter()
+        self.latency.add_load(timing)
+        return result
+
+    def _fire(self, timing):
+        timing.t_start_call = perf_counter()
+        self.task.start()
+        timing.t_started = perf_counter()
+        self.task.wait_until_done(self.timeout)
+        timing.t_done = perf_counter()
+        self.task.stop()
+        timing.t_stopped = perf_counter()
+        self.latency.add(timing)
+        return timing
+
+    def _safe_stop(self):
+        try:
+            self.task.stop()
+        except Exception:
+            pass
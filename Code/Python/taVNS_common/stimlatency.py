@@ -0,0 +1,155 @@
+##############################################################################################################
+##############################################################################################################
+#   Stim delivery latency log
+##############################################################################################################
+##############################################################################################################
+# Nothing measured how long it takes from the decision to stimulate (e.g. the digit flip) to the
+# first sample leaving the DAQ. Every delivery is recorded as a StimTiming (perf_counter seconds),
+# and LatencyLog keeps the timestamps in a fixed size ring buffer (one float64 row per train, no
+# allocation while the session runs). At the end of the session report() prints, per phase, the
+# percentiles and a text histogram, and save() writes the raw rows:
+#
+#   write   t_write_start -> t_write_done   buffer write to the device
+#   queue   t_request     -> t_start_call   fire() until task.start() is called
+#   start   t_start_call  -> t_started      task.start() until the driver returned (acknowledged)
+#   onset   t_ref         -> t_started      reference event (digit flip) until the train was started
+#   train   t_started     -> t_done         start until wait_until_done() returned
+#   stop    t_done        -> t_stopped      task.stop()
+#
+# With a window (e.g. 0.25 s digit presentation) the report also gives the fraction of trains
+# that started inside it.
+#
+# Buffer writes that are not part of a train (StimController.load, e.g. at the start of a block) go
+# to add_load() instead of add(): they are kept in their own ring buffer and reported as the 'load'
+# phase, so count and the per-train phases only cover trains that were fired.
+from __future__ import division
+import csv
+import numpy as np
+
+FIELDS = ('t_ref', 't_request', 't_write_start', 't_write_done', 't_start_call', 't_started', 't_done',
+    't_stopped')
+
+PHASES = (('write', 't_write_start', 't_write_done'),
+          ('queue', 't_request', 't_start_call'),
+          ('start', 't_start_call', 't_started'),
+          ('onset', 't_ref', 't_started'),
+          ('train', 't_started', 't_done'),
+          ('stop', 't_done', 't_stopped'))
+
+
+class LatencyLog(object):
+
+    def __init__(self, capacity=4096):
+        # capacity: number of trains kept (older ones are overwritten)
+        self.capacity = int(capacity)
+        self._rows = np.full((self.capacity, len(FIELDS)), np.nan)
+        self._loads = np.full((self.capacity, len(FIELDS)), np.nan)
+        self._col = dict((name, i) for i, name in enumerate(FIELDS))
+        self.count = 0
+        self.nloads = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _store(self, rows, n, timing):
+        row = rows[n % self.capacity]
+        for i, name in enumerate(FIELDS):
+            value = getattr(timing, name, None)
+            row[i] = np.nan if value is None else value
+
+    def add(self, timing):
+        # one fired train; timing: StimTiming (missing or None fields are stored as NaN)
+        self._store(self._rows, self.count, timing)
+        self.count += 1
+
+    def add_load(self, timing):
+        # one buffer write outside a train (t_write_start/t_write_done)
+        self._store(self._loads, self.nloads, timing)
+        self.nloads += 1
+
+    def _ordered(self, rows, n):
+        if n <= self.capacity:
+            return rows[:n]
+        i = n % self.capacity
+        return np.concatenate((rows[i:], rows[:i]))
+
+    def rows(self):
+        # recorded trains, oldest first
+        return self._ordered(self._rows, self.count)
+
+    def load_rows(self):
+        # recorded buffer loads, oldest first
+        return self._ordered(self._loads, self.nloads)
+
+    def phase(self, name):
+        # durations (s) of one phase over the recorded trains (or loads), NaN where it was not measured
+        if name == 'load':
+            rows = self.load_rows()
+            return rows[:, self._col['t_write_done']]-rows[:, self._col['t_write_start']]
+        for phase, first, last in PHASES:
+            if phase == name:
+                rows = self.rows()
+                return rows[:, self._col[last]]-rows[:, self._col[first]]
+        raise KeyError(name)
+
+    def phases(self):
+        return [name for name, _, _ in PHASES]+(['load'] if self.nloads else [])
+
+    def percentiles(self, name, q=(50, 90, 99)):
+        values = self.phase(name)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return None
+        return values.size, np.percentile(values, q), values.max()
+
+    def histogram(self, name, nbins=12, width=40):
+        # text histogram with log spaced bins (ms)
+        values = self.phase(name)
+        values = values[np.isfinite(values)]*1e3
+        if values.size == 0:
+            return []
+        lo = max(values.min(), 1e-3)
+        hi = max(values.max(), lo*1.001)
+        counts, edges = np.histogram(np.clip(values, lo, hi), bins=np.geomspace(lo, hi, nbins+1))
+        lines = []
+        for count, left, right in zip(counts, edges[:-1], edges[1:]):
+            bar = '#'*int(np.ceil(width*count/counts.max())) if count else ''
+            lines.append('    {:>9.3f} - {:>9.3f} ms {:>6} {}'.format(left, right, count, bar))
+        return lines
+
+    def report(self, window=None, histograms=True):
+        lines = ['stim latency: {} trains{}'.format(self.count,
+            '' if self.count <= self.capacity else ' (last {} kept)'.format(self.capacity))]
+        if self.nloads:
+            lines[0] += ', {} buffer loads'.format(self.nloads)
+        lines.append('  {:>6} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('phase', 'n', 'p50 (ms)', 'p90', 'p99',
+            'max'))
+        for name in self.phases():
+            result = self.percentiles(name)
+            if result is None:
+                continue
+            n, (p50, p90, p99), vmax = result
+            lines.append('  {:>6} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(name, n, p50*1e3, p90*1e3,
+                p99*1e3, vmax*1e3))
+        if window is not None:
+            onset = self.phase('onset')
+            onset = onset[np.isfinite(onset)]
+            if onset.size:
+                lines.append('  {} of {} trains ({:.1f}%) started within {:.0f} ms of the reference event'.format(
+                    np.sum(onset < window), onset.size, 100*np.mean(onset < window), window*1e3))
+        if histograms:
+            for name in self.phases():
+                hist = self.histogram(name)
+                if hist:
+                    lines.append('  {}:'.format(name))
+                    lines.extend(hist)
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        # one row per train, then one per buffer load ('event' column)
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('event', 'n')+FIELDS)
+            for event, rows in (('train', self.rows()), ('load', self.load_rows())):
+                for i, row in enumerate(rows):
+                    writer.writerow([event, i+1]+['' if np.isnan(v) else repr(float(v)) for v in row])
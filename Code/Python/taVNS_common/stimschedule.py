@@ -0,0 +1,152 @@
+##############################################################################################################
+##############################################################################################################
+#   Whole-session stim schedules streamed to a continuously running DAQ task
+##############################################################################################################
+##############################################################################################################
+# taVNS_custom_expr.py used to start and stop a finite task for every stim period and busy-wait the
+# random ITI in between, so every cycle added software latency and the session drifted. Instead,
+# compile_schedule draws all ITIs up front and turns the session into a sparse schedule (stim onsets
+# in samples + one stim block), and StreamingOutput feeds it to a single continuous task in fixed
+# size chunks. Onsets are then exact to the sample clock and memory stays at a few chunks no matter
+# how long the session is.
+from __future__ import division
+import csv
+import numpy as np
+
+
+class StimSchedule(object):
+
+    def __init__(self, onsets, itis, block, sr, nsamples):
+        self.onsets = onsets        # first sample of every stim period
+        self.itis = itis            # realized inter-trial intervals in seconds (after rounding to samples)
+        self.block = block          # samples of one stim period
+        self.sr = sr
+        self.nsamples = nsamples    # total length of the session in samples
+
+    def __len__(self):
+        return len(self.onsets)
+
+    @property
+    def duration(self):
+        return self.nsamples/self.sr
+
+    def onset_times(self):
+        return self.onsets/self.sr
+
+    def chunk(self, start, out):
+        # write samples [start, start+len(out)) of the session into out
+        n = len(out)
+        out[:] = 0
+        nblock = len(self.block)
+        # stim periods that overlap [start, start+n)
+        first = np.searchsorted(self.onsets+nblock, start, side='right')
+        last = np.searchsorted(self.onsets, start+n, side='left')
+        for onset in self.onsets[first:last]:
+            lo = max(onset, start)
+            hi = min(onset+nblock, start+n)
+            out[lo-start:hi-start] = self.block[lo-onset:hi-onset]
+        return out
+
+    def render(self):
+        # the whole session as one array (only sensible for short sessions / plotting)
+        return self.chunk(0, np.zeros(self.nsamples))
+
+    def save(self, filename):
+        # one row per stim period: onset (s), onset (samples), ITI that followed it (s)
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('trial', 'onset_s', 'onset_sample', 'stim_duration_s', 'iti_s'))
+            for i, onset in enumerate(self.onsets):
+                iti = self.itis[i] if i < len(self.itis) else ''
+                writer.writerow((i+1, onset/self.sr, int(onset), len(self.block)/self.sr, iti))
+
+
+def compile_schedule(duration_expr, iti, duration_stim, train, sr, seed=None):
+    # duration_expr: session length in seconds (no new stim period starts after this)
+    # iti: fixed ITI in seconds, or [low, high] for a uniformly drawn ITI
+    # duration_stim: stim period in seconds; the train is repeated back to back to fill it (at least once)
+    # train: one stim buffer (e.g. from MakeStimBuffer) at sample rate sr
+    # seed: seed for the ITI draws, so a session can be reproduced
+    train = np.asarray(train, dtype=float)
+    sr = float(sr)
+    nrep = max(1, int(np.ceil(duration_stim*sr/len(train))))
+    block = np.tile(train, nrep)
+
+    session = int(np.ceil(duration_expr*sr))
+    period = len(block)
+    # upper bound on the number of stim periods, used to draw all ITIs at once
+    if np.ndim(iti) == 0:
+        lo = hi = float(iti)
+    elif len(iti) == 1:
+        lo = hi = float(iti[0])
+    else:
+        lo, hi = float(iti[0]), float(iti[1])
+    nmax = int(np.ceil(session/(period+int(np.round(lo*sr))))) + 1
+
+    rng = np.random.default_rng(seed)
+    iti_samples = np.round((lo+(hi-lo)*rng.random(nmax))*sr).astype(np.int64)
+    onsets = np.concatenate(([0], np.cumsum(period+iti_samples)))[:nmax]
+    onsets = onsets[onsets < session]
+    itis = iti_samples[:len(onsets)]/sr
+    nsamples = int(onsets[-1]+period) if len(onsets) else 0
+    return StimSchedule(onsets.astype(np.int64), itis, block, sr, nsamples)
+
+
+class StreamingOutput(object):
+    # plays a StimSchedule on one continuous, non-regenerating AO task
+
+    def __init__(self, task, writer, schedule, chunk_size=None, nbuffered=4):
+        # task: nidaqmx/simdaq Task with the AO channel added (timing is configured here)
+        # writer: writer for the task (AnalogSingleChannelWriter or daqcodes.Int16Writer)
+        # chunk_size: samples per write (default 0.25 s); nbuffered: chunks held by the device buffer
+        from daq import constants
+        self.task = task
+        self.writer = writer
+        self.schedule = schedule
+        self.chunk_size = int(chunk_size or round(schedule.sr/4))
+        self.nbuffered = nbuffered
+        self._chunk = np.zeros(self.chunk_size)
+        self.nwritten = 0
+
+        task.timing.cfg_samp_clk_timing(rate=schedule.sr, sample_mode=constants.AcquisitionType.CONTINUOUS,
+            samps_per_chan=self.chunk_size*nbuffered)
+        task.out_stream.regen_mode = constants.RegenerationMode.DONT_ALLOW_REGENERATION
+        task.out_stream.output_buf_size = self.chunk_size*nbuffered
+
+    @property
+    def nchunks(self):
+        # session chunks plus one trailing chunk of zeros so the output ends at 0 V
+        return int(np.ceil(self.schedule.nsamples/self.chunk_size))+1
+
+    def _write_next(self):
+        self.schedule.chunk(self.nwritten, self._chunk)
+        self.writer.write_many_sample(self._chunk)
+        self.nwritten += self.chunk_size
+
+    def run(self, on_chunk=None):
+        # blocks until the whole schedule (up to the trailing chunk of zeros) has been generated
+        # on_chunk(nwritten, ngenerated) is called after every write (e.g. for progress or an abort check)
+        nchunks = self.nchunks
+        for _ in range(min(self.nbuffered, nchunks)):
+            self._write_next()
+        self.task.start()
+        try:
+            for _ in range(nchunks-min(self.nbuffered, nchunks)):
+                # blocks until the device has room for another chunk
+                self._write_next()
+                if on_chunk is not None and on_chunk(self.nwritten, self.generated()) is False:
+                    return False
+            # stop while the trailing chunk of zeros is playing: a non-regenerating buffer that
+            # runs dry is an underflow (-200290), reported by the next property read or by stop()
+            self.wait_generated(self.nwritten-self.chunk_size)
+        finally:
+            self.task.stop()
+        return True
+
+    def generated(self):
+        return self.task.out_stream.total_samp_per_chan_generated
+
+    def wait_generated(self, nsamples, poll=0.01):
+        import time
+        while self.generated() < nsamples:
+            time.sleep(poll)
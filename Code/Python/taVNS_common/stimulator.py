@@ -0,0 +1,130 @@
+##############################################################################################################
+##############################################################################################################
+#   Persistent stimulation session
+##############################################################################################################
+##############################################################################################################
+# singleStimTrain used to import everything, list the devices, create a task, add the channel,
+# configure the clock and tear it all down again for every train, which costs hundreds of ms per
+# call during interactive threshold testing. A Stimulator does the discovery and the channel/clock
+# setup once and keeps the task committed, so fire() only rescales the (cached) unit buffer,
+# writes it and starts the task:
+#
+#   with Stimulator(MakeStimBuffer, {'sr':24000.0, 'pw':200, 'freq':25, 'npulse':15}) as stim:
+#       stim.fire(amp=0.5)
+#       stim.fire(amp=0.6, freq=30)     # any params can be overridden per train
+#
+# The clock is only reconfigured (and the task re-committed) when the buffer length changes, e.g.
+# after a new freq or npulse; amplitude changes reuse the committed task. Leaving the with block
+# (also on an exception or Ctrl-C) stops the task and plays a short buffer of zeros so the output
+# is left at 0 V before the task is closed.
+from __future__ import division
+from time import perf_counter
+import numpy as np
+
+from stimbuffer import StimBufferCache
+from stimcontroller import StimTiming
+from stimlatency import LatencyLog
+
+
+class Stimulator(object):
+
+    def __init__(self, make_buffer, defaults, channel='Dev1/ao1', timeout=10.0, verbose=True):
+        # make_buffer: the script's MakeStimBuffer(params)
+        # defaults: params used when fire() does not override them (must contain sr)
+        # channel: AO channel that drives the stimulator
+        import daq
+        from daq import nidaqmx, constants
+        from daqcodes import Int16Writer
+        self.constants = constants
+        self.defaults = dict(defaults)
+        self.channel = channel
+        self.timeout = timeout
+        self.cache = StimBufferCache(make_buffer)
+        self.latency = LatencyLog()
+        self.nsamples = None
+        self.ntrains = 0
+        self.last = None
+
+        system = nidaqmx.system.System.local()
+        device = channel.split('/')[0]
+        names = [d.name for d in system.devices]
+        if verbose:
+            print('driver {}, devices: {}'.format(system.driver_version, ', '.join(names)))
+        if device not in names:
+            raise RuntimeError('{} not found (devices: {})'.format(device, ', '.join(names)))
+
+        self.task = nidaqmx.Task()
+        try:
+            self.task.ao_channels.add_ao_voltage_chan(channel)
+            self.writer = Int16Writer(self.task)
+        except BaseException:
+            self.task.close()
+            raise
+        self._zeros = np.zeros(16, dtype=np.int16) + self.writer.quantize(np.zeros(1))[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def params(self, **overrides):
+        params = dict(self.defaults)
+        params.update(overrides)
+        if 'npulse' in overrides or 'freq' in overrides or 'duration_test' not in params:
+            params['duration_test'] = params['npulse']/params['freq']
+        return params
+
+    def _configure(self, nsamples):
+        # (re)configure the sample clock for a new buffer length and commit the task
+        if nsamples == self.nsamples:
+            return
+        self.task.timing.cfg_samp_clk_timing(rate=self.defaults['sr'],
+            sample_mode=self.constants.AcquisitionType.FINITE, samps_per_chan=nsamples)
+        self.task.control(self.constants.TaskMode.TASK_COMMIT)
+        self.nsamples = nsamples
+
+    def buffer(self, **overrides):
+        # the float buffer fire() would play (read-only until the next fire)
+        params = self.params(**overrides)
+        return self.cache.unit(params).scale(params['amp'])
+
+    def fire(self, t_ref=None, **overrides):
+        # play one train and block until it is done; returns its StimTiming (also kept in self.latency)
+        timing = StimTiming(perf_counter(), t_ref)
+        buf = self.buffer(**overrides)
+        self._configure(len(buf))
+        timing.t_write_start = perf_counter()
+        self.writer.write_many_sample(buf)
+        timing.t_write_done = perf_counter()
+        self.last = buf
+        timing.t_start_call = perf_counter()
+        try:
+            self.task.start()
+            timing.t_started = perf_counter()
+            self.task.wait_until_done(self.timeout)
+            timing.t_done = perf_counter()
+        finally:
+            self.task.stop()
+        timing.t_stopped = perf_counter()
+        self.latency.add(timing)
+        self.ntrains += 1
+        return timing
+
+    def zero(self):
+        # stop whatever is playing and drive the output to 0 V
+        self.task.stop()
+        self._configure(len(self._zeros))
+        self.writer.write_codes(self._zeros)
+        self.task.start()
+        self.task.wait_until_done(self.timeout)
+        self.task.stop()
+
+    def close(self):
+        if self.task is None:
+            return
+        try:
+            self.zero()
+        finally:
+            self.task.close()
+            self.task = None
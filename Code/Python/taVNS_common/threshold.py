@@ -0,0 +1,274 @@
+##############################################################################################################
+##############################################################################################################
+#   Adaptive perception threshold engines
+##############################################################################################################
+##############################################################################################################
+# taVNS_Staircase.py stepped the amplitude by hand: +0.2 mA before the first percept, +0.1 mA after,
+# -0.3 mA on every percept, stop after 8 percepts, threshold = mean of the amplitudes after the
+# second one. That rule is kept as UpDownStaircase. PsiThreshold (psi method, Kontsevich & Tyler
+# 1999) keeps a posterior over the psychometric function instead and picks the amplitude whose
+# answer is expected to shrink the uncertainty about the threshold the most; it stops once the
+# posterior SD of the threshold is below stop_sd. Both have the same interface, so the trial loop
+# does not change with the engine:
+#
+#   engine = PsiThreshold(start=0.1, target=0.25)       # or UpDownStaircase(start=0.1)
+#   while not engine.done:
+#       amp = engine.next()
+#       ...deliver a train at amp, ask the participant...
+#       engine.update(amp, response == '2')
+#   engine.estimate(), engine.sd()
+#
+# The psychometric function is a logistic in mA with a fixed false alarm (guess) and lapse rate:
+#   P(felt | x) = guess + (1-guess-lapse) / (1+exp(-slope*(x-threshold) - logit(F_target)))
+# parametrized so that `threshold` is the amplitude at which P(felt) = target. The posterior is one
+# (threshold x slope) array and the likelihoods of every candidate amplitude are precomputed, so
+# choosing the next amplitude is a handful of array operations (under a millisecond).
+# benchmark_threshold.py compares the two engines on a simulated observer (simulate()).
+from __future__ import division
+import numpy as np
+
+# amplitudes the engines may ask for (mA), the range the staircase could reach
+AMPLITUDES = np.round(np.arange(0.1, 3.0+1e-9, 0.1), 2)
+
+
+def _logit(p):
+    return np.log(p/(1-p))
+
+
+class UpDownStaircase(object):
+    # the original taVNS_Staircase.py rule ('reversals' are percepts, as in the script)
+
+    def __init__(self, start=0.1, up_first=0.2, up=0.1, down=0.3, nreversals=8, low=0.0, high=3.0):
+        self.amp = np.round(start, 2)
+        self.up_first = up_first
+        self.up = up
+        self.down = down
+        self.nreversals = nreversals
+        self.low = low
+        self.high = high
+        self.reversals = 0
+        self.ampvec = []
+        self.runningmean = 0
+        self.history = []           # (amplitude, detected)
+
+    @property
+    def ntrials(self):
+        return len(self.history)
+
+    @property
+    def done(self):
+        return (self.reversals >= self.nreversals) or not (self.low < self.amp < self.high)
+
+    def next(self):
+        return self.amp
+
+    def update(self, amp, detected):
+        self.history.append((amp, bool(detected)))
+        if detected:
+            self.reversals += 1
+            self.amp = self.amp-self.down
+        elif self.reversals == 0:
+            self.amp = self.amp+self.up_first
+        else:
+            self.amp = self.amp+self.up
+        self.amp = np.round(self.amp, 2)
+        if self.reversals == 1:
+            self.ampvec.append(self.amp)
+            self.runningmean = 0
+        elif self.reversals > 2:
+            self.ampvec.append(self.amp)
+            self.runningmean = np.mean(self.ampvec)
+        else:
+            self.runningmean = 0
+        if self.amp > self.high:
+            self.amp = self.high
+        elif self.amp < 0.1:
+            self.amp = self.low
+
+    def estimate(self):
+        return self.runningmean
+
+    def sd(self):
+        return np.nan
+
+
+class PsiThreshold(object):
+
+    def __init__(self, start=0.1, target=0.25, amplitudes=AMPLITUDES, thresholds=None, slopes=None,
+        guess=0.02, lapse=0.02, stop_sd=0.2, min_trials=8, max_trials=40, max_step_up=0.5):
+        # start: first amplitude (mA); target: P(felt) the threshold is defined at
+        # amplitudes: candidate amplitudes; thresholds, slopes (1/mA): the posterior grid
+        # guess, lapse: false alarm and lapse rate of the participant
+        # stop_sd: stop when the posterior SD of the threshold is below this (mA)
+        # max_step_up: never go more than this above the highest amplitude given so far (None: no limit)
+        self.start = np.round(start, 2)
+        self.target = target
+        self.amplitudes = np.asarray(amplitudes, dtype=float)
+        self.thresholds = np.arange(0.0, 3.5+1e-9, 0.02) if thresholds is None else np.asarray(thresholds, float)
+        self.slopes = np.geomspace(1, 30, 15) if slopes is None else np.asarray(slopes, float)
+        self.guess = guess
+        self.lapse = lapse
+        self.stop_sd = stop_sd
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+        self.max_step_up = max_step_up
+        self.history = []
+
+        # uniform prior over threshold and log slope
+        self.posterior = np.full((len(self.thresholds), len(self.slopes)), 1/(len(self.thresholds)*len(self.slopes)))
+        # P(felt | amplitude, threshold, slope) for every candidate amplitude: (amplitudes, thresholds, slopes)
+        self.likelihood = self.psychometric(self.amplitudes[:, None, None], self.thresholds[None, :, None],
+            self.slopes[None, None, :])
+
+    def psychometric(self, x, threshold, slope):
+        c = _logit((self.target-self.guess)/(1-self.guess-self.lapse))
+        return self.guess+(1-self.guess-self.lapse)/(1+np.exp(-slope*(x-threshold)-c))
+
+    @property
+    def ntrials(self):
+        return len(self.history)
+
+    @property
+    def done(self):
+        if self.ntrials >= self.max_trials:
+            return True
+        return self.ntrials >= self.min_trials and self.sd() < self.stop_sd
+
+    def _allowed(self):
+        if self.max_step_up is None:
+            return np.ones(len(self.amplitudes), dtype=bool)
+        highest = max([self.start]+[amp for amp, _ in self.history])
+        return self.amplitudes <= highest+self.max_step_up+1e-9
+
+    def expected_entropy(self):
+        # expected entropy of the threshold marginal after a trial at each candidate amplitude
+        joint = self.likelihood*self.posterior                         # P(felt, threshold, slope | x)
+        pyes = joint.sum(axis=(1, 2))
+        yes = joint.sum(axis=2)/pyes[:, None]
+        no = (self.posterior.sum(axis=1)[None, :]-joint.sum(axis=2))/(1-pyes)[:, None]
+        return pyes*_entropy(yes)+(1-pyes)*_entropy(no)
+
+    def next(self):
+        if not self.history:
+            return self.start
+        h = np.where(self._allowed(), self.expected_entropy(), np.inf)
+        return float(self.amplitudes[np.argmin(h)])
+
+    def update(self, amp, detected):
+        self.history.append((amp, bool(detected)))
+        i = np.flatnonzero(np.isclose(self.amplitudes, amp))
+        if len(i):
+            p = self.likelihood[i[0]]
+        else:
+            p = self.psychometric(amp, self.thresholds[:, None], self.slopes[None, :])
+        self.posterior *= p if detected else 1-p
+        self.posterior /= self.posterior.sum()
+
+    def marginal(self):
+        return self.posterior.sum(axis=1)
+
+    def estimate(self):
+        # posterior mean of the threshold (mA)
+        return float(np.dot(self.marginal(), self.thresholds))
+
+    def sd(self):
+        m = self.marginal()
+        mean = np.dot(m, self.thresholds)
+        return float(np.sqrt(np.dot(m, (self.thresholds-mean)**2)))
+
+
+def _entropy(p):
+    # entropy of each row of p
+    logp = np.log(np.where(p > 0, p, 1))
+    return -(p*logp).sum(axis=-1)
+
+
+class InterleavedStaircases(object):
+    # several independent engines (e.g. one per pulse width or waveshape) run in one session; every
+    # trial goes to a randomly chosen engine that has not stopped yet (as multiRandomStaircase.m)
+    #
+    #   stairs = InterleavedStaircases(OrderedDict((pw, PsiThreshold(start=0.1)) for pw in (200, 300, 500)))
+    #   while not stairs.done:
+    #       key, amp = stairs.next()
+    #       ...
+    #       stairs.update(key, amp, response == '2')
+
+    def __init__(self, engines, seed=None):
+        # engines: dict name -> engine (UpDownStaircase / PsiThreshold)
+        self.engines = engines
+        self.rng = np.random.default_rng(seed)
+        self.history = []           # (name, amplitude, detected)
+
+    def __getitem__(self, key):
+        return self.engines[key]
+
+    def active(self):
+        return [key for key, engine in self.engines.items() if not engine.done]
+
+    @property
+    def done(self):
+        return not self.active()
+
+    @property
+    def ntrials(self):
+        return len(self.history)
+
+    def next(self):
+        active = self.active()
+        key = active[self.rng.integers(len(active))]
+        return key, self.engines[key].next()
+
+    def update(self, key, amp, detected):
+        self.history.append((key, amp, bool(detected)))
+        self.engines[key].update(amp, detected)
+
+
+class SimulatedObserver(object):
+    # a participant with a logistic psychometric function (threshold at P(felt) = 0.5 of the
+    # non-guess part), for benchmarking the engines
+
+    def __init__(self, threshold, slope, guess=0.02, lapse=0.02, rng=None):
+        self.threshold = threshold
+        self.slope = slope
+        self.guess = guess
+        self.lapse = lapse
+        self.rng = np.random.default_rng(rng)
+
+    def p_felt(self, x):
+        return self.guess+(1-self.guess-self.lapse)/(1+np.exp(-self.slope*(x-self.threshold)))
+
+    def amplitude_at(self, p):
+        # amplitude at which P(felt) = p
+        return self.threshold+_logit((p-self.guess)/(1-self.guess-self.lapse))/self.slope
+
+    def respond(self, x):
+        return self.rng.random() < self.p_felt(x)
+
+
+def simulate(engine, observer):
+    # run engine against observer to its stopping rule; returns (estimate, number of trials)
+    while not engine.done:
+        amp = engine.next()
+        engine.update(amp, observer.respond(amp))
+    return engine.estimate(), engine.ntrials
+
+
+if __name__ == '__main__':
+    # self-check: both engines stop, the psi estimate lands near the simulated threshold
+    observer = SimulatedObserver(1.2, 6, rng=1)
+    for engine in (UpDownStaircase(start=0.1), PsiThreshold(start=0.1, target=0.25)):
+        estimate, ntrials = simulate(engine, observer)
+        print('{:>16}: estimate {:.2f} mA (sd {:.3f}) after {} trials, true 25% point {:.2f} mA'.format(
+            type(engine).__name__, estimate, engine.sd(), ntrials, observer.amplitude_at(0.25)))
+
+    # interleaved: one observer per staircase
+    from collections import OrderedDict
+    observers = OrderedDict((pw, SimulatedObserver(t, 6, rng=pw)) for pw, t in ((200, 1.4), (300, 1.0), (500, 0.7)))
+    stairs = InterleavedStaircases(OrderedDict((pw, PsiThreshold(start=0.1)) for pw in observers), seed=1)
+    while not stairs.done:
+        key, amp = stairs.next()
+        stairs.update(key, amp, observers[key].respond(amp))
+    for key, observer in observers.items():
+        print('{:>16}: estimate {:.2f} mA after {} trials, true 25% point {:.2f} mA'.format(
+            'pw {}'.format(key), stairs[key].estimate(), stairs[key].ntrials, observer.amplitude_at(0.25)))
+    print('{} interleaved trials'.format(stairs.ntrials))
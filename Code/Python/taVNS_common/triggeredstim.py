@@ -0,0 +1,129 @@
+##############################################################################################################
+##############################################################################################################
+#   Hardware-triggered stimulation
+##############################################################################################################
+##############################################################################################################
+# StimController starts every train with task.start() on its worker thread, so the onset also
+# depends on when the OS schedules that thread and on the driver's start latency. TriggeredStim
+# takes those out of the path: the analog output task is configured with a retriggerable digital
+# edge start trigger, the block's buffer is written and the task armed once per block, and a trial
+# only pulses a digital output line that is cabled to the trigger terminal:
+#
+#   Dev1/port0/line0 (DO) ---- cable ----> /Dev1/PFI0 (AO start trigger)
+#
+#   daq.connect('Dev1/port0/line0', '/Dev1/PFI0')    # the cable (simdaq only, no-op on hardware)
+#   stim = TriggeredStim(task, writer, trigger_task, '/Dev1/PFI0')
+#   stim.load(buf)                  # stop, write the block's buffer, re-arm
+#   future = stim.fire(t_ref)       # DO edge: the train starts on the next sample clock tick
+#   stim.close()
+#
+# It has the load/fire/close/latency interface of StimController, so the trial code does not change.
+# fire() is called on the thread that flipped the window and returns a resolved future.
+#
+# The trigger edge is still software-timed: fire() writes the DO line once win.flip() has returned
+# and the on_digit_flip callback runs, so the onset keeps the jitter between the flip and that
+# callback. What is removed is the worker thread hand-off and the task.start() call. A flip-locked
+# onset needs a hardware source on the trigger terminal instead (e.g. a photodiode on the digit),
+# which would also fire on the trials without stim, so it is not used here.
+#
+# The train runs on the device with no done event per trigger, so the StimTiming of a train has
+# t_started (the edge) but no t_done/t_stopped; only load() and close() wait for the predicted end
+# (edge + buffer duration). An edge that arrives while the previous train is still playing is
+# ignored by the device; keep the trial period longer than the train.
+#
+# Without hardware, run with TAVNS_SIMULATE_DAQ=1: simdaq implements the trigger, the digital
+# output task and the cable, and records every edge (simdaq.recorder.edges) next to the trains.
+from __future__ import division
+from concurrent.futures import Future
+from time import perf_counter
+import time
+
+from stimcontroller import StimTiming
+from stimlatency import LatencyLog
+
+
+class TriggeredStim(object):
+
+    def __init__(self, task, writer, trigger_task, trigger_source, edge=None, latency=None):
+        # task: configured finite AO task (not running); writer: the writer used for its buffers
+        # trigger_task: task with one digital output line (cabled to trigger_source), started here
+        # trigger_source: start trigger terminal of the AO task, e.g. '/Dev1/PFI0'
+        # edge: constants.Edge of the trigger (rising by default)
+        from daq import constants, DigitalSingleChannelWriter
+        self.task = task
+        self.writer = writer
+        self.trigger_task = trigger_task
+        self.latency = LatencyLog() if latency is None else latency
+        self.edge = constants.Edge.RISING if edge is None else edge
+        self.train_time = task.timing.samp_quant_samp_per_chan/task.timing.samp_clk_rate
+        self._active = self.edge == constants.Edge.RISING
+        self._t_end = 0.0
+        self._armed = False
+        self._closed = False
+
+        task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source, trigger_edge=self.edge)
+        task.triggers.start_trigger.retriggerable = True
+        trigger_task.start()
+        self.line = DigitalSingleChannelWriter(trigger_task.out_stream)
+        self.line.write_one_sample_one_line(not self._active)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _resolved(self, result):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        future.set_result(result)
+        return future
+
+    def _wait_train(self):
+        # let the last triggered train finish before the task is stopped
+        remaining = self._t_end-perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def load(self, buf):
+        # write the block's buffer and arm the task; the future resolves to the samples written
+        if self._closed:
+            raise RuntimeError('TriggeredStim is closed')
+        self._wait_train()
+        if self._armed:
+            self.task.stop()
+        timing = StimTiming(perf_counter())
+        timing.t_write_start = perf_counter()
+        result = self.writer.write_many_sample(buf)
+        timing.t_write_done = perf_counter()
+        self.task.start()
+        self._armed = True
+        self.latency.add_load(timing)
+        return self._resolved(result)
+
+    def fire(self, t_ref=None):
+        # pulse the trigger line; the future resolves to the StimTiming of the train (t_done and
+        # t_stopped stay None: the end of a triggered train is not measured)
+        if not self._armed:
+            raise RuntimeError('TriggeredStim.fire() before load()')
+        timing = StimTiming(perf_counter(), t_ref)
+        timing.t_start_call = perf_counter()
+        self.line.write_one_sample_one_line(self._active)
+        timing.t_started = perf_counter()
+        self.line.write_one_sample_one_line(not self._active)
+        self._t_end = timing.t_started+self.train_time
+        self.latency.add(timing)
+        return self._resolved(timing)
+
+    def wait_idle(self, timeout=None):
+        self._wait_train()
+
+    def close(self, timeout=None):
+        # finish the last train, stop the task and leave the trigger line idle
+        if self._closed:
+            return
+        self._closed = True
+        self._wait_train()
+        if self._armed:
+            self.task.stop()
+            self._armed = False